@@ -0,0 +1,116 @@
+"""
+Write synthetic BloFin futures order-history exports for benchmarking.
+
+    python -m benchmarks.generate_blofin_csv --rows 100000 --output trades.csv
+"""
+from datetime import datetime, timedelta
+import argparse
+import numpy as np
+import pandas as pd
+
+COLUMNS = [
+    'Underlying Asset', 'Margin Mode', 'Leverage', 'Order Time', 'Side',
+    'Avg Fill', 'Price', 'Filled', 'Total', 'PNL', 'PNL%', 'Fee',
+    'Order Options', 'Reduce-only', 'Status',
+]
+
+# Asset, weight, starting price
+DEFAULT_ASSET_MIX = [
+    ('BTCUSDT', 0.30, 64000.0),
+    ('ETHUSDT', 0.20, 3100.0),
+    ('SOLUSDT', 0.12, 145.0),
+    ('ARBUSDT', 0.06, 1.05),
+    ('INJUSDT', 0.05, 24.0),
+    ('WIFUSDT', 0.05, 2.4),
+    ('NEARUSDT', 0.05, 6.1),
+    ('RUNEUSDT', 0.04, 5.2),
+    ('LDOUSDT', 0.03, 1.9),
+    ('SEIUSDT', 0.03, 0.55),
+    ('MATICUSDT', 0.03, 0.7),
+    ('VRAUSDT', 0.02, 0.0041),
+    # Not in the ingest allowlist, so these rows are skipped
+    ('DOGEUSDT', 0.02, 0.15),
+]
+
+
+def generate_frame(rows, duplicate_ratio=0.0, canceled_ratio=0.05,
+                   asset_mix=DEFAULT_ASSET_MIX, seed=0,
+                   end_time=datetime(2024, 10, 1)):
+    """
+    Build a DataFrame shaped like a BloFin export, newest order first.
+
+    :param duplicate_ratio: Share of rows that repeat an earlier row verbatim.
+    :param canceled_ratio: Share of rows with Status 'Canceled'.
+    :param asset_mix: (asset, weight, starting price) triples.
+    """
+    rng = np.random.default_rng(seed)
+    duplicates = int(rows * duplicate_ratio)
+    unique_rows = rows - duplicates
+
+    assets = np.array([asset for asset, _, _ in asset_mix])
+    weights = np.array([weight for _, weight, _ in asset_mix], dtype=float)
+    start_prices = np.array([price for _, _, price in asset_mix])
+    asset_index = rng.choice(len(assets), size=unique_rows, p=weights / weights.sum())
+
+    # A random walk per asset keeps fills in a believable range
+    drift = np.exp(np.cumsum(rng.normal(0, 0.002, size=unique_rows)))
+    avg_fill = start_prices[asset_index] * drift * rng.uniform(0.98, 1.02, size=unique_rows)
+    notional = rng.lognormal(mean=6, sigma=1, size=unique_rows)
+    filled = notional / avg_fill
+
+    seconds = rng.integers(60, 90, size=unique_rows).cumsum()
+    order_times = pd.to_datetime(end_time) - pd.to_timedelta(seconds, unit='s')
+
+    is_sell = rng.random(unique_rows) < 0.5
+    side = np.where(is_sell, 'Sell(Close)', 'Buy(Open)')
+    is_market = rng.random(unique_rows) < 0.6
+    pnl = np.where(is_sell, rng.normal(0, notional * 0.02), np.nan)
+    base_asset = np.char.replace(assets[asset_index].astype(str), 'USDT', '')
+
+    frame = pd.DataFrame({
+        'Underlying Asset': assets[asset_index],
+        'Margin Mode': np.where(rng.random(unique_rows) < 0.8, 'Cross', 'Isolated'),
+        'Leverage': rng.choice([3, 5, 10, 20, 50], size=unique_rows),
+        'Order Time': order_times.strftime('%m/%d/%Y %H:%M:%S'),
+        'Side': side,
+        'Avg Fill': pd.Series(avg_fill).map('{:.6g} USDT'.format),
+        'Price': np.where(is_market, 'Market',
+                          pd.Series(avg_fill).map('{:.6g} USDT'.format)),
+        'Filled': pd.Series(filled).map('{:.4f}'.format) + ' ' + base_asset,
+        'Total': pd.Series(notional).map('{:.2f} USDT'.format),
+        'PNL': np.where(is_sell, pd.Series(pnl).map('{:.4f} USDT'.format), '--'),
+        'PNL%': np.where(is_sell, pd.Series(pnl / notional * 100).map('{:.2f}%'.format), '--'),
+        'Fee': pd.Series(notional * 0.0006).map('{:.8f} USDT'.format),
+        'Order Options': '--',
+        'Reduce-only': np.where(is_sell & (rng.random(unique_rows) < 0.3), 'Y', 'N'),
+        'Status': np.where(rng.random(unique_rows) < canceled_ratio, 'Canceled', 'Filled'),
+    }, columns=COLUMNS)
+
+    if duplicates:
+        repeated = frame.iloc[rng.integers(0, unique_rows, size=duplicates)]
+        frame = pd.concat([frame, repeated]).sort_index(kind='stable')
+
+    return frame.reset_index(drop=True)
+
+
+def write_csv(path, rows, **options):
+    """Generate ``rows`` trades and write them to ``path``."""
+    generate_frame(rows, **options).to_csv(path, index=False)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.0)
+    parser.add_argument('--canceled-ratio', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+
+    write_csv(args.output, args.rows, duplicate_ratio=args.duplicate_ratio,
+              canceled_ratio=args.canceled_ratio, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""
+Measure BloFin CSV ingest throughput stage by stage.
+
+    python -m benchmarks.ingest --rows 10000 100000 --output bench.json
+    python -m benchmarks.ingest --database-url postgres://localhost/doji --rows 100000
+
+Each run builds a throwaway test database, so the configured database is
+never written to. Results are printed and written as JSON so they can be
+compared between commits.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+class StageTimer:
+    """Accumulate wall-clock time per named stage."""
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - started
+
+
+def setup_django(database_url=None):
+    """Point the project settings at SQLite or at ``database_url``, then set Django up."""
+    if database_url:
+        os.environ.pop('DEV', None)
+        os.environ['DATABASE_URL'] = database_url
+    else:
+        os.environ.setdefault('DEV', '1')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'doji_lite_api_v2.settings')
+
+    import django
+    django.setup()
+
+
+def time_stages(path, owner, chunk_size):
+    """Run the ingest stages by hand so each one can be timed on its own."""
+    import pandas as pd
+    from upload_csv.exchange.blofin.blofin_csv_handler import BloFinHandler, TradeDuplicateIndex
+    from upload_csv.models import TradeUploadBlofin
+
+    timer = StageTimer()
+    handler = BloFinHandler()
+    inserted = 0
+
+    with timer.stage('read'):
+        reader = pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_size)
+
+    while True:
+        with timer.stage('read'):
+            chunk = next(reader, None)
+        if chunk is None:
+            break
+
+        with timer.stage('normalize'):
+            frame, _, _ = handler.normalize_frame(chunk)
+        with timer.stage('model_build'):
+            trades = handler.build_trades(frame, owner, 'BloFin', 'benchmark.csv')
+        with timer.stage('dedup'):
+            duplicate_index = TradeDuplicateIndex.for_trades(trades, owner)
+            new_trades = []
+            for trade in trades:
+                if not duplicate_index.contains(trade):
+                    duplicate_index.add(trade)
+                    new_trades.append(trade)
+        with timer.stage('insert'):
+            TradeUploadBlofin.objects.bulk_create(
+                new_trades, batch_size=1000, ignore_conflicts=True)
+        inserted += len(new_trades)
+
+    reader.close()
+    return timer.seconds, inserted
+
+
+def run_size(rows, args, owner):
+    from benchmarks.generate_blofin_csv import write_csv
+    from upload_csv.exchange.blofin.csv_processor import CsvProcessor
+    from upload_csv.models import IngestedRange, TradeUploadBlofin
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f'blofin_{rows}.csv')
+        write_csv(path, rows, duplicate_ratio=args.duplicate_ratio,
+                  canceled_ratio=args.canceled_ratio, seed=args.seed)
+
+        stages, inserted = time_stages(path, owner, args.chunk_size)
+        TradeUploadBlofin.objects.all().delete()
+
+        # The same file through CsvProcessor as an upload job would run it,
+        # first into an empty table and then again as a full re-upload
+        processor = CsvProcessor(owner, 'BloFin', chunk_size=args.chunk_size)
+        started = time.perf_counter()
+        new_trades, duplicates, canceled, covered = processor.process_csv_file(path, 'benchmark.csv')
+        end_to_end = time.perf_counter() - started
+
+        IngestedRange.objects.all().delete()
+        started = time.perf_counter()
+        processor.process_csv_file(path, 'benchmark.csv')
+        reupload = time.perf_counter() - started
+
+        TradeUploadBlofin.objects.all().delete()
+        IngestedRange.objects.all().delete()
+
+    return {
+        'rows': rows,
+        'stages': {name: round(seconds, 4) for name, seconds in stages.items()},
+        'stage_inserted': inserted,
+        'end_to_end_seconds': round(end_to_end, 4),
+        'end_to_end_rows_per_second': round(rows / end_to_end, 1) if end_to_end else None,
+        'reupload_seconds': round(reupload, 4),
+        'new_trades': new_trades,
+        'duplicates': duplicates,
+        'canceled': canceled,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], text=True,
+            stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--duplicate-ratio', type=float, default=0.05)
+    parser.add_argument('--canceled-ratio', type=float, default=0.05)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database-url', help='Benchmark against PostgreSQL instead of SQLite.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    args = parser.parse_args()
+
+    setup_django(args.database_url)
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+
+    test_database = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        owner = User.objects.create(username='benchmark')
+        results = [run_size(rows, args, owner) for rows in args.rows]
+    finally:
+        connection.creation.destroy_test_db(test_database, verbosity=0)
+
+    report = {
+        'benchmark': 'ingest',
+        'created_at': datetime.now(dt_timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'options': {
+            'duplicate_ratio': args.duplicate_ratio,
+            'canceled_ratio': args.canceled_ratio,
+            'chunk_size': args.chunk_size,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as results_file:
+            results_file.write(output + '\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
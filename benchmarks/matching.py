@@ -0,0 +1,109 @@
+"""
+Compare the FIFO matching engines on synthetic fills, without a database.
+
+    python -m benchmarks.matching --fills 100000 1000000 --output matching.json
+
+The engines are fed the same fills, the NumPy one as the int64 columns the
+trade snapshot cache holds, and their results and allocations are checked
+against each other before the timings are reported.
+"""
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+
+
+def generate_fills(count, buy_ratio=0.5, seed=0):
+    """
+    Random Buy/Sell fills, oldest first, as the columns a TradeSnapshot
+    holds: ids, whether each is a buy, and 10 dp fixed-point quantities.
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, count + 1, dtype=np.int64)
+    is_buy = rng.random(count) < buy_ratio
+    quantities = rng.integers(1, 5 * 10 ** 10, count)
+    return ids, is_buy, quantities
+
+
+def to_records(ids, is_buy, quantities):
+    """The same fills as the TradeRecords the Python engine reads."""
+    from upload_csv.matching import TradeRecord
+
+    return [
+        TradeRecord(trade_id, 'Buy' if buy else 'Sell', Decimal(quantity).scaleb(-10))
+        for trade_id, buy, quantity in zip(ids.tolist(), is_buy.tolist(), quantities.tolist())
+    ]
+
+
+def run_engine(engine_class, fills, checkpoint_interval):
+    """
+    Time matching, then matching plus reading every result and
+    allocation; engines with ``process_columns`` are given the columns.
+    """
+    columns, records = fills
+    checkpoint_at = range(checkpoint_interval, len(records) + 1, checkpoint_interval)
+    started = time.perf_counter()
+    engine = engine_class()
+    if hasattr(engine, 'process_columns'):
+        engine.process_columns(*columns, checkpoint_at)
+    else:
+        engine.process(records, checkpoint_at)
+    matched = time.perf_counter() - started
+    results = sorted(engine.results()), list(engine.allocations)
+    return matched, time.perf_counter() - started, results
+
+
+def main():
+    from upload_csv.matching import FifoMatchingEngine, NumpyFifoMatchingEngine
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fills', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--buy-ratio', type=float, default=0.5)
+    parser.add_argument('--checkpoint-interval', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    args = parser.parse_args()
+
+    engines = {'python': FifoMatchingEngine, 'numpy': NumpyFifoMatchingEngine}
+    results = []
+    for count in args.fills:
+        columns = generate_fills(count, args.buy_ratio, args.seed)
+        fills = columns, to_records(*columns)
+        timings = {}
+        expected = None
+        for name, engine_class in engines.items():
+            matched, total, engine_results = run_engine(
+                engine_class, fills, args.checkpoint_interval)
+            if expected is None:
+                expected = engine_results
+            elif engine_results != expected:
+                raise SystemExit(f"The {name} engine disagrees on {count} fills.")
+            timings[name] = {'match_seconds': round(matched, 4),
+                             'with_results_seconds': round(total, 4)}
+        results.append({'fills': count, 'engines': timings})
+
+    report = {
+        'benchmark': 'matching',
+        'created_at': datetime.now(dt_timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'options': {
+            'buy_ratio': args.buy_ratio,
+            'checkpoint_interval': args.checkpoint_interval,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as results_file:
+            results_file.write(output + '\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -21,6 +21,8 @@ if os.path.exists('env.py'):
 # Celery settings
 # CELERY_BROKER_URL = f'redis://:{os.environ["REDIS_PASSWORD"]}@127.0.0.1:6379/1'
 CELERY_BROKER_URL = os.environ.get("REDIS_URL")
+# Matching fans out as a chord, which needs a result backend
+CELERY_RESULT_BACKEND = os.environ.get("REDIS_URL")
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
@@ -36,6 +38,23 @@ DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Uploaded CSV files wait here until a worker ingests them. The web and
+# worker processes must see the same directory, e.g. a volume mounted in
+# both; separate dynos each have their own filesystem, so uploads fail
+# there with a missing-file error until this points at shared storage
+UPLOAD_SPOOL_DIR = Path(os.environ.get('UPLOAD_SPOOL_DIR', BASE_DIR / 'spool'))
+
+# FIFO matching engine: 'python', 'numpy' for assets with many fills, or
+# 'sql' to match inside PostgreSQL (other databases use 'python')
+TRADE_MATCHER_BACKEND = os.environ.get('TRADE_MATCHER_BACKEND', 'python')
+
+# Uploads finishing within this many seconds of each other share one
+# matching pass per asset
+MATCH_DEBOUNCE_SECONDS = float(os.environ.get('MATCH_DEBOUNCE_SECONDS', 5))
+
+# Assets whose trades each worker keeps in memory for matching
+TRADE_SNAPSHOT_CACHE_SIZE = int(os.environ.get('TRADE_SNAPSHOT_CACHE_SIZE', 64))
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [(
         'rest_framework.authentication.SessionAuthentication'
@@ -0,0 +1,134 @@
+from contextlib import contextmanager
+from django.conf import settings
+from pathlib import Path
+import hashlib
+import mmap
+import numpy as np
+import os
+import tempfile
+
+
+class BlobMissing(FileNotFoundError):
+    """Raised when a blob is not in the store, e.g. a worker with its own spool."""
+
+
+class BlobStore:
+    """
+    Content-addressed store for uploaded files.
+
+    Each file is written once to ``<root>/<key[:2]>/<key>`` where the key is
+    the SHA-256 of its bytes, so tasks only need to be handed the key.
+    """
+    BLOCK_SIZE = 1 << 24
+
+    def __init__(self, root=None):
+        self.root = Path(root or settings.UPLOAD_SPOOL_DIR)
+
+    def path(self, key):
+        return self.root / key[:2] / key
+
+    def exists(self, key):
+        return self.path(key).exists()
+
+    def require(self, key):
+        """
+        :raises BlobMissing: If the blob is not in the store.
+        """
+        if not self.exists(key):
+            raise BlobMissing(
+                f"Uploaded file {key} is not in the spool at {self.root}; the web "
+                f"and worker processes must share UPLOAD_SPOOL_DIR.")
+
+    def put(self, chunks):
+        """
+        Stream byte chunks into the store.
+
+        :param chunks: An iterable of bytes, e.g. ``UploadedFile.chunks()``.
+        :return: The SHA-256 hex key of the stored blob.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        spooled = tempfile.NamedTemporaryFile(dir=self.root, delete=False)
+        try:
+            with spooled:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    spooled.write(chunk)
+
+            key = digest.hexdigest()
+            path = self.path(key)
+            os.makedirs(path.parent, exist_ok=True)
+            # Identical content already stored under the same key is kept as is
+            os.replace(spooled.name, path)
+        except BaseException:
+            # An upload cut short must not leave its partial file behind
+            os.unlink(spooled.name)
+            raise
+        return key
+
+    @contextmanager
+    def open(self, key):
+        """Memory-map a blob read-only."""
+        with open(self.path(key), 'rb') as blob:
+            if os.fstat(blob.fileno()).st_size == 0:
+                yield b''
+                return
+            with mmap.mmap(blob.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+
+    def count_data_rows(self, key):
+        """Count the data rows of a stored CSV without parsing it."""
+        with self.open(key) as mapped:
+            size = len(mapped)
+            if not size:
+                return 0
+            lines = 0
+            for offset in range(0, size, self.BLOCK_SIZE):
+                block = np.frombuffer(
+                    mapped, dtype=np.uint8,
+                    count=min(self.BLOCK_SIZE, size - offset), offset=offset)
+                lines += int(np.count_nonzero(block == ord('\n')))
+                # Release the view before the map is closed
+                del block
+            if mapped[size - 1:size] != b'\n':
+                lines += 1
+        # The first line is the header
+        return max(lines - 1, 0)
+
+    def describe(self, key):
+        """
+        Return (size, header_size, body_hash) for a stored CSV.
+
+        ``header_size`` covers the header line and its newline, and
+        ``body_hash`` is the SHA-256 of every byte after it.
+        """
+        with self.open(key) as mapped:
+            size = len(mapped)
+            header_end = mapped.find(b'\n') if size else -1
+            header_size = size if header_end == -1 else header_end + 1
+        return size, header_size, self.hash_range(key, header_size, size)
+
+    def hash_range(self, key, start, end):
+        """SHA-256 of the bytes ``[start, end)`` of a blob."""
+        digest = hashlib.sha256()
+        for block in self.iter_range(key, start, end):
+            digest.update(block)
+        return digest.hexdigest()
+
+    def iter_range(self, key, start, end):
+        """Yield the bytes ``[start, end)`` of a blob in bounded blocks."""
+        with self.open(key) as mapped:
+            for offset in range(start, end, self.BLOCK_SIZE):
+                yield mapped[offset:min(offset + self.BLOCK_SIZE, end)]
+
+    def put_ranges(self, key, ranges):
+        """Store the concatenation of byte ranges of a blob as a new blob."""
+        return self.put(
+            block for start, end in ranges
+            for block in self.iter_range(key, start, end))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
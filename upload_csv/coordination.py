@@ -0,0 +1,258 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import transaction
+import threading
+import time
+import uuid
+
+# Longer than CELERY_TASK_TIME_LIMIT, so a killed worker's lease lapses
+# soon after the task would have been stopped anyway
+MATCH_LEASE_SECONDS = 180
+
+_redis_client = None
+
+
+class LeaseUnavailable(Exception):
+    """Raised when another worker holds the lease."""
+
+
+def get_redis():
+    """
+    Return a client for the Redis broker, or None when Celery is not
+    configured with one (tests and local runs without a worker).
+    """
+    global _redis_client
+    url = getattr(settings, 'CELERY_BROKER_URL', None) or ''
+    if not url.startswith(('redis://', 'rediss://', 'unix://')):
+        return None
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.Redis.from_url(url)
+    return _redis_client
+
+
+class RedisLeases:
+    # Only the holder's token may release the key
+    RELEASE_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.release_script = client.register_script(self.RELEASE_SCRIPT)
+
+    def acquire(self, key, token, seconds):
+        return bool(self.client.set(key, token, nx=True, ex=seconds))
+
+    def release(self, key, token):
+        self.release_script(keys=[key], args=[token])
+
+
+class LocalLeases:
+    """In-process leases for tests and single-process runs."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.holders = {}
+
+    def acquire(self, key, token, seconds):
+        now = time.monotonic()
+        with self.lock:
+            holder = self.holders.get(key)
+            if holder is not None and holder[1] > now:
+                return False
+            self.holders[key] = (token, now + seconds)
+            return True
+
+    def release(self, key, token):
+        with self.lock:
+            holder = self.holders.get(key)
+            if holder is not None and holder[0] == token:
+                del self.holders[key]
+
+
+_local_leases = LocalLeases()
+
+
+def get_leases():
+    client = get_redis()
+    return _local_leases if client is None else RedisLeases(client)
+
+
+@contextmanager
+def asset_lease(owner_id, asset_name, seconds=MATCH_LEASE_SECONDS):
+    """
+    Hold the matching lease for one owner's asset.
+
+    :raises LeaseUnavailable: If another run holds it.
+    """
+    leases = get_leases()
+    key = f"upload_csv:match-lease:{owner_id}:{asset_name}"
+    token = uuid.uuid4().hex
+    if not leases.acquire(key, token, seconds):
+        raise LeaseUnavailable(f"Asset {asset_name} of owner {owner_id} is being matched.")
+    try:
+        yield
+    finally:
+        leases.release(key, token)
+
+
+class RedisDirtyAssets:
+    """Per-owner sets of assets and upload jobs waiting for a matching pass."""
+    PREFIX = 'upload_csv:dirty'
+    # Lets a later upload schedule a pass if a scheduled one was lost
+    SCHEDULED_SECONDS = 300
+
+    def __init__(self, client):
+        self.client = client
+
+    def keys(self, owner_id):
+        prefix = f"{self.PREFIX}:{owner_id}"
+        return (f"{prefix}:assets", f"{prefix}:jobs",
+                f"{prefix}:touched", f"{prefix}:scheduled")
+
+    def mark(self, owner_id, asset_names, job_id=None):
+        """
+        Add assets (and the job waiting on them) to the owner's set.
+
+        :return: True when no pass is scheduled yet and the caller must
+            schedule one.
+        """
+        assets_key, jobs_key, touched_key, scheduled_key = self.keys(owner_id)
+        pipeline = self.client.pipeline()
+        pipeline.sadd(assets_key, *asset_names)
+        if job_id is not None:
+            pipeline.sadd(jobs_key, job_id)
+        pipeline.set(touched_key, time.time())
+        pipeline.set(scheduled_key, 1, nx=True, ex=self.SCHEDULED_SECONDS)
+        return bool(pipeline.execute()[-1])
+
+    def due_in(self, owner_id, window):
+        """Seconds left until ``window`` has passed since the last mark."""
+        touched = self.client.get(self.keys(owner_id)[2])
+        if touched is None:
+            return 0
+        return max(0.0, float(touched) + window - time.time())
+
+    def take(self, owner_id):
+        """Atomically empty the owner's set; return (asset_names, job_ids)."""
+        assets_key, jobs_key, touched_key, scheduled_key = self.keys(owner_id)
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.smembers(assets_key)
+        pipeline.smembers(jobs_key)
+        pipeline.delete(assets_key, jobs_key, touched_key, scheduled_key)
+        asset_names, job_ids, _ = pipeline.execute()
+        return (sorted(asset.decode() for asset in asset_names),
+                sorted(int(job_id) for job_id in job_ids))
+
+
+class LocalDirtyAssets:
+    """In-process dirty-asset sets for tests and single-process runs."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.owners = {}
+
+    def mark(self, owner_id, asset_names, job_id=None):
+        with self.lock:
+            entry = self.owners.get(owner_id)
+            schedule = entry is None
+            if schedule:
+                entry = self.owners[owner_id] = {'assets': set(), 'jobs': set()}
+            entry['assets'].update(asset_names)
+            if job_id is not None:
+                entry['jobs'].add(job_id)
+            entry['touched'] = time.time()
+            return schedule
+
+    def due_in(self, owner_id, window):
+        with self.lock:
+            entry = self.owners.get(owner_id)
+            if entry is None:
+                return 0
+            return max(0.0, entry['touched'] + window - time.time())
+
+    def take(self, owner_id):
+        with self.lock:
+            entry = self.owners.pop(owner_id, None)
+        if entry is None:
+            return [], []
+        return sorted(entry['assets']), sorted(entry['jobs'])
+
+
+_local_dirty_assets = LocalDirtyAssets()
+
+
+def get_dirty_assets():
+    client = get_redis()
+    return _local_dirty_assets if client is None else RedisDirtyAssets(client)
+
+
+class RedisTradeVersions:
+    """
+    Per-(owner, asset) tokens replaced whenever trades are inserted or
+    deleted. A missing key gets a fresh token rather than a default, so a
+    key Redis evicted or lost never matches a version cached before.
+    """
+    PREFIX = 'upload_csv:trade-version'
+
+    def __init__(self, client):
+        self.client = client
+
+    def key(self, owner_id, asset_name):
+        return f"{self.PREFIX}:{owner_id}:{asset_name}"
+
+    def get(self, owner_id, asset_name):
+        key = self.key(owner_id, asset_name)
+        version = self.client.get(key)
+        if version is None:
+            token = uuid.uuid4().hex
+            # Another worker may set one first; its token wins
+            if self.client.set(key, token, nx=True):
+                return token
+            version = self.client.get(key) or token.encode()
+        return version.decode()
+
+    def bump(self, owner_id, asset_names):
+        pipeline = self.client.pipeline()
+        for asset_name in asset_names:
+            pipeline.set(self.key(owner_id, asset_name), uuid.uuid4().hex)
+        pipeline.execute()
+
+
+class LocalTradeVersions:
+    """In-process version tokens for tests and single-process runs."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.versions = {}
+
+    def get(self, owner_id, asset_name):
+        with self.lock:
+            return self.versions.setdefault((owner_id, asset_name), uuid.uuid4().hex)
+
+    def bump(self, owner_id, asset_names):
+        with self.lock:
+            for asset_name in asset_names:
+                self.versions[(owner_id, asset_name)] = uuid.uuid4().hex
+
+
+_local_trade_versions = LocalTradeVersions()
+
+
+def get_trade_versions():
+    client = get_redis()
+    return _local_trade_versions if client is None else RedisTradeVersions(client)
+
+
+def bump_trade_versions(owner_id, asset_names):
+    """
+    Mark the assets' stored trades as changed once the current transaction
+    commits, so cached snapshots of them are reloaded.
+    """
+    asset_names = sorted(set(asset_names))
+    if asset_names:
+        transaction.on_commit(lambda: get_trade_versions().bump(owner_id, asset_names))
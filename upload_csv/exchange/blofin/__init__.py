@@ -2,3 +2,6 @@ from upload_csv.exchange.blofin.utils.convert_to_decimal import convert_to_decim
 from upload_csv.exchange.blofin.utils.convert_to_native_datetime import convert_to_naive_datetime
 from upload_csv.exchange.blofin.utils.convert_to_boolean import convert_to_boolean
 from upload_csv.exchange.blofin.utils.process_invalid_data import process_invalid_data
+from upload_csv.exchange.blofin.utils.convert_series_to_decimal import convert_series_to_decimal
+from upload_csv.exchange.blofin.utils.convert_series_to_datetime import convert_series_to_datetime
+from upload_csv.exchange.blofin.utils.convert_series_to_boolean import convert_series_to_boolean
@@ -1,170 +1,247 @@
-from upload_csv.exchange.blofin.utils.convert_to_decimal import convert_to_decimal
-from upload_csv.exchange.blofin.utils.convert_to_native_datetime import convert_to_naive_datetime
-from upload_csv.exchange.blofin.utils.convert_to_boolean import convert_to_boolean
+from upload_csv.exchange.blofin.utils.convert_series_to_decimal import convert_series_to_decimal
+from upload_csv.exchange.blofin.utils.convert_series_to_datetime import convert_series_to_datetime
+from upload_csv.exchange.blofin.utils.convert_series_to_boolean import convert_series_to_boolean
 # Modal imports
+from upload_csv.coordination import bump_trade_versions
 from upload_csv.models import TradeUploadBlofin
+from upload_csv.progress import IngestProgress
+from upload_csv.utils.fixed_point import PRICE, QUANTITY
 # Pachage and library imports
-from decimal import Decimal, InvalidOperation
-from datetime import datetime
+from bisect import bisect_left, insort
+from collections import defaultdict
+from decimal import Decimal
+from django.db import IntegrityError, transaction
 from django.utils import timezone
-from django.db.models import Sum, Q
-import requests
-import pytz
+import pandas as pd
+
+
+class TradeDuplicateIndex:
+    """
+    In-memory index of the trades an upload could collide with.
+
+    Trades are keyed on (order_time, underlying_asset, fee) and each key
+    holds a sorted list of avg_fill values, so the tolerance check is a
+    binary search instead of a database range query. Fees and avg_fill
+    are held as fixed-point ints at the model's scales, which compare
+    much faster than Decimals.
+    """
+    TOLERANCE = PRICE.encode(Decimal('0.0001'))
+
+    def __init__(self):
+        self.avg_fills = defaultdict(list)
+
+    @classmethod
+    def for_trades(cls, trades, owner):
+        """Load every stored trade that could collide with ``trades`` in one query."""
+        index = cls()
+        if not trades:
+            return index
+
+        order_times = [trade.order_time for trade in trades]
+        candidates = TradeUploadBlofin.objects.filter(
+            owner=owner,
+            underlying_asset__in={trade.underlying_asset for trade in trades},
+            order_time__range=(min(order_times), max(order_times)),
+        ).values_list('order_time', 'underlying_asset', 'fee', 'avg_fill')
+
+        candidates = list(candidates)
+        if candidates:
+            order_times, underlying_assets, fees, avg_fills = zip(*candidates)
+            keys = zip(order_times, underlying_assets, QUANTITY.encode_list(fees, exact=False))
+            for key, avg_fill in zip(keys, PRICE.encode_list(avg_fills, exact=False)):
+                index.avg_fills[key].append(avg_fill)
+        for avg_fills in index.avg_fills.values():
+            avg_fills.sort()
+        return index
+
+    def key(self, order_time, underlying_asset, fee):
+        return order_time, underlying_asset, QUANTITY.encode(fee, exact=False)
+
+    def contains(self, trade):
+        """Check if a trade is a duplicate within tolerance."""
+        avg_fills = self.avg_fills.get(
+            self.key(trade.order_time, trade.underlying_asset, trade.fee))
+        if not avg_fills:
+            return False
+        avg_fill = PRICE.encode(trade.avg_fill, exact=False)
+        position = bisect_left(avg_fills, avg_fill - self.TOLERANCE)
+        return position < len(avg_fills) and avg_fills[position] <= avg_fill + self.TOLERANCE
+
+    def add(self, trade):
+        """Record a trade so later rows of the same upload are checked against it."""
+        insort(self.avg_fills[self.key(
+            trade.order_time, trade.underlying_asset, trade.fee)],
+            PRICE.encode(trade.avg_fill, exact=False))
 
 
 class CsvCopyProcessor:
+    BATCH_SIZE = 1000
+
     def __init__(self, handler: 'BloFinHandler'):
         self.handler = handler
 
-    def process_csv_data(self, csv_data, user, exchange, file_name):
-        """Process CSV data, only adding new trades."""
-        new_trades = []
-        duplicates = []
-        duplicates_count = 0
-        canceled_count = 0
-
-        for row in csv_data:
-            trade_status = row.get('Status', None)
-            if trade_status == 'Canceled':
-                canceled_count += 1
-                continue
+    def process_csv_data(self, csv_data, user, exchange, file_name, progress=None, coverage=None):
+        """
+        Process a raw CSV DataFrame, only adding new trades.
 
-            trade = self.handler.process_row(row, user, exchange, file_name)
-            if trade:
-                if self.is_duplicate(trade):
-                    duplicates_count += 1
+        :param coverage: An IngestCoverage; rows inside ranges it holds are
+            dropped before any dedup work and the kept rows widen its spans.
+            ``None`` checks every row.
+        """
+        progress = progress or IngestProgress()
 
-                else:
-                    new_trades.append(trade)
+        progress.start_stage('parse')
+        frame, canceled_count, skipped_count = self.handler.normalize_frame(csv_data, coverage)
+        if coverage is not None:
+            coverage.extend(frame)
+        trades = self.handler.build_trades(frame, user, exchange, file_name)
 
-            else:
+        duplicates_count = skipped_count
 
-                duplicates.append(trade)
-
-        # Bulk create new trades in the database
-        TradeUploadBlofin.objects.bulk_create(new_trades)
-
-        return len(new_trades), len(duplicates), canceled_count
-
-    def is_duplicate(self, trade):
-        """Check if a trade is a duplicate within tolerance."""
-        TOLERANCE = Decimal('0.0001')
-
-        duplicate_queryset = TradeUploadBlofin.objects.filter(
-            order_time=trade.order_time,
-            underlying_asset=trade.underlying_asset,
-            fee=trade.fee
-        ).filter(
-            Q(avg_fill__lte=trade.avg_fill + TOLERANCE) &
-            Q(avg_fill__gte=trade.avg_fill - TOLERANCE)
-        )
-
-        is_duplicate = duplicate_queryset.exists()
-
-        if is_duplicate:
-            print(f"Duplicate check: Trade on {trade.order_time} with asset {
-                  trade.underlying_asset} is a duplicate.")
-            # Log the duplicate trades for debugging
-
-        else:
-            print(f"Duplicate check: Trade on {trade.order_time} with asset {
-                  trade.underlying_asset} is not a duplicate.")
-
-        return is_duplicate
+        progress.start_stage('dedup')
+        duplicate_index = TradeDuplicateIndex.for_trades(trades, user)
 
+        new_trades = []
 
-class BloFinHandler:
-    def process_row(self, row, owner, exchange, file_name):
-        duplicates = []
-        try:
-            # Extract fields from the row
-            trade_status = row.get('Status', None)
-            if trade_status == 'Canceled':
-                return None
-
-            order_time_str = row['Order Time']
-            # Use the utility function to convert the order time string
-            order_time_naive = convert_to_naive_datetime(order_time_str)
-            if order_time_naive:
-                order_time = timezone.make_aware(
-                    order_time_naive, timezone.get_current_timezone())
+        for trade in trades:
+            if duplicate_index.contains(trade):
+                duplicates_count += 1
             else:
-                order_time = None
-
-            underlying_asset = row['Underlying Asset']
-
-            # # Define a set of assets to exclude
-            # excluded_assets = {'BOMEUSDT',
-            #                    'POPCATUSDT', 'GMEUSDT', 'BRETTUSDT'}
-
-            # # Check if the underlying asset is in the excluded list
-            # if underlying_asset in excluded_assets:
-            #     return None
-
-            if underlying_asset not in ['ARBUSDT', 'BTCUSDT', 'ETHUSDT',
-                                        'RUNEUSDT', 'INJUSDT', 'VRAUSDT', 'LDOUSDT', 'WIFUSDT', 'SOLUSDT',
-                                        'BLURUSDT', 'MATICUSDT', 'SEIUSDT', 'NEARUSDT', 'GMEUSDT']:
-                return None
+                duplicate_index.add(trade)
+                new_trades.append(trade)
+
+        progress.start_stage('insert')
+        inserts = self.insert_trades(self.unstored_trades(new_trades))
+        duplicates_count += len(new_trades) - len(inserts)
+        new_trades_count = len(inserts)
+        if new_trades_count:
+            bump_trade_versions(user.id, {trade.underlying_asset for trade in inserts})
+
+        return new_trades_count, duplicates_count, canceled_count
+
+    def insert_trades(self, trades):
+        """
+        Insert trades that were not stored when checked and return the
+        ones inserted. Another upload may store some of them in between;
+        the unique fingerprint then rejects the insert, which is retried
+        without them, so only this upload's own inserts are counted.
+        """
+        while trades:
+            try:
+                with transaction.atomic():
+                    TradeUploadBlofin.objects.bulk_create(trades, batch_size=self.BATCH_SIZE)
+                return trades
+            except IntegrityError:
+                unstored = self.unstored_trades(trades)
+                if len(unstored) == len(trades):
+                    raise
+                trades = unstored
+        return trades
+
+    def unstored_trades(self, trades):
+        """
+        Drop trades whose fingerprint is already stored or repeats an
+        earlier trade of ``trades``; one indexed lookup per batch.
+        """
+        stored = set()
+        for start in range(0, len(trades), self.BATCH_SIZE):
+            stored.update(TradeUploadBlofin.objects.filter(fingerprint__in=[
+                trade.fingerprint for trade in trades[start:start + self.BATCH_SIZE]
+            ]).values_list('fingerprint', flat=True))
+        unstored = []
+        for trade in trades:
+            if trade.fingerprint not in stored:
+                stored.add(trade.fingerprint)
+                unstored.append(trade)
+        return unstored
 
 
-            avg_fill = convert_to_decimal(row['Avg Fill'])
-            pnl = convert_to_decimal(row['PNL'])
-            pnl_percentage = convert_to_decimal(row['PNL%'])
-            fee = convert_to_decimal(row['Fee'])
-            price = convert_to_decimal(row['Price'])
-            filled_quantity = convert_to_decimal(row['Filled'])
-            reduce_only = convert_to_boolean(row['Reduce-only'])
-            side = row['Side'].split('(')[0].strip()  # Remove everything after '(' and strip any extra spaces
-
-
-            is_matched = False
-            is_open = False
-
-            # Define the tolerance level
-            TOLERANCE = Decimal('0.0001')
-
-            # Create a query to find duplicates within the tolerance range
-            duplicate_queryset = TradeUploadBlofin.objects.filter(
-                order_time=order_time,
-                underlying_asset=underlying_asset,
-                fee=fee
-            ).filter(
-                Q(avg_fill__lte=avg_fill +
-                  TOLERANCE) & Q(avg_fill__gte=avg_fill - TOLERANCE)
-            )
-
-            if duplicate_queryset.exists():
-                duplicate_count = 0
-
-                # Iterate over the duplicate queryset
-                for idx, duplicate in enumerate(duplicate_queryset):
-                    duplicate_count += 1
-
-                    # Print the count of duplicates
-                    print("Count of duplicates:", duplicate_count)
-
-                    # If there are more than one duplicate
-                    if duplicate_count > 1:
-                        # Get all but the first duplicate
-                        excess_duplicates = duplicate_queryset[1:]
-
-                        #
-
-                        # Delete the excess duplicates
-                        excess_duplicates.delete()
-
-                        # Since we only need to handle the first duplicate case,
-                        # we can break the loop after processing excess duplicates
-                        break
-
-                return None
-
-            trade_upload_csv = TradeUploadBlofin(
+class BloFinHandler:
+    ALLOWED_ASSETS = [
+        'ARBUSDT', 'BTCUSDT', 'ETHUSDT', 'RUNEUSDT', 'INJUSDT', 'VRAUSDT',
+        'LDOUSDT', 'WIFUSDT', 'SOLUSDT', 'BLURUSDT', 'MATICUSDT', 'SEIUSDT',
+        'NEARUSDT', 'GMEUSDT',
+    ]
+
+    DECIMAL_COLUMNS = {
+        'Avg Fill': 'avg_fill',
+        'Price': 'price',
+        'Filled': 'filled_quantity',
+        'PNL': 'pnl',
+        'PNL%': 'pnl_percentage',
+        'Fee': 'fee',
+    }
+
+    def normalize_frame(self, frame, coverage=None):
+        """
+        Normalize a raw BloFin export column by column.
+
+        Returns the normalized frame (one row per trade to keep, with model
+        field names as columns), the number of canceled rows and the number
+        of rows skipped because of the asset allowlist or unparseable data.
+        Rows inside a range ``coverage`` holds are dropped too and counted
+        there.
+        """
+        canceled = frame['Status'] == 'Canceled'
+        canceled_count = int(canceled.sum())
+        frame = frame[~canceled]
+
+        allowed = frame['Underlying Asset'].isin(self.ALLOWED_ASSETS)
+        skipped_count = int((~allowed).sum())
+        frame = frame[allowed]
+
+        order_time = convert_series_to_datetime(
+            frame['Order Time'], timezone.get_current_timezone())
+        if coverage is not None:
+            # An earlier upload already stored these rows
+            uncovered = ~coverage.covers(frame['Underlying Asset'], order_time)
+            frame = frame[uncovered]
+            order_time = order_time[uncovered]
+
+        normalized = pd.DataFrame(index=frame.index)
+        normalized['underlying_asset'] = frame['Underlying Asset']
+        normalized['margin_mode'] = frame['Margin Mode']
+        # The first number in the cell ('10', '20x'); the model only holds
+        # whole multiples, so '1.5x' is unparseable like other bad cells
+        leverage = pd.to_numeric(
+            frame['Leverage'].str.extract(r'(\d+(?:\.\d+)?)', expand=False),
+            errors='coerce')
+        normalized['leverage'] = leverage.where(leverage % 1 == 0)
+        normalized['order_time'] = order_time
+        # Remove everything after '(' and strip any extra spaces
+        normalized['side'] = frame['Side'].str.split('(').str[0].str.strip()
+        normalized['reduce_only'] = convert_series_to_boolean(frame['Reduce-only'])
+        normalized['trade_status'] = frame['Status']
+
+        valid = (normalized['leverage'].notna()
+                 & normalized['order_time'].notna()
+                 & normalized['reduce_only'].notna())
+        skipped_count += int((~valid).sum())
+        normalized = normalized[valid]
+        frame = frame[valid]
+
+        for column, field in self.DECIMAL_COLUMNS.items():
+            normalized[field] = convert_series_to_decimal(frame[column])
+        normalized['leverage'] = normalized['leverage'].astype('int64')
+
+        return normalized, canceled_count, skipped_count
+
+    def build_trades(self, frame, owner, exchange, file_name):
+        """Build unsaved TradeUploadBlofin instances from a normalized frame."""
+        order_times = pd.DatetimeIndex(frame['order_time']).to_pydatetime()
+        columns = zip(
+            frame['underlying_asset'], frame['margin_mode'], frame['leverage'],
+            order_times, frame['side'], frame['avg_fill'], frame['price'],
+            frame['filled_quantity'], frame['pnl'], frame['pnl_percentage'],
+            frame['fee'], frame['reduce_only'], frame['trade_status'],
+        )
+        trades = [
+            TradeUploadBlofin(
                 owner=owner,
                 file_name=file_name,
                 underlying_asset=underlying_asset,
-                margin_mode=row['Margin Mode'],
-                leverage=row['Leverage'],
+                margin_mode=margin_mode,
+                leverage=int(leverage),
                 order_time=order_time,
                 side=side,
                 avg_fill=avg_fill,
@@ -175,13 +252,15 @@ class BloFinHandler:
                 pnl_percentage=pnl_percentage,
                 fee=fee,
                 reduce_only=reduce_only,
-                trade_status=row.get('Status', None),
+                trade_status=trade_status,
                 exchange=exchange,
-                is_open=is_open,
-                is_matched=is_matched,
+                is_open=False,
+                is_matched=False,
             )
-            return trade_upload_csv
-
-        except (InvalidOperation, ValueError) as e:
-
-            return None
+            for (underlying_asset, margin_mode, leverage, order_time, side,
+                 avg_fill, price, filled_quantity, pnl, pnl_percentage, fee,
+                 reduce_only, trade_status) in columns
+        ]
+        for trade in trades:
+            trade.refresh_fingerprint()
+        return trades
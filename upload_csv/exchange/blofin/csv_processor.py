@@ -1,44 +1,120 @@
+import os
 import pandas as pd
 from rest_framework.response import Response
 from upload_csv.exchange.blofin.blofin_csv_handler import BloFinHandler, CsvCopyProcessor
+from upload_csv.ingest_coverage import IngestCoverage
+from upload_csv.progress import IngestProgress
 from rest_framework import status
 import time
 
 
 class CsvProcessor:
-    def __init__(self, owner, exchange):
+    CHUNK_SIZE = 5000
+
+    REQUIRED_COLUMNS = {
+        'Underlying Asset', 'Margin Mode', 'Leverage', 'Order Time', 'Side',
+        'Avg Fill', 'Price', 'Filled', 'Total', 'PNL', 'PNL%', 'Fee',
+        'Order Options', 'Reduce-only', 'Status'
+    }
+
+    def __init__(self, owner, exchange, chunk_size=CHUNK_SIZE, full_reconcile=False):
+        """
+        :param chunk_size: Rows read, deduplicated and inserted per step.
+            ``None`` reads the whole file in one go.
+        :param full_reconcile: Check every row against stored trades instead
+            of dropping rows inside ranges earlier uploads stored in full.
+        """
         self.owner = owner
         self.exchange = exchange
+        self.chunk_size = chunk_size
+        self.full_reconcile = full_reconcile
 
-    def process_csv_file(self, file, file_name):
+    def read_chunks(self, file):
+        """Yield the CSV as DataFrames of at most ``chunk_size`` rows."""
         try:
-            reader = pd.read_csv(file)
+            # Keep every cell as text so decimals are parsed exactly
+            # Files on disk are memory-mapped rather than read into buffers
+            reader = pd.read_csv(
+                file, dtype=str, keep_default_na=False, chunksize=self.chunk_size,
+                memory_map=isinstance(file, (str, os.PathLike)))
         except Exception as e:
             raise ValueError("Error reading CSV file.") from e
 
-        required_columns = {
-            'Underlying Asset', 'Margin Mode', 'Leverage', 'Order Time', 'Side', 
-            'Avg Fill', 'Price', 'Filled', 'Total', 'PNL', 'PNL%', 'Fee', 
-            'Order Options', 'Reduce-only', 'Status'
-        }
+        if self.chunk_size is None:
+            yield reader
+            return
+
+        with reader:
+            while True:
+                try:
+                    chunk = next(reader)
+                except StopIteration:
+                    return
+                except Exception as e:
+                    raise ValueError("Error reading CSV file.") from e
+                yield chunk
 
-        missing_cols = required_columns - set(reader.columns)
+    def validate_columns(self, columns):
+        missing_cols = self.REQUIRED_COLUMNS - set(columns)
         if missing_cols:
             raise ValueError(f"Missing Columns: {', '.join(missing_cols)}")
 
-        unexpected_cols = set(reader.columns) - required_columns
+        unexpected_cols = set(columns) - self.REQUIRED_COLUMNS
         if unexpected_cols:
             raise ValueError(f"Unexpected columns found: {', '.join(unexpected_cols)}")
 
-        # Validate data types or specific content if necessary
+    def drop_header_rows(self, chunk):
+        """
+        Drop header lines repeated inside the file, as in exports pasted
+        together. A header line naming the columns in another order would
+        misalign every row after it.
+        """
+        # Only rows whose first cell is a column name can be header lines
+        suspects = chunk[chunk.iloc[:, 0].isin(self.REQUIRED_COLUMNS)]
+        if suspects.empty:
+            return chunk
+        headers = suspects[suspects.isin(self.REQUIRED_COLUMNS).all(axis=1)]
+        misplaced = headers[(headers != list(chunk.columns)).any(axis=1)]
+        if not misplaced.empty:
+            raise ValueError(
+                f"Header on line {misplaced.index[0] + 2} does not match the first header.")
+        return chunk.drop(headers.index)
 
-        csv_data = reader.to_dict('records')
+    def process_csv_file(self, file, file_name, progress=None):
+        """
+        Ingest a CSV export chunk by chunk.
 
+        Returns the new, duplicate, canceled and covered row counts; covered
+        rows sit inside ranges earlier uploads stored and are not checked.
+
+        :param progress: An IngestProgress told about each stage and chunk;
+            cancellation is checked between chunks.
+        """
+        progress = progress or IngestProgress()
         handler = BloFinHandler()
         processor = CsvCopyProcessor(handler)
 
-        new_trades_count, duplicates, canceled_count = processor.process_csv_data(
-            csv_data, self.owner, self.exchange, file_name
-        )
+        coverage = (IngestCoverage() if self.full_reconcile
+                    else IngestCoverage.load(self.owner, self.exchange))
+
+        new_trades_count = duplicates = canceled_count = 0
+        chunks = self.read_chunks(file)
+
+        for chunk in chunks:
+            progress.check_canceled()
+
+            self.validate_columns(chunk.columns)
+            rows = len(chunk)
+            chunk = self.drop_header_rows(chunk)
+
+            chunk_new, chunk_duplicates, chunk_canceled = processor.process_csv_data(
+                chunk, self.owner, self.exchange, file_name, progress, coverage
+            )
+            new_trades_count += chunk_new
+            duplicates += chunk_duplicates
+            canceled_count += chunk_canceled
+            progress.advance(rows)
+
+        coverage.save(self.owner, self.exchange)
 
-        return new_trades_count, duplicates, canceled_count
+        return new_trades_count, duplicates, canceled_count, coverage.covered_count
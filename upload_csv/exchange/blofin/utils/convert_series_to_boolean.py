@@ -0,0 +1,4 @@
+def convert_series_to_boolean(series):
+    """Convert a column of Y/N flags to booleans, None where unknown."""
+    bool_map = {"Y": True, "N": False}
+    return series.map(bool_map).astype(object).where(series.isin(bool_map), None)
@@ -0,0 +1,14 @@
+import pandas as pd
+
+
+def convert_series_to_datetime(series, tz, date_format='%m/%d/%Y %H:%M:%S'):
+    """
+    Parse a whole column of date strings and localize it to ``tz``.
+
+    :param series: A pandas Series of date strings.
+    :param tz: The timezone the exchange timestamps are expressed in.
+    :param date_format: The format of the date strings (default: '%m/%d/%Y %H:%M:%S').
+    :return: A tz-aware datetime64 Series, NaT where parsing failed.
+    """
+    parsed = pd.to_datetime(series, format=date_format, errors='coerce')
+    return parsed.dt.tz_localize(tz, ambiguous='NaT', nonexistent='NaT')
@@ -0,0 +1,25 @@
+from decimal import Decimal
+import pandas as pd
+
+
+def convert_series_to_decimal(series):
+    """
+    Convert a whole column of raw CSV strings to Decimal in one pass.
+
+    Mirrors ``convert_to_decimal``: units and thousands separators are
+    stripped, a leading '-' keeps the sign and anything that is not a
+    number ('--', 'Market', blanks) becomes Decimal('0.0').
+
+    :param series: A pandas Series of strings.
+    :return: An object Series of Decimal values with the same index.
+    """
+    values = series.fillna('').astype(str).str.strip()
+    negative = values.str.startswith('-')
+    digits = values.str.replace(r'[^\d\.]', '', regex=True)
+
+    valid = digits.str.fullmatch(r'\d+\.?\d*|\.\d+')
+    digits = digits.where(valid, '0.0')
+    digits = digits.where(~(negative & valid), '-' + digits)
+
+    return pd.Series([Decimal(value) for value in digits],
+                     index=series.index, dtype=object)
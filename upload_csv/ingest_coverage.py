@@ -0,0 +1,53 @@
+from .models import IngestedRange
+import pandas as pd
+
+
+class IngestCoverage:
+    """
+    The order time ranges an owner's earlier uploads stored in full, per
+    asset, and the ranges the current upload adds to them.
+
+    ``covers`` masks the rows strictly inside a stored range, which need no
+    dedup; ``extend`` widens the current upload's per-asset span with the
+    rows it kept and ``save`` records those spans once the whole file is in.
+    An upload that stops early saves nothing, so a partial file never hides
+    rows from a later one.
+    """
+
+    def __init__(self, ranges=()):
+        self.ranges = list(ranges)
+        self.spans = {}
+        self.covered_count = 0
+
+    @classmethod
+    def load(cls, owner, exchange):
+        return cls(IngestedRange.objects.filter(owner=owner, exchange=exchange).values_list(
+            'underlying_asset', 'first_order_time', 'last_order_time'))
+
+    def covers(self, assets, order_times):
+        """Return a mask of the rows strictly inside a stored range."""
+        covered = pd.Series(False, index=order_times.index)
+        for asset, first_order_time, last_order_time in self.ranges:
+            covered |= ((assets == asset)
+                        & (order_times > first_order_time)
+                        & (order_times < last_order_time))
+        self.covered_count += int(covered.sum())
+        return covered
+
+    def extend(self, frame):
+        """Widen the spans with a normalized frame's rows."""
+        if frame.empty:
+            return
+        bounds = frame.groupby('underlying_asset')['order_time'].agg(['min', 'max'])
+        for asset, first, last in bounds.itertuples():
+            first, last = first.to_pydatetime(), last.to_pydatetime()
+            if asset in self.spans:
+                span_first, span_last = self.spans[asset]
+                first, last = min(first, span_first), max(last, span_last)
+            self.spans[asset] = (first, last)
+
+    def save(self, owner, exchange):
+        for asset, (first, last) in self.spans.items():
+            # A single second has no inside to skip
+            if first < last:
+                IngestedRange.record(owner, exchange, asset, first, last)
@@ -0,0 +1,4 @@
+from upload_csv.matching.fifo_engine import FifoMatchingEngine, TradeRecord
+from upload_csv.matching.numpy_engine import FixedPointError, NumpyFifoMatchingEngine
+from upload_csv.matching.sql_engine import SqlFifoMatcher
+from upload_csv.matching.position import PositionAccumulator
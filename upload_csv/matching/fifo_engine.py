@@ -0,0 +1,110 @@
+from collections import deque, namedtuple
+from decimal import Decimal
+
+TradeRecord = namedtuple('TradeRecord', ['id', 'side', 'quantity'])
+
+
+class OpenLot:
+    __slots__ = ('trade_id', 'remaining')
+
+    def __init__(self, trade_id, remaining):
+        self.trade_id = trade_id
+        self.remaining = remaining
+
+
+class FifoMatchingEngine:
+    """
+    Match buys against sells first in, first out.
+
+    Trades must be fed in (order_time, id) order. At any time only one side
+    has open lots: a trade first closes the oldest open lots of the other
+    side and whatever is left of it opens a lot of its own, so longs and
+    shorts are both handled. Every trade is visited once and every lot is
+    closed at most once, which keeps a whole asset linear in its fills.
+
+    Each closing is recorded in ``allocations`` as (entry_trade_id,
+    exit_trade_id, quantity, round_trip). ``round_trip`` numbers positions
+    from flat to flat and is the number of positions closed so far.
+    """
+
+    def __init__(self):
+        self.open_lots = deque()
+        self.open_side = None
+        self.quantities = {}
+        self.remaining = {}
+        self.checkpoints = []
+        self.allocations = []
+        self.round_trip = 0
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Rebuild an engine from ``snapshot()`` output to resume matching."""
+        engine = cls()
+        engine.open_side = snapshot['open_side']
+        engine.round_trip = snapshot.get('round_trip', 0)
+        for trade_id, remaining, quantity in snapshot['lots']:
+            engine.open_lots.append(OpenLot(trade_id, Decimal(remaining)))
+            engine.quantities[trade_id] = Decimal(quantity)
+        return engine
+
+    def snapshot(self):
+        """The open lots as JSON-serializable data."""
+        return {
+            'open_side': self.open_side,
+            'round_trip': self.round_trip,
+            'lots': [
+                [lot.trade_id, str(lot.remaining), str(self.quantities[lot.trade_id])]
+                for lot in self.open_lots
+            ],
+        }
+
+    def process(self, trades, checkpoint_at=()):
+        """
+        Feed trades in order.
+
+        :param checkpoint_at: 1-based counts into ``trades`` after which a
+            ``(count, snapshot)`` pair is appended to ``checkpoints``.
+        """
+        marks = iter(sorted(checkpoint_at))
+        next_mark = next(marks, None)
+        for count, trade in enumerate(trades, 1):
+            self.add(trade)
+            if count == next_mark:
+                self.checkpoints.append((count, self.snapshot()))
+                next_mark = next(marks, None)
+        return self
+
+    def add(self, trade):
+        remaining = trade.quantity
+        self.quantities[trade.id] = trade.quantity
+
+        if self.open_side is not None and self.open_side != trade.side:
+            open_lots = self.open_lots
+            while remaining > 0 and open_lots:
+                lot = open_lots[0]
+                matched = min(remaining, lot.remaining)
+                lot.remaining -= matched
+                remaining -= matched
+                self.remaining[lot.trade_id] = lot.remaining
+                self.allocations.append((lot.trade_id, trade.id, matched, self.round_trip))
+                if lot.remaining == 0:
+                    open_lots.popleft()
+            if not open_lots:
+                self.open_side = None
+                self.round_trip += 1
+
+        self.remaining[trade.id] = remaining
+        if remaining > 0:
+            self.open_lots.append(OpenLot(trade.id, remaining))
+            self.open_side = trade.side
+
+    def results(self):
+        """
+        Yield (trade_id, remaining, is_matched, is_partially_matched, is_open)
+        for every trade fed in and every resumed lot that changed.
+        """
+        for trade_id, remaining in self.remaining.items():
+            is_matched = remaining == 0
+            is_open = not is_matched
+            is_partially_matched = is_open and remaining < self.quantities[trade_id]
+            yield trade_id, remaining, is_matched, is_partially_matched, is_open
@@ -0,0 +1,212 @@
+from decimal import Decimal
+from upload_csv.utils.fixed_point import FixedPointError, QUANTITY
+import numpy as np
+
+
+class NumpyFifoMatchingEngine:
+    """
+    FIFO matching over int64 fixed-point arrays.
+
+    Closing the oldest opposite lots first pairs the k-th unit bought with
+    the k-th unit sold, so a trade's matched quantity is the overlap of its
+    slice of its own side's running total with the other side's total. The
+    running totals are cumulative sums and the open lots at any point are
+    found with ``searchsorted``, so there is no per-trade matching loop.
+    Results, allocations and snapshots hold the same values as
+    FifoMatchingEngine's; ``process_columns`` takes the trades as int64
+    columns so they need no conversion from Decimal.
+    """
+    # filled_quantity is stored with 10 decimal places
+    CODEC = QUANTITY
+    MAX_TOTAL = np.iinfo(np.int64).max
+
+    def __init__(self):
+        self.open_side = None
+        self.seed_ids = []
+        self.seed_remaining = []
+        self.seed_quantities = []
+        self.checkpoints = []
+        self.allocation_columns = None
+        self.decoded_allocations = None
+        self.round_trip = 0
+        self.ids = np.empty(0, dtype=np.int64)
+        self.original = np.empty(0, dtype=np.int64)
+        self.remaining = np.empty(0, dtype=np.int64)
+        self.partially_matched = np.empty(0, dtype=bool)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Rebuild an engine from ``snapshot()`` output to resume matching."""
+        engine = cls()
+        engine.open_side = snapshot['open_side']
+        engine.round_trip = snapshot.get('round_trip', 0)
+        for trade_id, remaining, quantity in snapshot['lots']:
+            engine.seed_ids.append(trade_id)
+            engine.seed_remaining.append(cls.CODEC.encode(Decimal(remaining)))
+            engine.seed_quantities.append(cls.CODEC.encode(Decimal(quantity)))
+        return engine
+
+    def process(self, trades, checkpoint_at=()):
+        """
+        Match TradeRecords given in order, after any resumed lots.
+
+        :raises FixedPointError: If a quantity has more than 10 decimal
+            places or the quantities overflow int64.
+        """
+        trades = list(trades)
+        return self.process_columns(
+            np.array([trade.id for trade in trades], dtype=np.int64),
+            np.array([trade.side == 'Buy' for trade in trades], dtype=bool),
+            self.CODEC.encode_array([trade.quantity for trade in trades]),
+            checkpoint_at)
+
+    def process_columns(self, ids, is_buy, quantities, checkpoint_at=()):
+        """
+        Match trades given in order as columns, such as a TradeSnapshot
+        slice, after any resumed lots.
+
+        :param ids: Trade ids, int64.
+        :param is_buy: True for Buy trades, False for Sell ones.
+        :param quantities: Quantities in the CODEC's fixed point, int64.
+        :param checkpoint_at: 1-based counts into the trades after which a
+            ``(count, snapshot)`` pair is appended to ``checkpoints``.
+        :raises FixedPointError: If the quantities overflow int64.
+        """
+        seed_count = len(self.seed_ids)
+        quantity = np.concatenate([self.CODEC.to_array(self.seed_remaining), quantities])
+        # A sum past int64 would wrap silently, so large totals are checked exactly
+        if (len(quantity) and int(quantity.max()) > self.MAX_TOTAL // len(quantity)
+                and sum(quantity.tolist()) > self.MAX_TOTAL):
+            raise FixedPointError("Quantities overflow int64 fixed point.")
+
+        self.ids = np.concatenate([np.array(self.seed_ids, dtype=np.int64), ids])
+        self.is_buy = np.concatenate([np.full(seed_count, self.open_side == 'Buy'), is_buy])
+        # Resumed lots are partial against their original quantity
+        self.original = np.concatenate([self.CODEC.to_array(self.seed_quantities), quantities])
+
+        self.cum_buy = np.cumsum(np.where(self.is_buy, quantity, 0))
+        self.cum_sell = np.cumsum(np.where(self.is_buy, 0, quantity))
+        self.end = np.where(self.is_buy, self.cum_buy, self.cum_sell)
+        self.start = self.end - quantity
+        self.side_index = {
+            'Buy': np.flatnonzero(self.is_buy),
+            'Sell': np.flatnonzero(~self.is_buy),
+        }
+
+        if len(quantity):
+            opposite_total = np.where(self.is_buy, self.cum_sell[-1], self.cum_buy[-1])
+            matched = np.clip(np.minimum(self.end, opposite_total) - self.start, 0, quantity)
+            self.remaining = quantity - matched
+            self.partially_matched = (self.remaining > 0) & (self.remaining < self.original)
+
+        # A position closes where the running position returns to zero or
+        # changes sign; by then min(bought, sold) units have been paired
+        position = self.cum_buy - self.cum_sell
+        previous = np.zeros_like(position)
+        previous[1:] = position[:-1]
+        flat = ((position == 0) & (previous != 0)) | (np.sign(position) * np.sign(previous) < 0)
+        self.round_trip_at = self.round_trip + np.cumsum(flat)
+        self.allocation_columns = self.build_allocations(
+            np.minimum(self.cum_buy, self.cum_sell)[flat])
+        self.decoded_allocations = None
+        self.round_trip += int(flat.sum())
+
+        for count in sorted(checkpoint_at):
+            self.checkpoints.append((count, self.snapshot_at(seed_count + count - 1)))
+        return self
+
+    @property
+    def allocations(self):
+        """
+        (entry_trade_id, exit_trade_id, quantity, round_trip) tuples as
+        FifoMatchingEngine's, decoded from ``allocation_columns`` on first use.
+        """
+        if self.decoded_allocations is None:
+            if self.allocation_columns is None:
+                return []
+            entries, exits, quantities, round_trips = self.allocation_columns
+            self.decoded_allocations = list(zip(
+                entries.tolist(), exits.tolist(),
+                self.CODEC.decode_list(quantities.tolist()), round_trips.tolist()))
+        return self.decoded_allocations
+
+    def build_allocations(self, flat_units):
+        """
+        Split the paired units into runs sharing one buy and one sell; the
+        earlier of the two is the entry. Returns (entry ids, exit ids,
+        fixed-point quantities, round trips) arrays.
+        """
+        if not len(self.ids):
+            return None
+        paired = min(self.cum_buy[-1], self.cum_sell[-1])
+        buy_index, sell_index = self.side_index['Buy'], self.side_index['Sell']
+        buy_end, sell_end = self.end[buy_index], self.end[sell_index]
+
+        ends = np.union1d(buy_end, sell_end)
+        ends = ends[(ends > 0) & (ends <= paired)]
+        starts = np.zeros_like(ends)
+        starts[1:] = ends[:-1]
+        buys = buy_index[np.searchsorted(buy_end, starts, side='right')]
+        sells = sell_index[np.searchsorted(sell_end, starts, side='right')]
+        entries = self.ids[np.minimum(buys, sells)]
+        exits = self.ids[np.maximum(buys, sells)]
+        round_trips = self.round_trip + np.searchsorted(flat_units, starts, side='right')
+
+        return entries, exits, ends - starts, round_trips
+
+    def snapshot_at(self, index):
+        """The open lots after the trade at ``index`` of the combined arrays."""
+        bought, sold = self.cum_buy[index], self.cum_sell[index]
+        round_trip = int(self.round_trip_at[index])
+        if bought == sold:
+            return {'open_side': None, 'round_trip': round_trip, 'lots': []}
+
+        open_side = 'Buy' if bought > sold else 'Sell'
+        side_index = self.side_index[open_side]
+        side_index = side_index[:np.searchsorted(side_index, index, side='right')]
+        # Units up to the smaller running total are closed; later ones are open
+        closed = min(bought, sold)
+        ends = self.end[side_index]
+        lots = side_index[np.searchsorted(ends, closed, side='right'):]
+        lot_remaining = self.end[lots] - np.maximum(self.start[lots], closed)
+        # Empty fills never open a lot
+        lots, lot_remaining = lots[lot_remaining > 0], lot_remaining[lot_remaining > 0]
+
+        return {
+            'open_side': open_side,
+            'round_trip': round_trip,
+            'lots': [
+                list(lot) for lot in zip(
+                    self.ids[lots].tolist(), self.CODEC.text_list(lot_remaining),
+                    self.CODEC.text_list(self.original[lots]))
+            ],
+        }
+
+    def snapshot(self):
+        if not len(self.ids):
+            return {
+                'open_side': self.open_side,
+                'round_trip': self.round_trip,
+                'lots': [
+                    [trade_id, self.CODEC.text(remaining), self.CODEC.text(quantity)]
+                    for trade_id, remaining, quantity in zip(
+                        self.seed_ids, self.seed_remaining, self.seed_quantities)
+                ],
+            }
+        return self.snapshot_at(len(self.ids) - 1)
+
+    def results(self):
+        """
+        Yield (trade_id, remaining, is_matched, is_partially_matched, is_open)
+        for every trade fed in and every resumed lot that changed.
+        """
+        seed_count = len(self.seed_ids)
+        zero = self.CODEC.decode(0)
+        rows = zip(self.ids.tolist(), self.remaining.tolist(), self.partially_matched.tolist())
+        for index, (trade_id, remaining, is_partially_matched) in enumerate(rows):
+            if index < seed_count and remaining == self.seed_remaining[index]:
+                continue
+            if remaining == 0:
+                yield trade_id, zero, True, False, False
+            else:
+                yield trade_id, self.CODEC.decode(remaining), False, is_partially_matched, True
@@ -0,0 +1,60 @@
+from decimal import Decimal, localcontext
+
+
+class PositionAccumulator:
+    """
+    Running position of one asset, fed one trade at a time in
+    (order_time, id) order.
+
+    ``position`` is signed: positive is long, negative is short. Trades
+    adding to the position move ``avg_entry_price`` to the quantity
+    weighted average; trades reducing it realize PnL against that average,
+    and a trade that flips the position opens the rest at its own price.
+    ``realized_pnl`` and ``fees`` are totals since the first trade.
+
+    Prices are kept to 20 decimal places, as stored, so an accumulator
+    resumed from a PositionSnapshot continues exactly as an uninterrupted
+    one where decimals are stored exactly (PostgreSQL). SQLite keeps them
+    as floats, so a resumed run there drifts by float rounding.
+    """
+    PLACES = Decimal('1e-20')
+    # Enough digits for 20 decimal places on any stored value
+    PRECISION = 60
+
+    def __init__(self, position=Decimal('0'), avg_entry_price=Decimal('0'),
+                 realized_pnl=Decimal('0'), fees=Decimal('0')):
+        self.position = position
+        self.avg_entry_price = avg_entry_price
+        self.realized_pnl = realized_pnl
+        self.fees = fees
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Resume from a PositionSnapshot or any object with the same fields."""
+        return cls(snapshot.position, snapshot.avg_entry_price,
+                   snapshot.realized_pnl, snapshot.fees)
+
+    def add(self, side, quantity, price, fee):
+        signed = quantity if side == 'Buy' else -quantity
+        with localcontext() as context:
+            context.prec = self.PRECISION
+            self.fees += fee
+            if not signed:
+                return
+            position = self.position
+            if not position or (position > 0) == (signed > 0):
+                total = abs(position) + quantity
+                self.avg_entry_price = (
+                    (abs(position) * self.avg_entry_price + quantity * price) / total
+                ).quantize(self.PLACES)
+            else:
+                closed = min(quantity, abs(position))
+                direction = 1 if position > 0 else -1
+                self.realized_pnl += (
+                    (price - self.avg_entry_price) * closed * direction
+                ).quantize(self.PLACES)
+                if quantity == abs(position):
+                    self.avg_entry_price = Decimal('0')
+                elif quantity > abs(position):
+                    self.avg_entry_price = price
+            self.position = position + signed
@@ -0,0 +1,203 @@
+from django.db import connection
+
+
+class SqlFifoMatcher:
+    """
+    FIFO matching of one owner's asset in PostgreSQL statements.
+
+    Uses the same unit pairing as NumpyFifoMatchingEngine: a fill's matched
+    quantity is the overlap of its slice of its side's running total with
+    the other side's total. The running totals come from ``SUM() OVER``,
+    so no trade data leaves the database for matching. Only rows whose
+    state changes are written.
+    """
+    FILLS_SQL = """
+        fills AS (
+            SELECT
+                id,
+                side,
+                order_time,
+                avg_fill,
+                fee,
+                quantity,
+                SUM(quantity) OVER (
+                    PARTITION BY owner_id, underlying_asset, side
+                    ORDER BY order_time, id
+                ) AS side_total,
+                SUM(CASE WHEN side = 'Buy' THEN quantity ELSE 0 END) OVER (
+                    ORDER BY order_time, id
+                ) AS bought,
+                SUM(CASE WHEN side = 'Sell' THEN quantity ELSE 0 END) OVER (
+                    ORDER BY order_time, id
+                ) AS sold,
+                ROW_NUMBER() OVER (ORDER BY order_time, id) AS seq
+            FROM (
+                SELECT
+                    id, owner_id, underlying_asset, side, order_time, avg_fill, fee,
+                    COALESCE(original_filled_quantity, filled_quantity) AS quantity
+                FROM {trades}
+                WHERE owner_id = %(owner_id)s
+                    AND underlying_asset = %(asset)s
+                    AND side IN ('Buy', 'Sell')
+            ) asset_trades
+        ),
+        totals AS (
+            SELECT COALESCE(MAX(bought), 0) AS bought, COALESCE(MAX(sold), 0) AS sold
+            FROM fills
+        ),
+        flats AS (
+            -- A position closes where the running position returns to zero
+            -- or changes sign; by then LEAST(bought, sold) units are paired
+            SELECT LEAST(bought, sold) AS units
+            FROM (
+                SELECT
+                    bought,
+                    sold,
+                    bought - sold AS position,
+                    LAG(bought - sold, 1, 0) OVER (ORDER BY seq) AS previous
+                FROM fills
+            ) moves
+            WHERE (position = 0 AND previous <> 0) OR SIGN(position) * SIGN(previous) < 0
+        )
+    """
+
+    MATCH_SQL = """
+        WITH {fills},
+        matched AS (
+            SELECT
+                fills.id,
+                fills.quantity,
+                fills.quantity - GREATEST(
+                    LEAST(
+                        fills.side_total,
+                        CASE WHEN fills.side = 'Buy' THEN totals.sold ELSE totals.bought END
+                    ) - (fills.side_total - fills.quantity),
+                    0
+                ) AS remaining
+            FROM fills CROSS JOIN totals
+        )
+        UPDATE {trades} AS trade
+        SET
+            filled_quantity = matched.remaining,
+            is_matched = matched.remaining = 0,
+            is_partially_matched = matched.remaining > 0 AND matched.remaining < matched.quantity,
+            is_open = matched.remaining > 0
+        FROM matched
+        WHERE trade.id = matched.id
+            AND (
+                trade.filled_quantity IS DISTINCT FROM matched.remaining
+                OR trade.is_matched IS DISTINCT FROM (matched.remaining = 0)
+                OR trade.is_partially_matched IS DISTINCT FROM (
+                    matched.remaining > 0 AND matched.remaining < matched.quantity)
+                OR trade.is_open IS DISTINCT FROM (matched.remaining > 0)
+            )
+    """
+
+    # Paired units are split into runs sharing one buy and one sell: each
+    # run ends at a fill's side_total and lies in the first buy and the
+    # first sell whose side_total reaches that end
+    ALLOCATE_SQL = """
+        INSERT INTO {allocations} (
+            owner_id, underlying_asset, round_trip_number, direction,
+            entry_trade_id, exit_trade_id, entry_time, exit_time, quantity,
+            entry_price, exit_price, entry_fee, exit_fee, realized_pnl
+        )
+        WITH {fills},
+        marks AS (
+            SELECT side_total AS units, side, 0 AS flat FROM fills
+            UNION ALL
+            SELECT units, NULL, 1 FROM flats
+        ),
+        covering AS (
+            SELECT
+                units,
+                MIN(CASE WHEN side = 'Buy' THEN units END) OVER (ORDER BY units DESC) AS buy_total,
+                MIN(CASE WHEN side = 'Sell' THEN units END) OVER (ORDER BY units DESC) AS sell_total,
+                SUM(flat) OVER (ORDER BY units) - SUM(flat) OVER (PARTITION BY units) AS round_trip_number
+            FROM marks
+        ),
+        runs AS (
+            SELECT
+                units AS unit_end,
+                COALESCE(LAG(units) OVER (ORDER BY units), 0) AS unit_start,
+                buy_total,
+                sell_total,
+                round_trip_number
+            FROM (
+                SELECT DISTINCT units, buy_total, sell_total, round_trip_number
+                FROM covering
+                WHERE units > 0
+            ) run_ends
+        ),
+        pairs AS (
+            SELECT
+                runs.round_trip_number,
+                runs.unit_end - runs.unit_start AS quantity,
+                buy.seq < sell.seq AS is_long,
+                buy.id AS buy_id, buy.order_time AS buy_time, buy.avg_fill AS buy_price,
+                buy.fee * (runs.unit_end - runs.unit_start) / buy.quantity AS buy_fee,
+                sell.id AS sell_id, sell.order_time AS sell_time, sell.avg_fill AS sell_price,
+                sell.fee * (runs.unit_end - runs.unit_start) / sell.quantity AS sell_fee
+            FROM runs
+            CROSS JOIN totals
+            JOIN fills buy
+                ON buy.side = 'Buy' AND buy.quantity > 0 AND buy.side_total = runs.buy_total
+            JOIN fills sell
+                ON sell.side = 'Sell' AND sell.quantity > 0 AND sell.side_total = runs.sell_total
+            WHERE runs.unit_end <= LEAST(totals.bought, totals.sold)
+        )
+        SELECT
+            %(owner_id)s,
+            %(asset)s,
+            round_trip_number,
+            CASE WHEN is_long THEN 'Long' ELSE 'Short' END,
+            CASE WHEN is_long THEN buy_id ELSE sell_id END,
+            CASE WHEN is_long THEN sell_id ELSE buy_id END,
+            CASE WHEN is_long THEN buy_time ELSE sell_time END,
+            CASE WHEN is_long THEN sell_time ELSE buy_time END,
+            quantity,
+            CASE WHEN is_long THEN buy_price ELSE sell_price END,
+            CASE WHEN is_long THEN sell_price ELSE buy_price END,
+            CASE WHEN is_long THEN buy_fee ELSE sell_fee END,
+            CASE WHEN is_long THEN sell_fee ELSE buy_fee END,
+            (sell_price - buy_price) * quantity
+        FROM pairs
+    """
+
+    ROUND_TRIPS_SQL = """
+        WITH {fills}
+        SELECT COUNT(*) FROM flats
+    """
+
+    def __init__(self, model, allocation_model):
+        self.model = model
+        self.allocation_model = allocation_model
+
+    @staticmethod
+    def is_supported():
+        return connection.vendor == 'postgresql'
+
+    def render(self, sql):
+        quote_name = connection.ops.quote_name
+        fills = self.FILLS_SQL.format(trades=quote_name(self.model._meta.db_table))
+        return sql.format(
+            fills=fills,
+            trades=quote_name(self.model._meta.db_table),
+            allocations=quote_name(self.allocation_model._meta.db_table),
+        )
+
+    def match_asset(self, owner_id, asset_name):
+        """
+        Re-match every fill of the asset and insert its allocations; the
+        asset's old allocations must already be deleted.
+
+        :return: (rows changed, number of closed round trips)
+        """
+        params = {'owner_id': owner_id, 'asset': asset_name}
+        with connection.cursor() as cursor:
+            cursor.execute(self.render(self.MATCH_SQL), params)
+            changed = cursor.rowcount
+            cursor.execute(self.render(self.ALLOCATE_SQL), params)
+            cursor.execute(self.render(self.ROUND_TRIPS_SQL), params)
+            closed_round_trips = cursor.fetchone()[0]
+        return changed, closed_round_trips
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.11 on 2026-10-18 09:28
+
+from django.db import migrations, models
+from upload_csv.utils.trade_fingerprint import build_trade_fingerprint
+
+
+def backfill_fingerprints(apps, schema_editor):
+    """Fingerprint stored trades; later copies of the same trade keep NULL."""
+    TradeUploadBlofin = apps.get_model('upload_csv', 'TradeUploadBlofin')
+    seen = set()
+    batch = []
+
+    for trade in TradeUploadBlofin.objects.order_by('id').only(
+            'id', 'owner_id', 'order_time', 'underlying_asset', 'fee', 'avg_fill'
+    ).iterator(chunk_size=2000):
+        fingerprint = build_trade_fingerprint(
+            trade.owner_id, trade.order_time, trade.underlying_asset,
+            trade.fee, trade.avg_fill)
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        trade.fingerprint = fingerprint
+        batch.append(trade)
+
+        if len(batch) >= 2000:
+            TradeUploadBlofin.objects.bulk_update(batch, ['fingerprint'])
+            batch = []
+
+    TradeUploadBlofin.objects.bulk_update(batch, ['fingerprint'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('upload_csv', '0007_tradeuploadblofin_is_processed'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='tradeuploadblofin',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='tradeuploadblofin',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_fingerprints, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tradeuploadblofin',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.11 on 2026-10-18 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('upload_csv', '0009_uploadjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadjob',
+            name='assets_done',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='assets_total',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='matching_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='rows_done',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='rows_total',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='stage',
+            field=models.CharField(blank=True, choices=[('parse', 'Parse'), ('dedup', 'Dedup'), ('insert', 'Insert'), ('match', 'Match')], default='', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='uploadjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('canceled', 'Canceled')], default='queued', max_length=10),
+        ),
+    ]
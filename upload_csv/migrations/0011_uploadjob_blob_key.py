@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('upload_csv', '0010_uploadjob_progress'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='uploadjob',
+            name='spool_path',
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='blob_key',
+            field=models.CharField(db_index=True, default='', max_length=64),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.11 on 2026-10-18 09:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_blob_keys(apps, schema_editor):
+    """Existing jobs ingested the whole upload, so their blob is the content."""
+    UploadJob = apps.get_model('upload_csv', 'UploadJob')
+    UploadJob.objects.update(content_hash=models.F('blob_key'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('upload_csv', '0011_uploadjob_blob_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadjob',
+            name='base_job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='delta_jobs', to='upload_csv.uploadjob'),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='body_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='byte_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='header_size',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(copy_blob_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.11 on 2026-10-18 09:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('upload_csv', '0012_uploadjob_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadjob',
+            name='full_reconcile',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='IngestWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('exchange', models.CharField(max_length=100)),
+                ('order_time', models.DateTimeField()),
+                ('boundary_fingerprints', models.JSONField(default=list)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingest_watermarks', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('owner', 'exchange')},
+            },
+        ),
+    ]
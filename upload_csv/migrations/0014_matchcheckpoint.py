@@ -0,0 +1,33 @@
+# Generated by Django 4.2.11 on 2026-10-18 09:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('upload_csv', '0013_ingestwatermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('underlying_asset', models.CharField(max_length=10)),
+                ('order_time', models.DateTimeField()),
+                ('trade_id', models.BigIntegerField()),
+                ('position', models.PositiveIntegerField()),
+                ('state', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='match_checkpoints', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['order_time', 'trade_id'],
+                'indexes': [models.Index(fields=['owner', 'underlying_asset', 'order_time', 'trade_id'], name='upload_csv__owner_i_0e0110_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.2.11 on 2026-10-18 09:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def rematch_from_scratch(apps, schema_editor):
+    """Existing checkpoints carry no round trip numbers, so match every asset again."""
+    MatchCheckpoint = apps.get_model('upload_csv', 'MatchCheckpoint')
+    TradeUploadBlofin = apps.get_model('upload_csv', 'TradeUploadBlofin')
+    MatchCheckpoint.objects.all().delete()
+    TradeUploadBlofin.objects.update(is_processed=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('upload_csv', '0014_matchcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TradeAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('underlying_asset', models.CharField(max_length=10)),
+                ('round_trip_number', models.PositiveIntegerField()),
+                ('direction', models.CharField(choices=[('Long', 'Long'), ('Short', 'Short')], max_length=5)),
+                ('entry_time', models.DateTimeField()),
+                ('exit_time', models.DateTimeField()),
+                ('quantity', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('entry_price', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('exit_price', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('entry_fee', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('exit_fee', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('realized_pnl', models.DecimalField(decimal_places=10, max_digits=30)),
+                ('entry_trade', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exit_allocations', to='upload_csv.tradeuploadblofin')),
+                ('exit_trade', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entry_allocations', to='upload_csv.tradeuploadblofin')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trade_allocations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['exit_time', 'exit_trade_id', 'entry_trade_id'],
+                'indexes': [models.Index(fields=['owner', 'underlying_asset', 'exit_time'], name='upload_csv__owner_i_ef8506_idx'), models.Index(fields=['owner', 'underlying_asset', 'round_trip_number'], name='upload_csv__owner_i_aa9d1f_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RoundTrip',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('underlying_asset', models.CharField(max_length=10)),
+                ('number', models.PositiveIntegerField()),
+                ('direction', models.CharField(choices=[('Long', 'Long'), ('Short', 'Short')], max_length=5)),
+                ('opened_at', models.DateTimeField()),
+                ('closed_at', models.DateTimeField()),
+                ('quantity', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('avg_entry_price', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('avg_exit_price', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('fees', models.DecimalField(decimal_places=10, max_digits=30)),
+                ('realized_pnl', models.DecimalField(decimal_places=10, max_digits=30)),
+                ('allocation_count', models.PositiveIntegerField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='round_trips', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-closed_at'],
+                'indexes': [models.Index(fields=['owner', 'underlying_asset', 'closed_at'], name='upload_csv__owner_i_d0c8d2_idx')],
+                'unique_together': {('owner', 'underlying_asset', 'number')},
+            },
+        ),
+        migrations.RunPython(rematch_from_scratch, migrations.RunPython.noop),
+    ]
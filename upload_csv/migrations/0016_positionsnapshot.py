@@ -0,0 +1,34 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('upload_csv', '0015_tradeallocation_roundtrip'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('underlying_asset', models.CharField(max_length=10)),
+                ('order_time', models.DateTimeField()),
+                ('position', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('avg_entry_price', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('realized_pnl', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('fees', models.DecimalField(decimal_places=10, max_digits=30)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='position_snapshots', to=settings.AUTH_USER_MODEL)),
+                ('trade', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='position_snapshot', to='upload_csv.tradeuploadblofin')),
+            ],
+            options={
+                'ordering': ['order_time', 'trade_id'],
+                'indexes': [models.Index(fields=['owner', 'underlying_asset', 'order_time', 'trade'], name='upload_csv__owner_i_0a32fd_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:20
+
+from django.db import migrations, models
+import json
+
+
+def copy_trade_ids(apps, schema_editor):
+    """Link each live position to the trades its JSON list named."""
+    LiveTrades = apps.get_model('upload_csv', 'LiveTrades')
+    TradeUploadBlofin = apps.get_model('upload_csv', 'TradeUploadBlofin')
+    for live_trade in LiveTrades.objects.exclude(trade_ids__in=['', '[]']):
+        try:
+            trade_ids = json.loads(live_trade.trade_ids)
+        except ValueError:
+            continue
+        live_trade.trades.set(TradeUploadBlofin.objects.filter(
+            owner_id=live_trade.owner_id, id__in=trade_ids))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('upload_csv', '0016_positionsnapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='livetrades',
+            name='long_short',
+            field=models.CharField(blank=True, max_length=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='livetrades',
+            name='trades',
+            field=models.ManyToManyField(blank=True, related_name='live_trades', to='upload_csv.tradeuploadblofin'),
+        ),
+        migrations.RunPython(copy_trade_ids, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='livetrades',
+            name='trade_ids',
+        ),
+        migrations.RenameField(
+            model_name='livetrades',
+            old_name='trades',
+            new_name='trade_ids',
+        ),
+    ]
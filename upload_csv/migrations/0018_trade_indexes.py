@@ -0,0 +1,37 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('upload_csv', '0017_livetrades_trade_links'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tradeuploadblofin',
+            index=models.Index(fields=['owner', 'underlying_asset', 'order_time', 'id'], name='trade_owner_asset_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tradeuploadblofin',
+            index=models.Index(fields=['owner', 'underlying_asset', 'side', 'order_time'], name='trade_owner_asset_side_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tradeuploadblofin',
+            index=models.Index(fields=['file_name'], name='trade_file_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tradeuploadblofin',
+            index=models.Index(fields=['-order_time'], name='trade_order_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tradeuploadblofin',
+            index=models.Index(condition=models.Q(('is_processed', False)), fields=['owner', 'underlying_asset', 'order_time', 'id'], name='trade_unprocessed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tradeuploadblofin',
+            index=models.Index(condition=models.Q(('is_open', True)), fields=['owner', 'underlying_asset', 'order_time', 'id'], name='trade_open_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('upload_csv', '0018_trade_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadjob',
+            name='base_job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='delta_jobs', to='upload_csv.uploadjob'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('upload_csv', '0019_uploadjob_base_job_set_null'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('canceling', 'Canceling'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('canceled', 'Canceled')], default='queued', max_length=10),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('upload_csv', '0020_uploadjob_canceling_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestedRange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('exchange', models.CharField(max_length=100)),
+                ('underlying_asset', models.CharField(max_length=10)),
+                ('first_order_time', models.DateTimeField()),
+                ('last_order_time', models.DateTimeField()),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingested_ranges', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='covered_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.DeleteModel(
+            name='IngestWatermark',
+        ),
+        migrations.AddIndex(
+            model_name='ingestedrange',
+            index=models.Index(fields=['owner', 'exchange', 'underlying_asset'], name='upload_csv__owner_i_085f74_idx'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
 from decimal import Decimal
+from upload_csv.utils.trade_fingerprint import build_trade_fingerprint
 
 class TradeUploadBlofin(models.Model):
     EXCHANGE_CHOICES = [
@@ -39,15 +40,39 @@ class TradeUploadBlofin(models.Model):
     is_partially_matched = models.BooleanField(default=False)
     last_updated = models.DateTimeField(auto_now=True)
     is_processed = models.BooleanField(default=False)
+    fingerprint = models.CharField(
+        max_length=64, unique=True, null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['-order_time']
-        unique_together = ('underlying_asset',
-                           'avg_fill', 'fee')
+        indexes = [
+            # Matching reads, snapshots and range deletes of one asset
+            models.Index(fields=['owner', 'underlying_asset', 'order_time', 'id'],
+                         name='trade_owner_asset_time_idx'),
+            models.Index(fields=['owner', 'underlying_asset', 'side', 'order_time'],
+                         name='trade_owner_asset_side_idx'),
+            models.Index(fields=['file_name'], name='trade_file_name_idx'),
+            models.Index(fields=['-order_time'], name='trade_order_time_idx'),
+            # Only the few trades still waiting for matching, or still open
+            models.Index(fields=['owner', 'underlying_asset', 'order_time', 'id'],
+                         condition=models.Q(is_processed=False), name='trade_unprocessed_idx'),
+            models.Index(fields=['owner', 'underlying_asset', 'order_time', 'id'],
+                         condition=models.Q(is_open=True), name='trade_open_idx'),
+        ]
 
     def __str__(self):
         return f"{self.underlying_asset} - {self.side}"
 
+    def refresh_fingerprint(self):
+        self.fingerprint = build_trade_fingerprint(
+            self.owner_id, self.order_time, self.underlying_asset,
+            self.fee, self.avg_fill)
+
+    def save(self, *args, **kwargs):
+        if self.fingerprint is None:
+            self.refresh_fingerprint()
+        super().save(*args, **kwargs)
+
 class FileName(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='file_names')
     file_name = models.CharField(max_length=250, unique=True)
@@ -58,12 +83,225 @@ class FileName(models.Model):
     def __str__(self):
         return self.file_name
 
+class UploadJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('canceling', 'Canceling'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('canceled', 'Canceled'),
+    ]
+    # A canceling job stops at its next chunk or asset boundary
+    ACTIVE_STATUSES = ('queued', 'running', 'canceling')
+    STAGE_CHOICES = [
+        ('parse', 'Parse'),
+        ('dedup', 'Dedup'),
+        ('insert', 'Insert'),
+        ('match', 'Match'),
+    ]
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='upload_jobs')
+    file_name_entry = models.ForeignKey(
+        FileName, on_delete=models.CASCADE, related_name='upload_jobs')
+    exchange = models.CharField(max_length=100)
+    # Cleared once trades the upload relied on are deleted, so the same file
+    # or an export extending it is ingested again in full
+    content_hash = models.CharField(max_length=64, db_index=True, blank=True, default='')
+    blob_key = models.CharField(max_length=64, db_index=True)
+    byte_size = models.BigIntegerField(default=0)
+    header_size = models.IntegerField(default=0)
+    body_hash = models.CharField(max_length=64, blank=True, default='')
+    # Outlives the base upload: deleting its file hands its trades on to
+    # the delta (see DeleteTradesByFileNameView)
+    base_job = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='delta_jobs')
+    full_reconcile = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default='queued')
+    stage = models.CharField(
+        max_length=10, choices=STAGE_CHOICES, blank=True, default='')
+    rows_total = models.IntegerField(default=0)
+    rows_done = models.IntegerField(default=0)
+    assets_total = models.IntegerField(default=0)
+    assets_done = models.IntegerField(default=0)
+    new_trades_count = models.IntegerField(default=0)
+    duplicates_count = models.IntegerField(default=0)
+    canceled_count = models.IntegerField(default=0)
+    # Rows inside ranges earlier uploads already stored, which skip dedup
+    covered_count = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    matching_started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.file_name_entry} - {self.status}"
+
+class IngestedRange(models.Model):
+    """
+    An order time range of an owner's trades in one asset on an exchange
+    that an upload stored in full; rows strictly inside it are already
+    stored and skip dedup. Rows on its edges may share a second with trades
+    a later export adds, so they are still checked.
+    """
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='ingested_ranges')
+    exchange = models.CharField(max_length=100)
+    underlying_asset = models.CharField(max_length=10)
+    first_order_time = models.DateTimeField()
+    last_order_time = models.DateTimeField()
+    last_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['owner', 'exchange', 'underlying_asset'])]
+
+    def __str__(self):
+        return (f"{self.owner} - {self.exchange} {self.underlying_asset} "
+                f"{self.first_order_time} to {self.last_order_time}")
+
+    @classmethod
+    def record(cls, owner, exchange, underlying_asset, first_order_time, last_order_time):
+        """Add a stored range, merging it with the ranges it overlaps."""
+        with transaction.atomic():
+            overlapping = list(cls.objects.select_for_update().filter(
+                owner=owner, exchange=exchange, underlying_asset=underlying_asset,
+                first_order_time__lt=last_order_time,
+                last_order_time__gt=first_order_time))
+            for stored in overlapping:
+                first_order_time = min(first_order_time, stored.first_order_time)
+                last_order_time = max(last_order_time, stored.last_order_time)
+            cls.objects.filter(id__in=[stored.id for stored in overlapping]).delete()
+            return cls.objects.create(
+                owner=owner, exchange=exchange, underlying_asset=underlying_asset,
+                first_order_time=first_order_time, last_order_time=last_order_time)
+
+class MatchCheckpoint(models.Model):
+    """
+    The open FIFO lots of an owner's asset after the trade at
+    (order_time, trade_id), so matching can resume from there.
+    """
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='match_checkpoints')
+    underlying_asset = models.CharField(max_length=10)
+    order_time = models.DateTimeField()
+    trade_id = models.BigIntegerField()
+    position = models.PositiveIntegerField()
+    state = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['order_time', 'trade_id']
+        indexes = [
+            models.Index(fields=['owner', 'underlying_asset', 'order_time', 'trade_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.underlying_asset} @ {self.order_time} ({self.trade_id})"
+
+class TradeAllocation(models.Model):
+    """A quantity of an entry trade closed by a later exit trade."""
+    DIRECTION_CHOICES = [
+        ('Long', 'Long'),
+        ('Short', 'Short'),
+    ]
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='trade_allocations')
+    underlying_asset = models.CharField(max_length=10)
+    round_trip_number = models.PositiveIntegerField()
+    direction = models.CharField(max_length=5, choices=DIRECTION_CHOICES)
+    entry_trade = models.ForeignKey(
+        TradeUploadBlofin, on_delete=models.CASCADE, related_name='exit_allocations')
+    exit_trade = models.ForeignKey(
+        TradeUploadBlofin, on_delete=models.CASCADE, related_name='entry_allocations')
+    entry_time = models.DateTimeField()
+    exit_time = models.DateTimeField()
+    quantity = models.DecimalField(max_digits=20, decimal_places=10)
+    entry_price = models.DecimalField(max_digits=40, decimal_places=20)
+    exit_price = models.DecimalField(max_digits=40, decimal_places=20)
+    entry_fee = models.DecimalField(max_digits=20, decimal_places=10)
+    exit_fee = models.DecimalField(max_digits=20, decimal_places=10)
+    realized_pnl = models.DecimalField(max_digits=30, decimal_places=10)
+
+    class Meta:
+        ordering = ['exit_time', 'exit_trade_id', 'entry_trade_id']
+        indexes = [
+            models.Index(fields=['owner', 'underlying_asset', 'exit_time']),
+            models.Index(fields=['owner', 'underlying_asset', 'round_trip_number']),
+        ]
+
+    def __str__(self):
+        return f"{self.underlying_asset} {self.direction} {self.quantity} ({self.entry_trade_id} -> {self.exit_trade_id})"
+
+class RoundTrip(models.Model):
+    """A closed position, from flat back to flat, summed over its allocations."""
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='round_trips')
+    underlying_asset = models.CharField(max_length=10)
+    number = models.PositiveIntegerField()
+    direction = models.CharField(max_length=5, choices=TradeAllocation.DIRECTION_CHOICES)
+    opened_at = models.DateTimeField()
+    closed_at = models.DateTimeField()
+    quantity = models.DecimalField(max_digits=20, decimal_places=10)
+    avg_entry_price = models.DecimalField(max_digits=40, decimal_places=20)
+    avg_exit_price = models.DecimalField(max_digits=40, decimal_places=20)
+    fees = models.DecimalField(max_digits=30, decimal_places=10)
+    realized_pnl = models.DecimalField(max_digits=30, decimal_places=10)
+    allocation_count = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('owner', 'underlying_asset', 'number')
+        ordering = ['-closed_at']
+        indexes = [
+            models.Index(fields=['owner', 'underlying_asset', 'closed_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.underlying_asset} {self.direction} #{self.number}: {self.realized_pnl}"
+
+class PositionSnapshot(models.Model):
+    """
+    An owner's running position in an asset just after one trade, as
+    kept by PositionAccumulator. The latest one is the current position.
+    """
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='position_snapshots')
+    underlying_asset = models.CharField(max_length=10)
+    trade = models.OneToOneField(
+        TradeUploadBlofin, on_delete=models.CASCADE, related_name='position_snapshot')
+    order_time = models.DateTimeField()
+    position = models.DecimalField(max_digits=20, decimal_places=10)
+    avg_entry_price = models.DecimalField(max_digits=40, decimal_places=20)
+    realized_pnl = models.DecimalField(max_digits=40, decimal_places=20)
+    fees = models.DecimalField(max_digits=30, decimal_places=10)
+
+    class Meta:
+        ordering = ['order_time', 'trade_id']
+        indexes = [
+            models.Index(fields=['owner', 'underlying_asset', 'order_time', 'trade']),
+        ]
+
+    def __str__(self):
+        return f"{self.underlying_asset} {self.position} @ {self.avg_entry_price} ({self.trade_id})"
+
+    @classmethod
+    def current(cls, owner, asset_name):
+        """The asset's latest snapshot, or None before its first trade."""
+        return cls.objects.filter(
+            owner=owner, underlying_asset=asset_name
+        ).order_by('order_time', 'trade_id').last()
+
 class LiveTrades(models.Model):
     owner = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name='live_trades')
     asset = models.CharField(max_length=10)
     total_quantity = models.DecimalField(max_digits=20, decimal_places=10)
-    long_short = models.CharField(max_length=4, blank=True, null=True)
+    long_short = models.CharField(max_length=5, blank=True, null=True)
     live_fill = models.DecimalField(
         max_digits=20, decimal_places=10, blank=True, null=True)
     live_price = models.DecimalField(
@@ -73,15 +311,16 @@ class LiveTrades(models.Model):
     live_percentage = models.DecimalField(
         max_digits=20, decimal_places=2, null=True, blank=True)
     last_updated = models.DateTimeField(auto_now=True)
-    trade_ids = models.TextField(default='[]')
+    # The trades whose open lots make up the position
+    trade_ids = models.ManyToManyField(
+        TradeUploadBlofin, related_name='live_trades', blank=True)
     is_live = models.BooleanField(default=False)
 
     def get_trade_ids(self):
-        # Deserialize JSON string to list
-        return json.loads(self.trade_ids)
+        return list(self.trade_ids.values_list('id', flat=True))
 
     def set_trade_ids(self, trade_ids):
-        self.trade_ids = json.dumps(trade_ids)
+        self.trade_ids.set(trade_ids)
 
     class Meta:
         unique_together = ('owner', 'asset')
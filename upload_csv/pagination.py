@@ -0,0 +1,195 @@
+from base64 import b64decode, b64encode
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from functools import reduce
+import json
+import operator
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on the queryset's ordering with ``id`` appended as a
+    tiebreaker, e.g. (order_time, id) by default on trades. A cursor holds
+    the ordering values of the row it stops at, and the next page is read
+    with a WHERE on them rather than an OFFSET, and without a COUNT, so
+    every page costs the same however deep it is.
+
+    The ordering is whatever the view's OrderingFilter left on the
+    queryset. Ordered fields must not be nullable, and ``values()`` rows
+    must include them by attname (``owner_id``).
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE') or 10
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, queryset):
+        """Return the ordering as [(field, descending)], ending with ``id``."""
+        model = queryset.model
+        ordering = []
+        for name in queryset.query.order_by or model._meta.ordering:
+            if not isinstance(name, str) or name.lstrip('-') == '?':
+                raise ValueError("Keyset pagination needs a plain field ordering.")
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+            ordering.append((field, descending))
+        if not any(field.primary_key for field, _ in ordering):
+            descending = ordering[-1][1] if ordering else False
+            ordering.append((model._meta.pk, descending))
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.model = queryset.model
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        position, reverse = self.decode_cursor(request)
+
+        ordering = [
+            ('-' if descending != reverse else '') + field.attname
+            for field, descending in self.ordering
+        ]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(position, reverse))
+
+        # One extra row tells whether there is a page beyond this one
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.page = results
+        # Moving backwards always came from a page after this one
+        self.has_next = has_more if not reverse else position is not None
+        self.has_previous = position is not None if not reverse else has_more
+        return results
+
+    def after(self, position, reverse):
+        """Rows strictly after ``position`` in the (possibly reversed) ordering."""
+        conditions = []
+        equal = Q()
+        for (field, descending), value in zip(self.ordering, position):
+            lookup = 'lt' if descending != reverse else 'gt'
+            conditions.append(equal & Q(**{f"{field.attname}__{lookup}": value}))
+            equal &= Q(**{field.attname: value})
+        return reduce(operator.or_, conditions)
+
+    def position_of(self, obj):
+        if isinstance(obj, dict):
+            # A values() row, which must hold the ordering columns
+            obj = self.model(**{field.attname: obj[field.attname] for field, _ in self.ordering})
+        return [field.value_to_string(obj) for field, _ in self.ordering]
+
+    def encode_cursor(self, position, reverse):
+        data = {'p': position}
+        if reverse:
+            data['r'] = 1
+        cursor = b64encode(json.dumps(data, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def first_page_link(self):
+        url = remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return replace_query_param(url, OptionalKeysetPagination.mode_query_param, 'cursor')
+
+    def decode_cursor(self, request):
+        """Return (position, reverse), or (None, False) for the first page."""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(b64decode(cursor.encode(), validate=True))
+            values = data['p']
+            if len(values) != len(self.ordering):
+                raise ValueError("Cursor does not match the ordering.")
+            position = [field.to_python(value) for (field, _), value in zip(self.ordering, values)]
+            return position, bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, ValidationError, FieldDoesNotExist):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # Only reachable moving backwards past the start
+            return self.first_page_link()
+        return self.encode_cursor(self.position_of(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return self.first_page_link()
+        return self.encode_cursor(self.position_of(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class OptionalKeysetPagination(BasePagination):
+    """
+    Page numbers as before, unless the client opts in to keyset pages with
+    ``?pagination=cursor``; links from keyset pages carry a ``cursor``,
+    which keeps the following requests in that mode.
+    """
+    mode_query_param = 'pagination'
+
+    def __init__(self):
+        self.paginator = PageNumberPagination()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (request.query_params.get(self.mode_query_param) == 'cursor'
+                or KeysetPagination.cursor_query_param in request.query_params):
+            self.paginator = KeysetPagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.paginator.get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        return self.paginator.get_schema_operation_parameters(view) + [
+            {
+                'name': self.mode_query_param,
+                'required': False,
+                'in': 'query',
+                'description': "'cursor' for keyset pages without a count.",
+                'schema': {'type': 'string', 'enum': ['cursor']},
+            },
+        ]
@@ -0,0 +1,122 @@
+from django.db.models import F
+from django.utils import timezone
+from .models import FileName, UploadJob
+
+
+class UploadCanceled(Exception):
+    """Raised at a chunk boundary once the user has canceled the upload."""
+
+
+class IngestProgress:
+    """Progress hooks called by the ingest and matching loops; no-ops by default."""
+
+    def start_stage(self, stage):
+        pass
+
+    def advance(self, rows):
+        pass
+
+    def check_canceled(self):
+        pass
+
+    def start_matching(self, assets_total):
+        pass
+
+    def asset_matched(self):
+        pass
+
+    def matching_finished(self, status='succeeded', error=''):
+        pass
+
+    def finish(self, status, error=''):
+        pass
+
+
+class UploadJobProgress(IngestProgress):
+    """Record progress on an UploadJob and stop once it is canceled."""
+
+    def __init__(self, job):
+        self.job = job
+
+    def start_stage(self, stage):
+        if self.job.stage == stage:
+            return
+        self.job.stage = stage
+        UploadJob.objects.filter(id=self.job.id).update(stage=stage)
+
+    def advance(self, rows):
+        UploadJob.objects.filter(id=self.job.id).update(rows_done=F('rows_done') + rows)
+
+    def is_canceled(self):
+        return UploadJob.objects.filter(
+            id=self.job.id, status__in=('canceling', 'canceled')).exists()
+
+    def check_canceled(self):
+        if self.is_canceled():
+            raise UploadCanceled(f"Upload job {self.job.id} was canceled.")
+
+    def start_matching(self, assets_total):
+        self.job.stage = 'match'
+        self.job.assets_total = assets_total
+        self.job.matching_started_at = timezone.now()
+        self.job.save(update_fields=['stage', 'assets_total', 'matching_started_at'])
+
+    def asset_matched(self):
+        UploadJob.objects.filter(id=self.job.id).update(assets_done=F('assets_done') + 1)
+
+    def matching_finished(self, status='succeeded', error=''):
+        """Close the job unless it was canceled or failed meanwhile."""
+        # A pass shared with other uploads runs on after one is canceled
+        if status == 'succeeded' and self.is_canceled():
+            status = 'canceled'
+        completed = UploadJob.objects.filter(
+            id=self.job.id, status__in=('running', 'canceling')
+        ).update(status=status, error=error, finished_at=timezone.now())
+        if completed:
+            FileName.objects.filter(id=self.job.file_name_entry_id).update(processing=False)
+
+    def finish(self, status, error=''):
+        self.job.status = status
+        self.job.error = error
+        self.job.finished_at = timezone.now()
+        self.job.save(update_fields=['status', 'error', 'finished_at'])
+        FileName.objects.filter(id=self.job.file_name_entry_id).update(processing=False)
+
+
+class JobGroupProgress(IngestProgress):
+    """
+    Report one matching pass to every upload job coalesced into it. The
+    pass stops only once all of the jobs are canceled.
+    """
+
+    def __init__(self, members):
+        self.members = members
+
+    def start_stage(self, stage):
+        for member in self.members:
+            member.start_stage(stage)
+
+    def advance(self, rows):
+        for member in self.members:
+            member.advance(rows)
+
+    def check_canceled(self):
+        if self.members and all(member.is_canceled() for member in self.members):
+            raise UploadCanceled("Every upload job of the matching pass was canceled.")
+
+    def start_matching(self, assets_total):
+        for member in self.members:
+            member.start_matching(assets_total)
+
+    def asset_matched(self):
+        UploadJob.objects.filter(
+            id__in=[member.job.id for member in self.members]
+        ).update(assets_done=F('assets_done') + 1)
+
+    def matching_finished(self, status='succeeded', error=''):
+        for member in self.members:
+            member.matching_finished(status, error)
+
+    def finish(self, status, error=''):
+        for member in self.members:
+            member.finish(status, error)
@@ -1,9 +1,12 @@
-from rest_framework import serializers
-from .models import TradeUploadBlofin, FileName, LiveTrades
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from .models import TradeUploadBlofin, FileName, LiveTrades, UploadJob
 from collections import defaultdict
 from decimal import Decimal
 from django.contrib.auth.models import User
-from upload_csv.utils.convert_fields_to_readable import FormattingUtils
+from django.db.models import QuerySet
+from django.utils import timezone
+from upload_csv.utils.convert_fields_to_readable import BandedFormatter, FormattingUtils
 
 
 
@@ -13,10 +16,51 @@ class FileNameSerializer(serializers.ModelSerializer):
         fields = ['id', 'file_name', 'trade_count', 'owner', 'processing', 'cancel_processing']
 
 
+class UploadJobSerializer(serializers.ModelSerializer):
+    file_name = serializers.ReadOnlyField(source='file_name_entry.file_name')
+    throughput = serializers.SerializerMethodField()
+    eta_seconds = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadJob
+        fields = ['id', 'file_name', 'exchange', 'status', 'stage',
+                  'rows_done', 'rows_total', 'assets_done', 'assets_total',
+                  'throughput', 'eta_seconds', 'new_trades_count',
+                  'duplicates_count', 'canceled_count', 'covered_count', 'error',
+                  'created_at', 'started_at', 'finished_at']
+
+    def stage_rate(self, obj):
+        """Return (done, total, items per second) for the current stage."""
+        if obj.stage == 'match':
+            done, total, since = obj.assets_done, obj.assets_total, obj.matching_started_at
+        else:
+            done, total, since = obj.rows_done, obj.rows_total, obj.started_at
+
+        if since is None:
+            return done, total, None
+        elapsed = ((obj.finished_at or timezone.now()) - since).total_seconds()
+        if elapsed <= 0:
+            return done, total, None
+        return done, total, done / elapsed
+
+    def get_throughput(self, obj):
+        done, total, rate = self.stage_rate(obj)
+        return round(rate, 2) if rate is not None else None
+
+    def get_eta_seconds(self, obj):
+        if obj.status != 'running':
+            return None
+        done, total, rate = self.stage_rate(obj)
+        if not rate:
+            return None
+        return round(max(total - done, 0) / rate, 1)
+
+
 class FileUploadSerializer(serializers.Serializer):
     file = serializers.FileField()
     exchange = serializers.ChoiceField(
         choices=[('BloFin', 'BloFin'), ('OtherExchange', 'Other Exchange')])
+    full_reconcile = serializers.BooleanField(required=False, default=False)
 
 class LiveTradesSerializer(serializers.ModelSerializer):
     class Meta:
@@ -60,3 +104,97 @@ class SaveTradeSerializer(serializers.ModelSerializer):
 
     def get_price_formatted(self, obj):
         return FormattingUtils.formatted_price(obj.price, obj.avg_fill, obj.is_open)
+
+
+class TradeValuesListSerializer(serializers.ListSerializer):
+    """
+    Renders SaveTradeSerializer rows from ``values()`` dicts with the
+    formatted columns done a column at a time, without model instances or
+    a method call per field. The output is the same as the regular list.
+    """
+    FORMATTED = {'avg_fill_formatted', 'filled_quantity_formatted',
+                 'original_filled_quantity_formatted', 'pnl_formatted',
+                 'pnl_percentage_formatted', 'price_formatted'}
+
+    def to_representation(self, data):
+        rows = data.values(*self.child.values_fields) if isinstance(data, QuerySet) else data
+        rows = [row if isinstance(row, dict) else self.row_of(row) for row in rows]
+        columns = {name: [row[name] for row in rows] for name in self.child.values_fields}
+        formatted = self.format_columns(columns)
+
+        fields = []
+        for field in self.child._readable_fields:
+            name = field.field_name
+            if name in formatted:
+                fields.append((name, formatted[name]))
+            elif name == 'owner':
+                fields.append((name, columns['owner_id']))
+            elif isinstance(field, serializers.DateTimeField):
+                fields.append((name, self.datetime_column(field, columns[name])))
+            else:
+                fields.append((name, [None if value is None else field.to_representation(value)
+                                      for value in columns[name]]))
+        names = [name for name, _ in fields]
+        return [dict(zip(names, values)) for values in zip(*(values for _, values in fields))]
+
+    def datetime_column(self, field, values):
+        """
+        ``DateTimeField.to_representation`` with the field's timezone and
+        format looked up once rather than per value.
+        """
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        if output_format is None or output_format.lower() == ISO_8601 or field_timezone is None:
+            return [None if value is None else field.to_representation(value) for value in values]
+        return [
+            None if value is None
+            else value.astimezone(field_timezone).strftime(output_format) if timezone.is_aware(value)
+            else field.to_representation(value)
+            for value in values
+        ]
+
+    def row_of(self, trade):
+        return {name: getattr(trade, name) for name in self.child.values_fields}
+
+    def format_columns(self, columns):
+        """The SaveTradeSerializer method fields, one column at a time."""
+        formatter = BandedFormatter()
+        avg_fills, prices, is_open = columns['avg_fill'], columns['price'], columns['is_open']
+        zero = Decimal('0.0')
+
+        def pnl_column(values, format_value):
+            # As FormattingUtils.formatted_pnl and formatted_percentage,
+            # which SaveTradeSerializer passes is_open as the default
+            return [
+                '--' if avg_fill == price or (price == zero and value == zero)
+                else format_value(value) if value is not None else default
+                for value, avg_fill, price, default in zip(values, avg_fills, prices, is_open)
+            ]
+
+        return {
+            'avg_fill_formatted': formatter.format_list(avg_fills),
+            'filled_quantity_formatted': formatter.format_list(columns['filled_quantity']),
+            'original_filled_quantity_formatted': formatter.format_list(columns['original_filled_quantity']),
+            'pnl_formatted': pnl_column(columns['pnl'], formatter.format),
+            'pnl_percentage_formatted': pnl_column(columns['pnl_percentage'],
+                                                   lambda value: f"{Decimal(value):.2f}%"),
+            'price_formatted': [
+                '--' if avg_fill == price or (not open_ and price == zero)
+                else formatter.format(price)
+                for price, avg_fill, open_ in zip(prices, avg_fills, is_open)
+            ],
+        }
+
+
+class FastSaveTradeSerializer(SaveTradeSerializer):
+    """
+    SaveTradeSerializer whose lists render from ``values()`` rows; views
+    that list with it pass a values queryset, see ValuesListMixin.
+    """
+    values_fields = ['id', 'owner_id', 'file_name', 'underlying_asset', 'margin_mode',
+                     'leverage', 'order_time', 'side', 'avg_fill', 'price', 'filled_quantity',
+                     'original_filled_quantity', 'pnl', 'pnl_percentage', 'fee', 'exchange',
+                     'trade_status', 'is_open', 'is_matched', 'last_updated', 'is_processed']
+
+    class Meta(SaveTradeSerializer.Meta):
+        list_serializer_class = TradeValuesListSerializer
@@ -1,81 +1,222 @@
-from celery import shared_task
-from django.contrib.auth.models import User
-from .trade_matcher import TradeIdMatcher, TradeMatcherProcessor
-from .models import FileName, TradeUploadBlofin
+from celery import chord, shared_task
+from .trade_matcher import TradeMatcherProcessor
+from .models import FileName, TradeUploadBlofin, UploadJob
+from .progress import IngestProgress, JobGroupProgress, UploadCanceled, UploadJobProgress
+from .blob_store import BlobStore
+from .upload_delta import find_superset_delta
+from .coordination import LeaseUnavailable, asset_lease, get_dirty_assets
+from upload_csv.exchange.blofin.csv_processor import CsvProcessor
+from django.conf import settings
 from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from celery.exceptions import SoftTimeLimitExceeded
-import time
 import logging
 
 logger = logging.getLogger(__name__)
 
-@shared_task(bind=True, max_retries=5)
-def process_trade_ids_in_background(self, owner_id):
-    try:
-        logger.debug(f"Starting background processing for owner: {owner_id}")
-        processor = TradeIdMatcher(owner=owner_id)
-
-        # Fetch unprocessed trades only
-        with transaction.atomic():
-            asset_ids = processor.check_trade_ids(chunk_size=100)
-            if not asset_ids:
-                logger.info(f"No more trades to process for owner: {owner_id}")
-                return "All trades processed"  # Exit task when no unprocessed trades remain
-            logger.debug(f"Completed processing trade IDs: {asset_ids}")
-
-    except Exception as e:
-        logger.error(f"Error in processing trade IDs for owner {owner_id}: {str(e)}")
-        raise self.retry(exc=e, countdown=5)  # Retry with a delay
+# Retries of a matching task before its chord gives up on the pass: the
+# time limit may cut a long asset short a few times, and another run may
+# hold the asset's lease for up to MATCH_LEASE_SECONDS, retried every 5 s
+MATCH_TIME_LIMIT_RETRIES = 10
+MATCH_LEASE_RETRIES = 60
+
+def release_blob(blob_store, key, job_id=None):
+    """Delete a stored upload unless another pending job still needs it."""
+    pending = UploadJob.objects.filter(
+        Q(content_hash=key) | Q(blob_key=key), status__in=UploadJob.ACTIVE_STATUSES)
+    if not pending.exclude(id=job_id).exists():
+        blob_store.delete(key)
+
+
+def get_job_progress(job_id):
+    """
+    Return the progress reporter for an upload job, a list of jobs sharing
+    a matching pass, or a no-op one.
+    """
+    if job_id is None:
+        return IngestProgress()
+    if isinstance(job_id, list):
+        # Jobs deleted since the pass was scheduled are skipped
+        return JobGroupProgress([
+            UploadJobProgress(job) for job in UploadJob.objects.filter(id__in=job_id)])
+    return UploadJobProgress(UploadJob.objects.get(id=job_id))
 
 
 @shared_task(bind=True, max_retries=5)
-def process_asset_in_background(self, owner_id, asset_name):
+def process_asset_in_background(self, owner_id, asset_name, job_id=None,
+                                batch_size=TradeMatcherProcessor.BATCH_SIZE,
+                                time_limit_retries=0):
+    batches = 0
     try:
         logger.debug(f"Processing asset: {asset_name} for owner: {owner_id}")
-        processor = TradeMatcherProcessor(owner=owner_id)
-
-        # Process unprocessed trades for the asset in chunks
-        with transaction.atomic():
-            remaining_trades = processor.process_assets(asset_name, chunk_size=100)
-            if remaining_trades == 0:
-                logger.debug(f"All trades processed for asset: {asset_name}")
-                return True  # Stop processing when all trades are done
-
+        progress = get_job_progress(job_id)
+        processor = TradeMatcherProcessor(owner=owner_id, progress=progress)
+
+        # Only one run may rewrite an asset's trades at a time
+        with asset_lease(owner_id, asset_name):
+            # Each batch commits with its checkpoint, so a stopped run
+            # loses at most the batch in progress
+            remaining_trades = None
+            while remaining_trades != 0:
+                with transaction.atomic():
+                    remaining_trades = processor.process_assets(
+                        asset_name, chunk_size=100, batch_size=batch_size)
+                batches += 1
+        progress.asset_matched()
+        logger.debug(f"All trades processed for asset: {asset_name}")
+        return True
+
+    except SoftTimeLimitExceeded as e:
+        # Continue from the last committed batch; a run that could not
+        # finish a single batch retries with half as many trades
+        if not batches:
+            batch_size = max(batch_size // 2, TradeMatcherProcessor.CHECKPOINT_INTERVAL)
+        # Counted on their own, so waiting for the lease earlier does not
+        # use up these retries
+        if time_limit_retries >= MATCH_TIME_LIMIT_RETRIES:
+            raise
+        logger.warning(f"Matching {asset_name} hit the time limit after {batches} batches; continuing")
+        raise self.retry(
+            exc=e, kwargs={**self.request.kwargs, 'batch_size': batch_size,
+                           'time_limit_retries': time_limit_retries + 1},
+            countdown=0, max_retries=None)
+    except LeaseUnavailable as e:
+        logger.debug(str(e))
+        raise self.retry(exc=e, countdown=5, max_retries=MATCH_LEASE_RETRIES + time_limit_retries)
+    except UploadCanceled:
+        logger.info(f"Matching canceled for asset: {asset_name}")
+        progress.finish('canceled')
     except Exception as e:
         logger.error(f"Error processing asset {asset_name}: {e}")
         raise self.retry(exc=e, countdown=5)  # Retry with delay
 
-@shared_task(bind=True, soft_time_limit=90, time_limit=120)
-def process_csv_file_async(self, owner_id, file_name_entry_id, csv_content, exchange):
-    try:
-        owner = User.objects.get(id=owner_id)
-        file_name_entry = FileName.objects.get(id=file_name_entry_id)
 
-        logger.debug(f"Starting to process CSV for user: {owner.username}")
-
-        # Reset all trades' is_processed flag when a new file is uploaded
-        TradeUploadBlofin.objects.filter(owner=owner).update(is_processed=False)
-
-        # Fetch asset names in chunks to reduce memory usage
-        asset_names = TradeUploadBlofin.objects.filter(owner=owner).values_list('underlying_asset', flat=True)
-
-        for asset_name in asset_names:
-            time.sleep(1)  # Be cautious with sleep; it can waste time and resources.
-            # Process trade IDs for each asset with chunking
-            process_trade_ids_in_background.delay(owner.id)
-            # Process trades for each asset with chunking
-            process_asset_in_background.delay(owner.id, asset_name)
-            logger.debug(f"Triggered background task for asset processing: {asset_name}")
-
-        # Save the file_name_entry after processing
-        file_name_entry.save()
+@shared_task
+def matching_finished(job_id):
+    """Chord callback run once every asset of a matching pass is matched."""
+    get_job_progress(job_id).matching_finished()
+
+
+@shared_task
+def matching_failed(job_id):
+    """Chord error callback run when an asset exhausted its retries."""
+    get_job_progress(job_id).matching_finished(
+        'failed', "Matching failed for one or more assets.")
+
+
+def schedule_matching(owner_id, job_id=None):
+    """
+    Mark the owner's assets with unprocessed trades dirty and make sure a
+    matching pass is scheduled for them. Uploads finishing within
+    MATCH_DEBOUNCE_SECONDS of each other share that pass.
+    """
+    progress = get_job_progress(job_id)
+    asset_names = list(TradeUploadBlofin.objects.filter(
+        owner=owner_id, is_processed=False
+    ).order_by().values_list('underlying_asset', flat=True).distinct())
+    progress.start_matching(len(asset_names))
+    if not asset_names:
+        progress.finish('succeeded')
+        return
+
+    if get_dirty_assets().mark(owner_id, asset_names, job_id):
+        match_dirty_assets.apply_async(
+            (owner_id,), countdown=settings.MATCH_DEBOUNCE_SECONDS)
+    logger.debug(f"Marked assets dirty: {asset_names}")
+
+
+@shared_task(bind=True)
+def match_dirty_assets(self, owner_id):
+    """
+    Queue one matching task per dirty asset once the owner's uploads have
+    settled, and close every job waiting on them when all are done.
+    """
+    dirty_assets = get_dirty_assets()
+    # Every upload in the window pushes the pass back
+    wait = dirty_assets.due_in(owner_id, settings.MATCH_DEBOUNCE_SECONDS)
+    if wait > 0 and not self.request.is_eager:
+        match_dirty_assets.apply_async((owner_id,), countdown=wait)
+        return
+
+    asset_names, job_ids = dirty_assets.take(owner_id)
+    if not asset_names:
+        return
+    get_job_progress(job_ids).start_matching(len(asset_names))
+    chord(
+        process_asset_in_background.si(owner_id, asset_name, job_ids)
+        for asset_name in asset_names
+    )(matching_finished.si(job_ids).on_error(matching_failed.si(job_ids)))
+    logger.debug(f"Scheduled matching for assets: {asset_names}")
+
+@shared_task(bind=True, soft_time_limit=1800, time_limit=1900)
+def process_csv_file_async(self, job_id, blob_key):
+    try:
+        job = UploadJob.objects.select_related('owner', 'file_name_entry').get(id=job_id)
+    except UploadJob.DoesNotExist:
+        logger.error(f"UploadJob with ID {job_id} does not exist.")
+        return
+
+    owner = job.owner
+    file_name_entry = job.file_name_entry
+    progress = UploadJobProgress(job)
+    logger.debug(f"Starting to process CSV for user: {owner.username}")
+
+    blob_store = BlobStore()
+    job.status = 'running'
+    job.started_at = timezone.now()
+    # A job canceled while queued never starts
+    started = UploadJob.objects.filter(id=job.id, status='queued').update(
+        status=job.status, started_at=job.started_at)
+    if started:
+        FileName.objects.filter(id=file_name_entry.id).update(processing=True)
 
+    try:
+        if not started:
+            raise UploadCanceled(f"Upload job {job.id} was canceled before it started.")
+        blob_store.require(blob_key)
+        job.byte_size, job.header_size, job.body_hash = blob_store.describe(blob_key)
+
+        # Only ingest the rows an earlier upload of the same export lacks
+        delta = None if job.full_reconcile else find_superset_delta(job, blob_store)
+        if delta:
+            job.base_job, ranges = delta
+            job.blob_key = blob_store.put_ranges(blob_key, ranges)
+            logger.debug(f"Upload job {job.id} extends job {job.base_job.id}; ingesting {ranges}")
+
+        job.rows_total = blob_store.count_data_rows(job.blob_key)
+        job.save(update_fields=['byte_size', 'header_size', 'body_hash',
+                                'base_job', 'blob_key', 'rows_total'])
+
+        processor = CsvProcessor(owner, job.exchange, full_reconcile=job.full_reconcile)
+        new_trades_count, duplicates, canceled_count, covered_count = processor.process_csv_file(
+            blob_store.path(job.blob_key), file_name_entry.file_name, progress)
+        logger.debug(f"New trades count: {new_trades_count}, Duplicates: {duplicates}, "
+                     f"Canceled: {canceled_count}, Covered: {covered_count}")
+
+        file_name_entry.trade_count = F('trade_count') + new_trades_count
+        file_name_entry.save(update_fields=['trade_count'])
+
+        job.new_trades_count = new_trades_count
+        job.duplicates_count = duplicates
+        job.canceled_count = canceled_count
+        job.covered_count = covered_count
+        job.save(update_fields=['new_trades_count', 'duplicates_count', 'canceled_count',
+                                'covered_count'])
+
+        # Only the newly inserted trades are unprocessed; matching resumes
+        # from the earliest of them
+        schedule_matching(owner.id, job.id)
+
+    except UploadCanceled:
+        logger.info(f"Upload job {job.id} was canceled.")
+        progress.finish('canceled')
     except SoftTimeLimitExceeded:
         logger.warning(f"Soft time limit exceeded for task: {self.request.id}. Performing cleanup.")
-    except User.DoesNotExist:
-        logger.error(f"User with ID {owner_id} does not exist.")
-    except FileName.DoesNotExist:
-        logger.error(f"FileName with ID {file_name_entry_id} does not exist.")
+        progress.finish('failed', "Processing took too long.")
     except Exception as e:
         logger.error(f"Error processing CSV file: {str(e)}")
-
+        progress.finish('failed', str(e))
+    finally:
+        release_blob(blob_store, blob_key, job.id)
+        release_blob(blob_store, job.blob_key, job.id)
@@ -1,3 +1,1512 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock, skipUnless
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+import random
+import tempfile
+from benchmarks.generate_blofin_csv import generate_frame
+from celery.exceptions import SoftTimeLimitExceeded
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import Q, Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from doji_lite_api_v2.celery import app
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from .blob_store import BlobStore
+from .coordination import LeaseUnavailable, asset_lease, get_dirty_assets, get_trade_versions
+from .exchange.blofin import convert_to_boolean, convert_to_decimal, convert_to_naive_datetime
+from .exchange.blofin.blofin_csv_handler import BloFinHandler, CsvCopyProcessor
+from .exchange.blofin.csv_processor import CsvProcessor
+from .matching import FifoMatchingEngine, FixedPointError, NumpyFifoMatchingEngine, TradeRecord
+from .models import (
+    FileName, LiveTrades, PositionSnapshot, RoundTrip, TradeAllocation, TradeUploadBlofin,
+    UploadJob)
+from .serializers import FastSaveTradeSerializer, SaveTradeSerializer
+from .progress import UploadCanceled, UploadJobProgress
+from .tasks import (
+    get_job_progress, match_dirty_assets, matching_failed, matching_finished,
+    process_asset_in_background, process_csv_file_async, schedule_matching)
+from .trade_matcher import TradeMatcherProcessor
+from .trade_snapshot import TradeSnapshot, TradeSnapshotCache
+from .utils.fixed_point import PRICE, QUANTITY
 
-# Create your tests here.
+TRADE_TABLE = TradeUploadBlofin._meta.db_table
+
+
+@skipUnless(connection.vendor in ('postgresql', 'sqlite'), "Plans are checked on PostgreSQL and SQLite.")
+class TradeIndexPlanTests(TestCase):
+    """
+    The hot trade queries must be planned as index scans on a table large
+    enough for the planner to prefer them, so a change to a query or to
+    the indexes cannot silently fall back to scanning the whole table.
+    """
+    OWNERS = 5
+    ASSETS = ['BTCUSDT', 'ETHUSDT', 'SOLUSDT', 'ARBUSDT', 'INJUSDT', 'LDOUSDT', 'WIFUSDT', 'SEIUSDT']
+    TRADES_PER_ASSET = 500
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owners = [User.objects.create(username=f"owner{number}") for number in range(cls.OWNERS)]
+        start = timezone.now() - timedelta(days=365)
+        trades = []
+        for owner in cls.owners:
+            for asset_number, asset in enumerate(cls.ASSETS):
+                for number in range(cls.TRADES_PER_ASSET):
+                    quantity = Decimal(number % 7 + 1)
+                    trades.append(TradeUploadBlofin(
+                        owner=owner,
+                        file_name=f"{owner.username}-{asset_number}-{number // 100}.csv",
+                        underlying_asset=asset,
+                        margin_mode='Cross',
+                        leverage=10,
+                        order_time=start + timedelta(minutes=number * len(cls.ASSETS) + asset_number),
+                        side='Buy' if number % 2 else 'Sell',
+                        avg_fill=Decimal('100') + number,
+                        price=Decimal('0'),
+                        filled_quantity=quantity,
+                        original_filled_quantity=quantity,
+                        fee=Decimal('0.01'),
+                        reduce_only=False,
+                        trade_status='Filled',
+                        exchange='BloFin',
+                        # Like a matched account: almost everything is
+                        # processed and closed
+                        is_open=number >= cls.TRADES_PER_ASSET - 3,
+                        is_matched=number < cls.TRADES_PER_ASSET - 3,
+                        is_processed=number < cls.TRADES_PER_ASSET - 10,
+                        fingerprint=f"{owner.id}-{asset}-{number}",
+                    ))
+        TradeUploadBlofin.objects.bulk_create(trades, batch_size=2000)
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {connection.ops.quote_name(TRADE_TABLE)}")
+
+    def assertUsesIndex(self, queryset, *index_names):
+        """Assert the plan reads the trade table through one of ``index_names`` only."""
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            self.assertNotIn(f"Seq Scan on {TRADE_TABLE}", plan)
+        else:
+            # SQLite reports a full table scan as "SCAN <table>" without an index
+            for line in plan.splitlines():
+                if f"SCAN {TRADE_TABLE}" in line:
+                    self.assertIn("USING", line, plan)
+        self.assertTrue(any(name in plan for name in index_names),
+                        f"None of {index_names} in the plan:\n{plan}")
+
+    def asset_trades(self):
+        return TradeUploadBlofin.objects.filter(owner=self.owners[2], underlying_asset='SOLUSDT')
+
+    def test_earliest_unprocessed_trade(self):
+        self.assertUsesIndex(
+            self.asset_trades().filter(is_processed=False).order_by('order_time', 'id')
+            .values_list('order_time', 'id')[:1],
+            'trade_unprocessed_idx')
+
+    def test_assets_waiting_for_matching(self):
+        self.assertUsesIndex(
+            TradeUploadBlofin.objects.filter(owner=self.owners[2], is_processed=False)
+            .order_by().values_list('underlying_asset', flat=True).distinct(),
+            'trade_unprocessed_idx')
+
+    def test_matching_rows(self):
+        self.assertUsesIndex(
+            self.asset_trades().filter(side__in=['Buy', 'Sell']).order_by('order_time', 'id')
+            .values_list('id', 'side', 'filled_quantity', 'order_time', 'avg_fill', 'fee'),
+            'trade_owner_asset_time_idx', 'trade_owner_asset_side_idx')
+
+    def test_one_side_of_an_asset(self):
+        self.assertUsesIndex(
+            self.asset_trades().filter(side='Buy').order_by('order_time'),
+            'trade_owner_asset_side_idx')
+
+    def test_trades_after_a_time(self):
+        self.assertUsesIndex(
+            self.asset_trades().filter(order_time__gte=timezone.now() - timedelta(days=360)),
+            'trade_owner_asset_time_idx', 'trade_owner_asset_side_idx')
+
+    def test_open_lots(self):
+        self.assertUsesIndex(
+            self.asset_trades().filter(side__in=['Buy', 'Sell'], is_open=True)
+            .order_by('order_time', 'id'),
+            'trade_open_idx')
+
+    def test_trades_of_a_file(self):
+        self.assertUsesIndex(
+            TradeUploadBlofin.objects.filter(file_name='owner2-3-1.csv'),
+            'trade_file_name_idx')
+
+    def test_latest_trades_first(self):
+        self.assertUsesIndex(
+            TradeUploadBlofin.objects.order_by('-order_time')[:100],
+            'trade_order_time_idx')
+
+
+class KeysetPaginationTests(TestCase):
+    """``?pagination=cursor`` walks every row once, in order, without counting."""
+
+    @classmethod
+    def setUpTestData(cls):
+        owners = [User.objects.create(username=f"owner{number}") for number in range(2)]
+        start = timezone.now() - timedelta(days=30)
+        TradeUploadBlofin.objects.bulk_create([
+            TradeUploadBlofin(
+                owner=owners[number % 2],
+                file_name=f"file-{number // 10}.csv",
+                underlying_asset=['BTCUSDT', 'ETHUSDT', 'SOLUSDT'][number % 3],
+                margin_mode='Cross',
+                leverage=10,
+                # Every time is shared by several trades, so ties need the id
+                order_time=start + timedelta(minutes=number // 4),
+                side='Buy' if number % 2 else 'Sell',
+                avg_fill=Decimal('100'),
+                price=Decimal('0'),
+                filled_quantity=Decimal('1'),
+                original_filled_quantity=Decimal('1'),
+                fee=Decimal('0.01'),
+                reduce_only=False,
+                trade_status='Filled',
+                exchange='BloFin',
+                is_open=number % 5 == 0,
+                is_matched=number % 5 != 0,
+                fingerprint=f"trade-{number}",
+            )
+            for number in range(53)
+        ])
+
+    def walk(self, url, key='next'):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertNotIn('count', response.data)
+            page = [row['id'] for row in response.data['results']]
+            ids.extend(page if key == 'next' else reversed(page))
+            url = response.data[key]
+            pages += 1
+        return ids, pages, response
+
+    def test_default_ordering(self):
+        expected = list(TradeUploadBlofin.objects.order_by('-order_time', '-id').values_list('id', flat=True))
+        ids, pages, last = self.walk('/trades-csv/?pagination=cursor&page_size=7')
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 8)
+
+        # And back again from the last page
+        ids, pages, _ = self.walk(last.data['previous'], key='previous')
+        self.assertEqual(ids, expected[:49][::-1])
+
+    def test_ordering_filter_fields(self):
+        for ordering, fields in [('underlying_asset,-order_time', ['underlying_asset', '-order_time', '-id']),
+                                 ('-is_open,owner', ['-is_open', 'owner', 'id']),
+                                 ('side', ['side', 'id'])]:
+            with self.subTest(ordering=ordering):
+                expected = list(TradeUploadBlofin.objects.order_by(*fields).values_list('id', flat=True))
+                ids, _, _ = self.walk(f'/trades-csv/?pagination=cursor&page_size=6&ordering={ordering}')
+                self.assertEqual(ids, expected)
+
+    def test_no_count_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/trades-csv/?pagination=cursor')
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql'].upper()])
+
+    def test_page_numbers_by_default(self):
+        response = self.client.get('/trades-csv/')
+        self.assertEqual(response.data['count'], 53)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/trades-csv/?cursor=not-a-cursor').status_code, 404)
+
+
+class FastTradeListTests(TestCase):
+    """FastSaveTradeSerializer renders exactly what SaveTradeSerializer does."""
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create(username="owner")
+        start = timezone.now() - timedelta(days=30)
+        values = [None, Decimal('0'), Decimal('0.0099'), Decimal('0.01'), Decimal('0.5'),
+                  Decimal('-0.5'), Decimal('7.125'), Decimal('12345.6789'), Decimal('-42.005')]
+        trades = []
+        for number in range(len(values) ** 2):
+            first, second = values[number % len(values)], values[number // len(values)]
+            trades.append(TradeUploadBlofin(
+                owner=owner,
+                file_name="file.csv",
+                underlying_asset='BTCUSDT',
+                margin_mode='Cross',
+                leverage=number % 50 + 1,
+                order_time=start + timedelta(seconds=number),
+                side='Buy' if number % 2 else 'Sell',
+                avg_fill=first if first is not None else Decimal('100'),
+                price=second if second is not None else Decimal('0'),
+                filled_quantity=abs(first or Decimal('1')),
+                original_filled_quantity=second,
+                pnl=second,
+                pnl_percentage=first,
+                fee=Decimal('0.0123456789'),
+                reduce_only=False,
+                trade_status='Filled',
+                exchange='BloFin',
+                is_open=number % 3 == 0,
+                is_matched=number % 3 != 0,
+                fingerprint=f"trade-{number}",
+            ))
+        TradeUploadBlofin.objects.bulk_create(trades)
+
+    def test_same_rows(self):
+        trades = TradeUploadBlofin.objects.order_by('order_time')
+        expected = SaveTradeSerializer(trades, many=True).data
+        self.assertEqual(FastSaveTradeSerializer(trades.values(*FastSaveTradeSerializer.values_fields),
+                                                 many=True).data, expected)
+        # Model instances and querysets render the same way
+        self.assertEqual(FastSaveTradeSerializer(list(trades), many=True).data, expected)
+        self.assertEqual(FastSaveTradeSerializer(trades, many=True).data, expected)
+
+    def test_same_json(self):
+        for query in ['?page_size=20', '?pagination=cursor&page_size=30&ordering=-is_open,order_time']:
+            with self.subTest(query=query):
+                response = self.client.get(f'/trades-csv/{query}')
+                ids = [row['id'] for row in response.data['results']]
+                trades = sorted(TradeUploadBlofin.objects.filter(id__in=ids), key=lambda trade: ids.index(trade.id))
+                expected = JSONRenderer().render(SaveTradeSerializer(trades, many=True).data)
+                self.assertEqual(JSONRenderer().render(response.data['results']), expected)
+
+
+FIXTURE_DIR = Path(__file__).resolve().parent / 'fixtures'
+
+
+class NormalizeFrameTests(SimpleTestCase):
+    """The column-wise parser builds the trades the row-by-row one did."""
+    FIELDS = [
+        'file_name', 'underlying_asset', 'margin_mode', 'leverage', 'order_time', 'side',
+        'avg_fill', 'price', 'filled_quantity', 'original_filled_quantity', 'pnl',
+        'pnl_percentage', 'fee', 'reduce_only', 'trade_status', 'exchange',
+    ]
+
+    @staticmethod
+    def row_trade(row):
+        """The baseline's per-row parsing; None for rows it did not store."""
+        if row['Status'] == 'Canceled' or row['Underlying Asset'] not in BloFinHandler.ALLOWED_ASSETS:
+            return None
+        try:
+            # The IntegerField took the raw cell
+            leverage = int(row['Leverage'])
+        except ValueError:
+            return None
+        filled_quantity = convert_to_decimal(row['Filled'])
+        return TradeUploadBlofin(
+            file_name='export.csv',
+            underlying_asset=row['Underlying Asset'],
+            margin_mode=row['Margin Mode'],
+            leverage=leverage,
+            order_time=timezone.make_aware(
+                convert_to_naive_datetime(row['Order Time']), timezone.get_current_timezone()),
+            side=row['Side'].split('(')[0].strip(),
+            avg_fill=convert_to_decimal(row['Avg Fill']),
+            price=convert_to_decimal(row['Price']),
+            filled_quantity=filled_quantity,
+            original_filled_quantity=filled_quantity,
+            pnl=convert_to_decimal(row['PNL']),
+            pnl_percentage=convert_to_decimal(row['PNL%']),
+            fee=convert_to_decimal(row['Fee']),
+            reduce_only=convert_to_boolean(row['Reduce-only']),
+            trade_status=row['Status'],
+            exchange='BloFin',
+        )
+
+    def values(self, trades):
+        return [tuple(getattr(trade, field) for field in self.FIELDS) for trade in trades]
+
+    def test_same_trades_as_row_by_row(self):
+        path = FIXTURE_DIR / 'blofin_export.csv'
+        frame = pd.read_csv(path, dtype=str, keep_default_na=False)
+        handler = BloFinHandler()
+        normalized, canceled_count, skipped_count = handler.normalize_frame(frame)
+        trades = handler.build_trades(normalized, None, 'BloFin', 'export.csv')
+
+        expected = [trade for trade in map(self.row_trade, frame.to_dict('records')) if trade]
+        self.assertEqual(self.values(trades), self.values(expected))
+        self.assertEqual(canceled_count, 1)
+        # DOGEUSDT is not allowed and 1.5x is no whole leverage
+        self.assertEqual(skipped_count, 2)
+
+    def test_leverage_cells(self):
+        frame = pd.read_csv(FIXTURE_DIR / 'blofin_export.csv', dtype=str, keep_default_na=False)
+        frame = frame[(frame['Status'] == 'Filled')
+                      & frame['Underlying Asset'].isin(BloFinHandler.ALLOWED_ASSETS)].iloc[:4].copy()
+        frame['Leverage'] = ['20x', '1.5x', ' 10 ', 'x']
+        normalized, _, skipped_count = BloFinHandler().normalize_frame(frame)
+        self.assertEqual(normalized['leverage'].tolist(), [20, 10])
+        self.assertEqual(skipped_count, 2)
+
+
+class CsvChunkTests(TestCase):
+    """Reading an export in small chunks ingests what one read would."""
+
+    def setUp(self):
+        self.owners = iter(User.objects.create(username=f"chunks{number}") for number in range(3))
+
+    def ingest(self, content, chunk_size):
+        return CsvProcessor(next(self.owners), 'BloFin', chunk_size=chunk_size).process_csv_file(
+            io.StringIO(content), 'file.csv')
+
+    def test_small_chunks(self):
+        # Repeated rows follow the rows they repeat
+        frame = generate_frame(200, duplicate_ratio=0.2, seed=6)
+        repeats = frame.duplicated(keep='first')
+        # Some repeats open a chunk, so their first copy is in the one before
+        self.assertTrue(any(repeats.iloc[position] for position in range(7, len(frame), 7)))
+
+        content = frame.to_csv(index=False)
+        expected = self.ingest(content, None)
+        self.assertEqual(self.ingest(content, 7), expected)
+        self.assertGreaterEqual(expected[1], int(repeats.sum()))
+        self.assertEqual(sum(expected), len(frame))
+
+    def test_repeated_header_in_later_chunk(self):
+        frame = generate_frame(40, seed=6)
+        pasted = frame.iloc[:20].to_csv(index=False) + frame.iloc[20:].to_csv(index=False)
+        self.assertEqual(self.ingest(pasted, 7), self.ingest(frame.to_csv(index=False), None))
+
+    def test_bad_header_in_later_chunk(self):
+        frame = generate_frame(40, seed=6)
+        reordered = frame.iloc[20:, ::-1].to_csv(index=False)
+        with self.assertRaisesMessage(ValueError, "Header on line 22 does not match"):
+            self.ingest(frame.iloc[:20].to_csv(index=False) + reordered, 7)
+
+    def test_extra_field_in_later_chunk(self):
+        content = generate_frame(40, seed=6).to_csv(index=False).splitlines(keepends=True)
+        content[30] = content[30].rstrip('\n') + ',extra\n'
+        with self.assertRaisesMessage(ValueError, "Error reading CSV file."):
+            self.ingest(''.join(content), 7)
+
+
+class BlobStoreTests(SimpleTestCase):
+    """A failed put leaves nothing behind in the store."""
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = Path(root.name)
+        self.store = BlobStore(self.root)
+
+    def stored_files(self):
+        return [path for path in self.root.rglob('*') if path.is_file()]
+
+    def test_put(self):
+        key = self.store.put([b'a,b\n', b'1,2\n'])
+        self.assertEqual(self.stored_files(), [self.store.path(key)])
+        self.assertEqual(self.store.path(key).read_bytes(), b'a,b\n1,2\n')
+
+    def test_chunks_fail(self):
+        def chunks():
+            yield b'a,b\n'
+            raise IOError("Client went away")
+
+        with self.assertRaises(IOError):
+            self.store.put(chunks())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_move_fails(self):
+        with mock.patch('upload_csv.blob_store.os.replace', side_effect=OSError("Disk full")):
+            with self.assertRaises(OSError):
+                self.store.put([b'a,b\n'])
+        self.assertEqual(self.stored_files(), [])
+
+
+class UploadTestCase(TransactionTestCase):
+    """
+    Uploads run end to end with eager Celery tasks and a temporary spool.
+    Transactions really commit, so on_commit hooks such as the trade
+    version bumps run as they do in production.
+    """
+
+    def setUp(self):
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        settings_override = override_settings(UPLOAD_SPOOL_DIR=spool.name, MATCH_DEBOUNCE_SECONDS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, 'task_always_eager', eager)
+
+        self.owner = User.objects.create(username="uploader")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def csv_bytes(self, frame):
+        return frame.to_csv(index=False).encode()
+
+    def upload(self, name, content, **data):
+        response = self.client.post('/upload/', {
+            'file': SimpleUploadedFile(name, content, content_type='text/csv'),
+            'exchange': 'BloFin', **data,
+        }, format='multipart')
+        self.assertIn(response.status_code, (200, 202), response.data)
+        return response.data
+
+
+class SeparateSpoolTests(UploadTestCase):
+    """A worker that cannot see the web process's spool fails the job clearly."""
+
+    def test_blob_missing_in_worker(self):
+        worker_spool = tempfile.TemporaryDirectory()
+        self.addCleanup(worker_spool.cleanup)
+        with mock.patch('upload_csv.tasks.BlobStore', lambda: BlobStore(worker_spool.name)):
+            response = self.upload('file.csv', self.csv_bytes(generate_frame(10)))
+
+        job = UploadJob.objects.get(id=response['job_id'])
+        self.assertEqual(job.status, 'failed')
+        self.assertIn("must share UPLOAD_SPOOL_DIR", job.error)
+        self.assertFalse(job.file_name_entry.processing)
+        self.assertFalse(TradeUploadBlofin.objects.exists())
+
+
+class DeltaUploadDeleteTests(UploadTestCase):
+    """Deleting the file a delta upload extends keeps the delta whole."""
+
+    def test_delete_base_then_inspect_delta(self):
+        # Exports list the newest orders first, so the later export has
+        # its new rows right after the header
+        frame = generate_frame(1461, seed=3)
+        base = self.upload('a.csv', self.csv_bytes(frame.iloc[461:]))
+        delta = self.upload('b.csv', self.csv_bytes(frame))
+        delta_job = UploadJob.objects.get(id=delta['job_id'])
+        self.assertEqual(delta_job.base_job_id, base['job_id'])
+        self.assertEqual(delta_job.status, 'succeeded')
+        self.assertGreater(delta_job.new_trades_count, 0)
+        stored = TradeUploadBlofin.objects.filter(owner=self.owner).count()
+        self.assertEqual(TradeUploadBlofin.objects.filter(file_name='b.csv').count(),
+                         delta_job.new_trades_count)
+
+        base_file = FileName.objects.get(file_name='a.csv')
+        response = self.client.delete(f'/filenames/delete/{base_file.id}/')
+        self.assertEqual(response.status_code, 204)
+
+        response = self.client.get(f'/upload/jobs/{delta_job.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'succeeded')
+        self.assertIsNone(UploadJob.objects.get(id=delta_job.id).base_job)
+        # Every trade of b.csv is still stored, now under its name
+        self.assertEqual(TradeUploadBlofin.objects.filter(file_name='b.csv').count(), stored)
+        self.assertEqual(FileName.objects.get(file_name='b.csv').trade_count, stored)
+        self.assertFalse(FileName.objects.filter(file_name='a.csv').exists())
+
+
+class ReuploadAfterDeleteTests(UploadTestCase):
+    """
+    Deleting a file's trades stops earlier uploads that found them as
+    duplicates from standing in for a re-upload, whole or as a delta base.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # Newest order first
+        self.frame = generate_frame(1500, seed=7)
+
+    def reference(self, rows):
+        """The trades one upload of ``rows`` stores for a fresh owner."""
+        content = rows.to_csv(index=False)
+        return CsvCopyProcessor(BloFinHandler()).process_csv_data(
+            pd.read_csv(io.StringIO(content), dtype=str, keep_default_na=False),
+            User.objects.create(username=f"reference{User.objects.count()}"),
+            'BloFin', 'reference.csv')[0]
+
+    def stored(self):
+        return TradeUploadBlofin.objects.filter(owner=self.owner).count()
+
+    def upload_then_delete(self, kept, deleted):
+        """Upload ``deleted`` then ``kept``, which overlaps it, and delete the first."""
+        self.upload('deleted.csv', self.csv_bytes(deleted))
+        self.upload('kept.csv', self.csv_bytes(kept))
+        deleted_file = FileName.objects.get(file_name='deleted.csv')
+        response = self.client.delete(f'/filenames/delete/{deleted_file.id}/')
+        self.assertEqual(response.status_code, 204)
+
+    def test_identical_reupload(self):
+        kept = self.frame.iloc[:500]
+        self.upload_then_delete(kept, self.frame.iloc[200:900])
+
+        response = self.upload('kept.csv', self.csv_bytes(kept))
+        self.assertEqual(response['status'], 'accepted')
+        self.assertEqual(self.stored(), self.reference(kept))
+
+    def test_prefix_delta(self):
+        # The kept export is a byte prefix of the full one
+        self.upload_then_delete(self.frame.iloc[:500], self.frame.iloc[200:900])
+
+        job = self.upload('full.csv', self.csv_bytes(self.frame))
+        self.assertIsNone(UploadJob.objects.get(id=job['job_id']).base_job)
+        self.assertEqual(self.stored(), self.reference(self.frame))
+
+    def test_suffix_delta(self):
+        # The kept export's body is a byte suffix of the full one
+        self.upload_then_delete(self.frame.iloc[800:], self.frame.iloc[500:1000])
+
+        job = self.upload('full.csv', self.csv_bytes(self.frame))
+        self.assertIsNone(UploadJob.objects.get(id=job['job_id']).base_job)
+        self.assertEqual(self.stored(), self.reference(self.frame))
+
+    def test_delta_without_delete(self):
+        self.upload('kept.csv', self.csv_bytes(self.frame.iloc[:500]))
+
+        job = self.upload('full.csv', self.csv_bytes(self.frame))
+        self.assertIsNotNone(UploadJob.objects.get(id=job['job_id']).base_job)
+        self.assertEqual(self.stored(), self.reference(self.frame))
+
+
+class IngestedRangeTests(UploadTestCase):
+    """
+    Only rows inside ranges an earlier upload stored in full skip dedup,
+    whatever order the exports arrive in.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # Newest order first, one order per second at most
+        self.frame = generate_frame(1500, seed=5)
+        # What one upload of the whole export stores
+        self.filled = CsvCopyProcessor(BloFinHandler()).process_csv_data(
+            export_frame(1500, seed=5), User.objects.create(username="reference"),
+            'BloFin', 'reference.csv')[0]
+
+    def upload_rows(self, name, rows):
+        job = self.upload(name, self.csv_bytes(rows))
+        return UploadJob.objects.get(id=job['job_id'])
+
+    def stored(self):
+        return TradeUploadBlofin.objects.filter(owner=self.owner).count()
+
+    def test_older_rows_after_newer_upload(self):
+        newer = self.upload_rows('new.csv', self.frame.iloc[:700])
+        older = self.upload_rows('old.csv', self.frame.iloc[700:])
+
+        self.assertEqual(self.stored(), self.filled)
+        self.assertEqual(older.new_trades_count, self.filled - newer.new_trades_count)
+        self.assertEqual(older.covered_count, 0)
+
+        # The full export is covered apart from the rows on range edges
+        full = self.upload_rows('full.csv', self.frame)
+        self.assertEqual(full.new_trades_count, 0)
+        self.assertGreater(full.covered_count, 0)
+        self.assertEqual(full.covered_count + full.duplicates_count + full.canceled_count,
+                         full.rows_total)
+        self.assertEqual(self.stored(), self.filled)
+
+    def test_out_of_order_overlapping_uploads(self):
+        middle = self.upload_rows('middle.csv', self.frame.iloc[500:1000])
+        newest = self.upload_rows('newest.csv', self.frame.iloc[:600])
+        oldest = self.upload_rows('oldest.csv', self.frame.iloc[900:])
+
+        self.assertEqual(self.stored(), self.filled)
+        # Only the overlaps are covered or duplicate; the rest is new
+        for job, rows in ((newest, 600), (oldest, 600)):
+            self.assertGreater(job.covered_count, 0)
+            self.assertLess(job.covered_count, 100)
+            self.assertEqual(job.new_trades_count + job.duplicates_count
+                             + job.canceled_count + job.covered_count, rows)
+        self.assertEqual(middle.covered_count, 0)
+
+    def test_full_reconcile_checks_covered_rows(self):
+        self.upload_rows('full.csv', self.frame)
+        TradeUploadBlofin.objects.filter(owner=self.owner, order_time__in=list(
+            TradeUploadBlofin.objects.filter(owner=self.owner).order_by('order_time')
+            .values_list('order_time', flat=True)[500:510])).delete()
+
+        reconciled = self.upload('full.csv', self.csv_bytes(self.frame), full_reconcile=True)
+        job = UploadJob.objects.get(id=reconciled['job_id'])
+        self.assertEqual(job.new_trades_count, 10)
+        self.assertEqual(job.covered_count, 0)
+        self.assertEqual(self.stored(), self.filled)
+
+
+class MatchDispatchTests(UploadTestCase):
+    """
+    A matching pass queues one task per dirty asset in a chord whose
+    callbacks close its jobs; a per-(owner, asset) lease keeps two workers
+    off the same asset.
+    """
+
+    def create_job(self, name, status):
+        file_name = FileName.objects.create(owner=self.owner, file_name=name, processing=True)
+        return UploadJob.objects.create(
+            owner=self.owner, file_name_entry=file_name, exchange='BloFin',
+            blob_key='blob', status=status)
+
+    def test_one_task_per_asset(self):
+        frame = generate_frame(300, seed=9)
+        with mock.patch.object(process_asset_in_background, 'run',
+                               wraps=process_asset_in_background.run) as run:
+            job = self.upload('file.csv', self.csv_bytes(frame))
+
+        asset_names = sorted(TradeUploadBlofin.objects.filter(owner=self.owner).order_by(
+            ).values_list('underlying_asset', flat=True).distinct())
+        self.assertGreater(len(asset_names), 1)
+        self.assertEqual(sorted(call.args[1] for call in run.call_args_list), asset_names)
+        for call in run.call_args_list:
+            self.assertEqual(call.args[2], [job['job_id']])
+
+        job = UploadJob.objects.get(id=job['job_id'])
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual((job.assets_done, job.assets_total), (len(asset_names), len(asset_names)))
+        self.assertFalse(job.file_name_entry.processing)
+
+    def test_lease_keeps_a_second_worker_off_the_asset(self):
+        CsvCopyProcessor(BloFinHandler()).process_csv_data(
+            single_asset_frame(50, 9, 'BTCUSDT'), self.owner, 'BloFin', 'btc.csv')
+        CsvCopyProcessor(BloFinHandler()).process_csv_data(
+            single_asset_frame(50, 10, 'ETHUSDT'), self.owner, 'BloFin', 'eth.csv')
+
+        with asset_lease(self.owner.id, 'BTCUSDT'), \
+                mock.patch('upload_csv.tasks.MATCH_LEASE_RETRIES', 0):
+            blocked = process_asset_in_background.apply((self.owner.id, 'BTCUSDT'))
+            # Other assets are not held up
+            other = process_asset_in_background.apply((self.owner.id, 'ETHUSDT'))
+        self.assertEqual(blocked.state, 'FAILURE')
+        self.assertIsInstance(blocked.result, LeaseUnavailable)
+        self.assertEqual(other.state, 'SUCCESS')
+        self.assertTrue(TradeUploadBlofin.objects.filter(
+            owner=self.owner, underlying_asset='BTCUSDT', is_processed=False).exists())
+
+        # The lease is released when the first worker is done
+        self.assertTrue(process_asset_in_background.apply((self.owner.id, 'BTCUSDT')).get())
+        self.assertFalse(TradeUploadBlofin.objects.filter(
+            owner=self.owner, is_processed=False).exists())
+
+    def test_callbacks_close_the_jobs(self):
+        running = self.create_job('running.csv', 'running')
+        canceling = self.create_job('canceling.csv', 'canceling')
+        canceled = self.create_job('canceled.csv', 'canceled')
+        failing = self.create_job('failing.csv', 'running')
+
+        matching_finished.apply(([running.id, canceling.id, canceled.id],)).get()
+        matching_failed.apply(([failing.id],)).get()
+
+        statuses = dict(UploadJob.objects.values_list('id', 'status'))
+        self.assertEqual(statuses, {running.id: 'succeeded', canceling.id: 'canceled',
+                                    canceled.id: 'canceled', failing.id: 'failed'})
+        failing.refresh_from_db()
+        self.assertEqual(failing.error, "Matching failed for one or more assets.")
+        self.assertIsNotNone(failing.finished_at)
+        self.assertFalse(FileName.objects.filter(
+            id__in=[running.file_name_entry_id, canceling.file_name_entry_id,
+                    failing.file_name_entry_id], processing=True).exists())
+
+
+class UploadJobStatusTests(UploadTestCase):
+    """The status endpoint reports each stage's progress, rate and ETA."""
+
+    def status_at(self, now):
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            response = self.client.get(f'/upload/jobs/{self.job.id}/')
+        self.assertEqual(response.status_code, 200)
+        return {field: response.data[field] for field in (
+            'status', 'stage', 'rows_done', 'rows_total', 'assets_done', 'assets_total',
+            'throughput', 'eta_seconds')}
+
+    def test_stages(self):
+        started = timezone.now()
+        file_name = FileName.objects.create(owner=self.owner, file_name='file.csv', processing=True)
+        self.job = UploadJob.objects.create(
+            owner=self.owner, file_name_entry=file_name, exchange='BloFin', blob_key='blob',
+            status='running', started_at=started, rows_total=1000)
+        progress = UploadJobProgress(self.job)
+
+        progress.start_stage('parse')
+        progress.advance(400)
+        self.assertEqual(self.status_at(started + timedelta(seconds=10)), {
+            'status': 'running', 'stage': 'parse', 'rows_done': 400, 'rows_total': 1000,
+            'assets_done': 0, 'assets_total': 0, 'throughput': 40.0, 'eta_seconds': 15.0})
+
+        progress.start_stage('dedup')
+        progress.start_stage('insert')
+        progress.advance(600)
+        self.assertEqual(self.status_at(started + timedelta(seconds=20)), {
+            'status': 'running', 'stage': 'insert', 'rows_done': 1000, 'rows_total': 1000,
+            'assets_done': 0, 'assets_total': 0, 'throughput': 50.0, 'eta_seconds': 0.0})
+
+        with mock.patch('django.utils.timezone.now', return_value=started + timedelta(seconds=20)):
+            progress.start_matching(4)
+        progress.asset_matched()
+        progress.asset_matched()
+        self.assertEqual(self.status_at(started + timedelta(seconds=24)), {
+            'status': 'running', 'stage': 'match', 'rows_done': 1000, 'rows_total': 1000,
+            'assets_done': 2, 'assets_total': 4, 'throughput': 0.5, 'eta_seconds': 4.0})
+
+        progress.asset_matched()
+        progress.asset_matched()
+        with mock.patch('django.utils.timezone.now', return_value=started + timedelta(seconds=28)):
+            progress.matching_finished()
+        # Rates of a finished job stop at its finish time
+        self.assertEqual(self.status_at(started + timedelta(seconds=60)), {
+            'status': 'succeeded', 'stage': 'match', 'rows_done': 1000, 'rows_total': 1000,
+            'assets_done': 4, 'assets_total': 4, 'throughput': 0.5, 'eta_seconds': None})
+
+
+class CancelUploadJobTests(UploadTestCase):
+    """Canceling an upload job stops that job only."""
+
+    def queue(self, name, content):
+        """Upload without running the worker; return (job id, blob key)."""
+        with mock.patch('upload_csv.views.process_csv_file_async.delay') as delay:
+            job_id = self.upload(name, content)['job_id']
+        return delay.call_args.args
+
+    def cancel(self, job_id):
+        return self.client.post(f'/upload/jobs/{job_id}/cancel/')
+
+    def test_other_job_of_the_file_runs_on(self):
+        frame = generate_frame(400, seed=6)
+        canceled = self.queue('a.csv', self.csv_bytes(frame.iloc[200:]))
+        kept = self.queue('a.csv', self.csv_bytes(frame.iloc[:200]))
+        self.assertEqual(self.cancel(canceled[0]).status_code, 202)
+        self.assertEqual(UploadJob.objects.get(id=canceled[0]).status, 'canceling')
+        self.assertFalse(FileName.objects.get(file_name='a.csv').cancel_processing)
+
+        process_csv_file_async.apply(canceled)
+        process_csv_file_async.apply(kept)
+        canceled_job = UploadJob.objects.get(id=canceled[0])
+        kept_job = UploadJob.objects.get(id=kept[0])
+        self.assertEqual(canceled_job.status, 'canceled')
+        self.assertIsNone(canceled_job.started_at)
+        self.assertEqual(kept_job.status, 'succeeded')
+        self.assertGreater(kept_job.new_trades_count, 0)
+        self.assertEqual(TradeUploadBlofin.objects.filter(owner=self.owner).count(),
+                         kept_job.new_trades_count)
+
+    def test_shared_matching_pass_runs_on(self):
+        jobs = [UploadJob.objects.get(id=self.queue(name, self.csv_bytes(generate_frame(50, seed=seed)))[0])
+                for seed, name in enumerate(['a.csv', 'b.csv'])]
+        UploadJob.objects.filter(id__in=[job.id for job in jobs]).update(status='running')
+        self.assertEqual(self.cancel(jobs[0].id).status_code, 202)
+
+        progress = get_job_progress([job.id for job in jobs])
+        progress.check_canceled()
+        progress.matching_finished()
+        self.assertEqual([job.status for job in UploadJob.objects.filter(
+            id__in=[job.id for job in jobs]).order_by('id')], ['canceled', 'succeeded'])
+
+        # Once every job of the pass is canceled, it stops
+        progress = get_job_progress([jobs[0].id])
+        with self.assertRaises(UploadCanceled):
+            progress.check_canceled()
+
+    def test_finished_job(self):
+        job_id = self.upload('a.csv', self.csv_bytes(generate_frame(50, seed=7)))['job_id']
+        response = self.cancel(job_id)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['detail'], "Upload job is already succeeded.")
+
+
+def export_frame(rows, seed=0):
+    """A generated export as CsvProcessor reads it: every cell as text."""
+    content = generate_frame(rows, seed=seed).to_csv(index=False)
+    return pd.read_csv(io.StringIO(content), dtype=str, keep_default_na=False)
+
+
+def single_asset_frame(rows, seed=0, asset='BTCUSDT'):
+    """``export_frame`` with every trade in one asset."""
+    frame = export_frame(rows, seed)
+    frame['Underlying Asset'] = asset
+    return frame
+
+
+class FifoMatchingTests(TransactionTestCase):
+    """
+    Trades are matched first in, first out in one pass, shorts like
+    longs, and written back with a fixed number of statements per asset.
+    """
+
+    def test_longs_and_shorts(self):
+        trades = [
+            TradeRecord(1, 'Buy', Decimal('1')),
+            TradeRecord(2, 'Buy', Decimal('2')),
+            TradeRecord(3, 'Sell', Decimal('2.5')),
+            # Closes the long and opens a short with the rest
+            TradeRecord(4, 'Sell', Decimal('1.5')),
+            TradeRecord(5, 'Buy', Decimal('0.25')),
+        ]
+        engine = FifoMatchingEngine().process(trades)
+        self.assertEqual(engine.allocations, [
+            (1, 3, Decimal('1'), 0),
+            (2, 3, Decimal('1.5'), 0),
+            (2, 4, Decimal('0.5'), 0),
+            (4, 5, Decimal('0.25'), 1),
+        ])
+        self.assertEqual(sorted(engine.results()), [
+            (1, Decimal('0'), True, False, False),
+            (2, Decimal('0'), True, False, False),
+            (3, Decimal('0'), True, False, False),
+            (4, Decimal('0.75'), False, True, True),
+            (5, Decimal('0'), True, False, False),
+        ])
+        self.assertEqual(engine.snapshot(), {
+            'open_side': 'Sell', 'round_trip': 1, 'lots': [[4, '0.75', '1.5']]})
+
+    def trade_writes(self, rows):
+        owner = User.objects.create(username=f"owner{rows}")
+        CsvCopyProcessor(BloFinHandler()).process_csv_data(
+            single_asset_frame(rows, seed=11), owner, 'BloFin', 'file.csv')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(process_asset_in_background.apply((owner.id, 'BTCUSDT')).get())
+
+        trades = TradeUploadBlofin.objects.filter(owner=owner, side__in=['Buy', 'Sell'])
+        self.assertFalse(trades.filter(is_processed=False).exists())
+        # Only one side is left open, holding the net position
+        bought, sold = (trades.filter(side=side).aggregate(total=Sum('original_filled_quantity'))['total']
+                        for side in ('Buy', 'Sell'))
+        open_sides = set(trades.filter(is_open=True).values_list('side', flat=True))
+        self.assertLessEqual(len(open_sides), 1)
+        self.assertEqual(trades.filter(is_open=True).aggregate(total=Sum('filled_quantity'))['total'] or 0,
+                         abs(bought - sold))
+        return [query['sql'] for query in queries
+                if query['sql'].startswith('UPDATE') and TRADE_TABLE in query['sql']]
+
+    def test_writes_do_not_grow_with_the_trades(self):
+        small, large = self.trade_writes(200), self.trade_writes(800)
+        self.assertEqual(len(small), len(large))
+        self.assertLess(len(large), 10)
+
+
+class MatchingRetryTests(TestCase):
+    """
+    A matching task stops retrying after a few tries and fails, which is
+    what makes its chord run matching_failed on a worker.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create(username="matcher")
+
+    def run_task(self):
+        return process_asset_in_background.apply((self.owner.id, 'BTCUSDT'))
+
+    def test_lease_never_free(self):
+        attempts = []
+
+        def busy(owner_id, asset_name):
+            attempts.append(asset_name)
+            raise LeaseUnavailable(f"Asset {asset_name} is being matched.")
+
+        with mock.patch('upload_csv.tasks.asset_lease', busy), \
+                mock.patch('upload_csv.tasks.MATCH_LEASE_RETRIES', 2):
+            result = self.run_task()
+        self.assertEqual(result.state, 'FAILURE')
+        self.assertIsInstance(result.result, LeaseUnavailable)
+        # The first try and two retries
+        self.assertEqual(len(attempts), 3)
+
+    def test_time_limit_every_batch(self):
+        batch_sizes = []
+
+        def too_slow(asset_name, chunk_size, batch_size):
+            batch_sizes.append(batch_size)
+            raise SoftTimeLimitExceeded()
+
+        with mock.patch.object(TradeMatcherProcessor, 'process_assets', side_effect=too_slow), \
+                mock.patch('upload_csv.tasks.MATCH_TIME_LIMIT_RETRIES', 2):
+            result = self.run_task()
+        self.assertEqual(result.state, 'FAILURE')
+        self.assertIsInstance(result.result, SoftTimeLimitExceeded)
+        batch_size = TradeMatcherProcessor.BATCH_SIZE
+        self.assertEqual(batch_sizes, [batch_size, batch_size // 2, batch_size // 4])
+
+    def test_time_limit_after_lease_waits(self):
+        attempts = []
+
+        def busy_then_free(owner_id, asset_name):
+            attempts.append('lease')
+            if len(attempts) <= 3:
+                raise LeaseUnavailable(f"Asset {asset_name} is being matched.")
+            return contextlib.nullcontext()
+
+        def slow_once(asset_name, chunk_size, batch_size):
+            if attempts.count('time limit') < 2:
+                attempts.append('time limit')
+                raise SoftTimeLimitExceeded()
+            return 0
+
+        # More lease waits than time limit retries are allowed
+        with mock.patch('upload_csv.tasks.asset_lease', busy_then_free), \
+                mock.patch.object(TradeMatcherProcessor, 'process_assets', side_effect=slow_once), \
+                mock.patch('upload_csv.tasks.MATCH_TIME_LIMIT_RETRIES', 2), \
+                mock.patch('upload_csv.tasks.MATCH_LEASE_RETRIES', 3):
+            result = self.run_task()
+        self.assertEqual(result.state, 'SUCCESS')
+        self.assertEqual(attempts, ['lease'] * 4 + ['time limit', 'lease', 'time limit', 'lease'])
+
+
+@override_settings(MATCH_DEBOUNCE_SECONDS=60)
+class MatchSchedulingTests(TestCase):
+    """
+    Uploads mark their assets dirty; the first schedules a debounced pass
+    and later ones inside the window join it.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create(username="scheduler")
+        self.addCleanup(get_dirty_assets().take, self.owner.id)
+        patcher = mock.patch.object(match_dirty_assets, 'apply_async')
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('upload_csv.tasks.chord')
+        self.chord = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, asset, seed):
+        """Store an upload's trades of ``asset`` and schedule matching for its job."""
+        file_name = FileName.objects.create(owner=self.owner, file_name=f"{asset}{seed}.csv")
+        job = UploadJob.objects.create(
+            owner=self.owner, file_name_entry=file_name, exchange='BloFin', blob_key='blob')
+        CsvCopyProcessor(BloFinHandler()).process_csv_data(
+            single_asset_frame(20, seed, asset), self.owner, 'BloFin', file_name.file_name)
+        schedule_matching(self.owner.id, job.id)
+        return job.id
+
+    def dispatched(self):
+        """The (asset, job ids) of each matching task the last pass queued."""
+        return [(task.args[1], task.args[2]) for task in self.chord.call_args.args[0]]
+
+    def test_uploads_in_window_share_one_pass(self):
+        job_ids = [self.upload('BTCUSDT', 1), self.upload('ETHUSDT', 2), self.upload('BTCUSDT', 3)]
+        self.apply_async.assert_called_once_with((self.owner.id,), countdown=60)
+
+        # The last upload pushed the pass back by a whole window
+        match_dirty_assets.run(self.owner.id)
+        self.assertEqual(self.apply_async.call_count, 2)
+        self.assertGreater(self.apply_async.call_args.kwargs['countdown'], 59)
+        self.chord.assert_not_called()
+
+        with override_settings(MATCH_DEBOUNCE_SECONDS=0):
+            match_dirty_assets.run(self.owner.id)
+        self.assertEqual(self.dispatched(), [('BTCUSDT', job_ids), ('ETHUSDT', job_ids)])
+        self.assertEqual(get_dirty_assets().take(self.owner.id), ([], []))
+
+    @override_settings(MATCH_DEBOUNCE_SECONDS=0)
+    def test_asset_marked_during_a_run_is_matched_again(self):
+        first_job = self.upload('BTCUSDT', 1)
+        match_dirty_assets.run(self.owner.id)
+        self.assertEqual(self.dispatched(), [('BTCUSDT', [first_job])])
+
+        # The pass took the set, so an upload while it runs schedules another
+        second_job = self.upload('BTCUSDT', 2)
+        self.assertEqual(self.apply_async.call_count, 2)
+        match_dirty_assets.run(self.owner.id)
+        self.assertEqual(self.chord.call_count, 2)
+        self.assertEqual(self.dispatched(), [('BTCUSDT', [second_job])])
+
+
+class DuplicateDetectionTests(TestCase):
+    """
+    Upload dedup reads its candidates in one query and checks the
+    avg_fill tolerance in memory, also against earlier rows of the file.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create(username="owner")
+        self.processor = CsvCopyProcessor(BloFinHandler())
+
+    def ingest(self, frame, file_name='file.csv', owner=None):
+        return self.processor.process_csv_data(frame, owner or self.owner, 'BloFin', file_name)
+
+    @staticmethod
+    def shift_avg_fill(frame, delta):
+        frame = frame.copy()
+        frame['Avg Fill'] = [f"{Decimal(value.split()[0]) + delta} USDT" for value in frame['Avg Fill']]
+        return frame
+
+    def test_query_count_does_not_grow(self):
+        counts = []
+        for rows in (100, 900):
+            owner = User.objects.create(username=f"owner{rows}")
+            frame = export_frame(rows, seed=8)
+            self.ingest(frame.iloc[::2], owner=owner)
+            with CaptureQueriesContext(connection) as queries:
+                self.ingest(frame, 'again.csv', owner=owner)
+            candidates = [query for query in queries
+                          if TRADE_TABLE in query['sql'] and 'BETWEEN' in query['sql']]
+            self.assertEqual(len(candidates), 1)
+            # SQLite splits the INSERTs by its variable limit, so only the
+            # reads are counted
+            counts.append(sum(query['sql'].startswith('SELECT') for query in queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_within_tolerance(self):
+        frame = export_frame(200, seed=9)
+        new_trades, _, _ = self.ingest(frame)
+        self.assertGreater(new_trades, 0)
+        # Moves avg_fill across the fingerprint's 0.0001 rounding, so only
+        # the tolerance check can tell
+        new_trades_near, _, _ = self.ingest(self.shift_avg_fill(frame, Decimal('0.00009')), 'near.csv')
+        self.assertEqual(new_trades_near, 0)
+        new_trades_far, _, _ = self.ingest(self.shift_avg_fill(frame, Decimal('0.0002')), 'far.csv')
+        self.assertEqual(new_trades_far, new_trades)
+
+    def test_repeats_within_the_file(self):
+        frame = export_frame(200, seed=10)
+        alone = self.ingest(frame, owner=User.objects.create(username="alone"))
+        near = self.shift_avg_fill(frame, Decimal('0.00009'))
+        new_trades, duplicates, canceled = self.ingest(pd.concat([frame, near]))
+        # Each near copy is a duplicate of its row earlier in the file
+        self.assertEqual(new_trades, alone[0])
+        self.assertEqual(duplicates, alone[1] * 2 + alone[0])
+        self.assertEqual(canceled, alone[2] * 2)
+        self.assertEqual(TradeUploadBlofin.objects.filter(owner=self.owner).count(), new_trades)
+
+
+class InsertCountTests(TestCase):
+    """New trades are counted from the chunk itself, not by counting the table."""
+
+    def setUp(self):
+        self.owner = User.objects.create(username="owner")
+        self.processor = CsvCopyProcessor(BloFinHandler())
+
+    def ingest(self, frame):
+        return self.processor.process_csv_data(frame, self.owner, 'BloFin', 'file.csv')
+
+    def test_no_count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            new_trades, duplicates, canceled = self.ingest(export_frame(300, seed=1))
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql'].upper()])
+        stored = TradeUploadBlofin.objects.filter(owner=self.owner).count()
+        self.assertEqual(new_trades, stored)
+        self.assertEqual(new_trades + duplicates + canceled, 300)
+
+    def test_concurrent_inserts_are_not_counted(self):
+        frame = export_frame(300, seed=1)
+        self.ingest(frame.iloc[:100])
+        stored = TradeUploadBlofin.objects.filter(owner=self.owner, file_name='file.csv').count()
+        unstored_trades = self.processor.unstored_trades
+        racing = []
+
+        def insert_concurrently(trades):
+            # Another upload of the same rows lands between this one's
+            # check and its insert
+            unstored = unstored_trades(trades)
+            if not racing:
+                racing.append(CsvCopyProcessor(BloFinHandler()).process_csv_data(
+                    frame.iloc[100:150], self.owner, 'BloFin', 'other.csv'))
+            return unstored
+
+        with mock.patch.object(self.processor, 'unstored_trades', side_effect=insert_concurrently):
+            new_trades, duplicates, canceled = self.ingest(frame)
+        raced = TradeUploadBlofin.objects.filter(owner=self.owner, file_name='other.csv').count()
+        self.assertGreater(raced, 0)
+        self.assertEqual(racing[0][0], raced)
+        self.assertEqual(new_trades, TradeUploadBlofin.objects.filter(
+            owner=self.owner, file_name='file.csv').count() - stored)
+        # Every row is either stored once or counted as a duplicate
+        self.assertEqual(new_trades, self.ingest_reference(frame) - stored - raced)
+        self.assertEqual(new_trades + duplicates + canceled, 300)
+
+    def ingest_reference(self, frame):
+        """The trades one upload of ``frame`` stores for a fresh owner."""
+        return self.processor.process_csv_data(
+            frame, User.objects.create(username="reference"), 'BloFin', 'reference.csv')[0]
+
+
+class PositionResumeTests(TransactionTestCase):
+    """
+    Positions accumulated upload by upload, each resuming from a stored
+    snapshot, match positions accumulated from scratch.
+    """
+
+    def positions(self, parts):
+        owner = User.objects.create(username=f"owner{len(parts)}")
+        processor = CsvCopyProcessor(BloFinHandler())
+        for number, part in enumerate(parts):
+            processor.process_csv_data(part, owner, 'BloFin', f"{number}.csv")
+            asset_names = TradeUploadBlofin.objects.filter(owner=owner, is_processed=False).order_by(
+                ).values_list('underlying_asset', flat=True).distinct()
+            for asset_name in asset_names:
+                self.assertTrue(process_asset_in_background.apply((owner.id, asset_name)).get())
+        return list(PositionSnapshot.objects.filter(owner=owner).order_by(
+            'underlying_asset', 'order_time').values_list(
+            'underlying_asset', 'order_time', 'position', 'avg_entry_price', 'realized_pnl', 'fees'))
+
+    def assertSameValue(self, actual, expected):
+        if connection.vendor == 'postgresql' or not isinstance(expected, Decimal):
+            self.assertEqual(actual, expected)
+        else:
+            # SQLite stores the decimals as floats
+            self.assertLessEqual(abs(actual - expected), abs(expected) * Decimal('1e-9') + Decimal('1e-9'))
+
+    def test_incremental_matches_from_scratch(self):
+        # Exports list the newest orders first
+        frame = export_frame(900, seed=4)
+        expected = self.positions([frame])
+        actual = self.positions([frame.iloc[600:], frame.iloc[300:600], frame.iloc[:300]])
+        self.assertEqual(len(actual), len(expected))
+        for actual_row, expected_row in zip(actual, expected):
+            for actual_value, expected_value in zip(actual_row, expected_row):
+                self.assertSameValue(actual_value, expected_value)
+
+    def test_table_read_resumes_without_snapshot(self):
+        owner = User.objects.create(username="table")
+        CsvCopyProcessor(BloFinHandler()).process_csv_data(
+            single_asset_frame(300, seed=4), owner, 'BloFin', 'file.csv')
+        self.assertTrue(process_asset_in_background.apply((owner.id, 'BTCUSDT')).get())
+        snapshots = PositionSnapshot.objects.filter(owner=owner).order_by('order_time', 'trade_id')
+        expected = list(snapshots.values_list('trade_id', 'position', 'realized_pnl', 'fees'))
+        since = snapshots.values_list('order_time', 'trade_id')[200]
+
+        processor = TradeMatcherProcessor(owner)
+        with mock.patch('upload_csv.trade_matcher.get_trade_snapshot',
+                        side_effect=AssertionError("snapshot loaded")), \
+                mock.patch.object(processor, 'query_rows', wraps=processor.query_rows) as query_rows:
+            processor.accumulate_positions('BTCUSDT', since, from_table=True)
+
+        # Only the trades after the resumed snapshot are read
+        self.assertEqual(query_rows.call_args.kwargs['after'],
+                         tuple(snapshots.values_list('order_time', 'trade_id')[199]))
+        actual = list(snapshots.values_list('trade_id', 'position', 'realized_pnl', 'fees'))
+        self.assertEqual(len(actual), len(expected))
+        for actual_row, expected_row in zip(actual, expected):
+            for actual_value, expected_value in zip(actual_row, expected_row):
+                self.assertSameValue(actual_value, expected_value)
+
+
+def matching_state(owner):
+    """
+    Everything matching writes for an owner, with trades identified by
+    their order times, which are the same for every owner of an export.
+    """
+    return {
+        'trades': list(TradeUploadBlofin.objects.filter(owner=owner).order_by(
+            'order_time', 'id').values_list(
+            'order_time', 'side', 'filled_quantity', 'is_matched',
+            'is_partially_matched', 'is_open')),
+        'allocations': list(TradeAllocation.objects.filter(owner=owner).order_by(
+            'underlying_asset', 'exit_time', 'entry_time').values_list(
+            'underlying_asset', 'round_trip_number', 'direction', 'entry_time',
+            'exit_time', 'quantity', 'entry_price', 'exit_price', 'entry_fee',
+            'exit_fee', 'realized_pnl')),
+        'round_trips': list(RoundTrip.objects.filter(owner=owner).order_by(
+            'underlying_asset', 'number').values_list(
+            'underlying_asset', 'number', 'direction', 'opened_at', 'closed_at',
+            'quantity', 'avg_entry_price', 'avg_exit_price', 'fees', 'realized_pnl')),
+        'positions': list(PositionSnapshot.objects.filter(owner=owner).order_by(
+            'underlying_asset', 'order_time').values_list(
+            'underlying_asset', 'order_time', 'position', 'avg_entry_price',
+            'realized_pnl', 'fees')),
+        'live_trades': sorted(
+            (live_trade.asset, live_trade.total_quantity, live_trade.long_short,
+             live_trade.live_fill, live_trade.is_live,
+             sorted(live_trade.trade_ids.values_list('order_time', flat=True)))
+            for live_trade in LiveTrades.objects.filter(owner=owner)),
+    }
+
+
+class IncrementalMatchingTests(TransactionTestCase):
+    """
+    Matching after an upload resumes from the latest checkpoint before its
+    earliest new trade, and ends where matching from scratch would.
+    """
+
+    def setUp(self):
+        # A few hundred trades then span several checkpoints
+        patcher = mock.patch.object(TradeMatcherProcessor, 'CHECKPOINT_INTERVAL', 50)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, owner, frame, file_name):
+        """Ingest and match ``frame``; return the number of trades matched."""
+        CsvCopyProcessor(BloFinHandler()).process_csv_data(frame, owner, 'BloFin', file_name)
+        with mock.patch.object(FifoMatchingEngine, 'process', autospec=True,
+                               side_effect=FifoMatchingEngine.process) as process:
+            self.assertTrue(process_asset_in_background.apply((owner.id, 'BTCUSDT')).get())
+        return sum(len(call.args[1]) for call in process.call_args_list)
+
+    def test_rematch_from_the_earliest_new_trade(self):
+        # Exports list the newest orders first
+        frame = single_asset_frame(600, seed=12)
+        scratch = User.objects.create(username="scratch")
+        self.upload(scratch, frame, 'all.csv')
+
+        owner = User.objects.create(username="incremental")
+        self.upload(owner, pd.concat([frame.iloc[30:300], frame.iloc[330:]]), 'first.csv')
+        stored = TradeUploadBlofin.objects.filter(owner=owner).count()
+
+        # Newer trades resume from the checkpoint at the end of the last run
+        matched = self.upload(owner, frame.iloc[:30], 'newest.csv')
+        newest = TradeUploadBlofin.objects.filter(owner=owner, file_name='newest.csv').count()
+        self.assertGreater(newest, 0)
+        self.assertEqual(matched, newest)
+
+        # Trades in the middle resume from the checkpoint before them
+        matched = self.upload(owner, frame.iloc[300:330], 'middle.csv')
+        trades = TradeUploadBlofin.objects.filter(owner=owner)
+        earliest = trades.filter(file_name='middle.csv').order_by('order_time', 'id').first()
+        after = trades.filter(Q(order_time__gt=earliest.order_time)
+                              | Q(order_time=earliest.order_time, id__gte=earliest.id)).count()
+        self.assertGreaterEqual(matched, after)
+        self.assertLess(matched, after + TradeMatcherProcessor.CHECKPOINT_INTERVAL)
+        self.assertLess(matched, stored)
+
+        expected, actual = matching_state(scratch), matching_state(owner)
+        # Positions resumed from stored snapshots carry SQLite's float
+        # rounding; PositionResumeTests compares them
+        for name in ('trades', 'allocations', 'round_trips', 'live_trades'):
+            self.assertEqual(actual[name], expected[name], name)
+
+
+class DeleteRematchTests(UploadTestCase):
+    """
+    Deleting a file's trades re-matches its assets, ending where matching
+    the remaining trades from scratch would.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # A few hundred trades then span several checkpoints
+        patcher = mock.patch.object(TradeMatcherProcessor, 'CHECKPOINT_INTERVAL', 50)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Newest order first
+        self.frame = generate_frame(600, seed=13)
+
+    def upload_for(self, owner, name, rows):
+        self.client.force_authenticate(owner)
+        self.upload(name, self.csv_bytes(rows))
+
+    def assertRematched(self, kept, deleted):
+        scratch = User.objects.create(username="scratch")
+        self.upload_for(scratch, 'scratch.csv', kept)
+
+        # The kept rows leave a gap where the deleted ones go, so those
+        # are uploaded first rather than skipped as inside its range
+        self.upload_for(self.owner, 'deleted.csv', deleted)
+        self.upload_for(self.owner, 'kept.csv', kept)
+        self.assertNotEqual(matching_state(self.owner)['round_trips'],
+                            matching_state(scratch)['round_trips'])
+        deleted_file = FileName.objects.get(owner=self.owner, file_name='deleted.csv')
+        response = self.client.delete(f'/filenames/delete/{deleted_file.id}/')
+        self.assertEqual(response.status_code, 204)
+
+        self.assertFalse(TradeUploadBlofin.objects.filter(
+            owner=self.owner, is_processed=False).exists())
+        expected, actual = matching_state(scratch), matching_state(self.owner)
+        for name in ('trades', 'allocations', 'round_trips', 'live_trades'):
+            self.assertEqual(actual[name], expected[name], name)
+        # Resumed positions carry SQLite's float rounding; PositionResumeTests
+        # compares their values
+        self.assertEqual([row[:2] for row in actual['positions']],
+                         [row[:2] for row in expected['positions']])
+
+    def test_delete_middle_trades(self):
+        self.assertRematched(pd.concat([self.frame.iloc[:200], self.frame.iloc[400:]]),
+                             self.frame.iloc[200:400])
+
+    def test_delete_newest_trades(self):
+        # No trade is left after the deleted ones to resume matching from
+        self.assertRematched(self.frame.iloc[200:], self.frame.iloc[:200])
+
+
+class TradeSnapshotCacheTests(TransactionTestCase):
+    """
+    Cached snapshots are reloaded once their asset's trades change or its
+    version is lost, and the least recently used ones make way for others.
+    Versions are bumped on commit, so transactions really commit.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create(username="cached")
+        self.cache = TradeSnapshotCache(max_entries=2)
+        patcher = mock.patch.object(TradeSnapshot, 'load', wraps=TradeSnapshot.load)
+        self.load = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ingest(self, asset, seed):
+        CsvCopyProcessor(BloFinHandler()).process_csv_data(
+            single_asset_frame(30, seed, asset), self.owner, 'BloFin', f"{asset}{seed}.csv")
+
+    def loaded(self):
+        return [call.args[1] for call in self.load.call_args_list]
+
+    def test_insert_reloads(self):
+        self.ingest('BTCUSDT', 1)
+        snapshot = self.cache.get(self.owner.id, 'BTCUSDT')
+        self.assertIs(self.cache.get(self.owner.id, 'BTCUSDT'), snapshot)
+
+        self.ingest('BTCUSDT', 2)
+        reloaded = self.cache.get(self.owner.id, 'BTCUSDT')
+        self.assertEqual(len(reloaded), TradeUploadBlofin.objects.filter(
+            owner=self.owner, side__in=['Buy', 'Sell']).count())
+        self.assertGreater(len(reloaded), len(snapshot))
+        self.assertEqual(self.loaded(), ['BTCUSDT', 'BTCUSDT'])
+
+    def test_lost_version_reloads(self):
+        self.ingest('BTCUSDT', 1)
+        snapshot = self.cache.get(self.owner.id, 'BTCUSDT')
+
+        # As if Redis lost the key, and trades changed after it did
+        get_trade_versions().versions.pop((self.owner.id, 'BTCUSDT'))
+        self.ingest('BTCUSDT', 2)
+        reloaded = self.cache.get(self.owner.id, 'BTCUSDT')
+        self.assertGreater(len(reloaded), len(snapshot))
+        self.assertEqual(self.loaded(), ['BTCUSDT', 'BTCUSDT'])
+
+    def test_least_recently_used_is_evicted(self):
+        for seed, asset in enumerate(['BTCUSDT', 'ETHUSDT', 'SOLUSDT']):
+            self.ingest(asset, seed)
+        self.cache.get(self.owner.id, 'BTCUSDT')
+        self.cache.get(self.owner.id, 'ETHUSDT')
+        self.cache.get(self.owner.id, 'BTCUSDT')
+        self.cache.get(self.owner.id, 'SOLUSDT')
+
+        # ETHUSDT was used least recently; BTCUSDT is still cached
+        self.cache.get(self.owner.id, 'BTCUSDT')
+        self.cache.get(self.owner.id, 'ETHUSDT')
+        self.assertEqual(self.loaded(), ['BTCUSDT', 'ETHUSDT', 'SOLUSDT', 'ETHUSDT'])
+
+
+@skipUnless(connection.vendor == 'postgresql', "The SQL matcher runs on PostgreSQL only.")
+class SqlMatcherEquivalenceTests(TransactionTestCase):
+    """
+    Matching in SQL leaves the same state as the Python engine. Trade
+    versions are bumped on commit, so transactions really commit.
+    """
+
+    def matched_state(self, backend, seed):
+        owner = User.objects.create(username=f"{backend}{seed}")
+        CsvCopyProcessor(BloFinHandler()).process_csv_data(
+            export_frame(400, seed=seed), owner, 'BloFin', 'file.csv')
+        asset_names = TradeUploadBlofin.objects.filter(owner=owner).order_by(
+            ).values_list('underlying_asset', flat=True).distinct()
+        with override_settings(TRADE_MATCHER_BACKEND=backend):
+            for asset_name in asset_names:
+                self.assertTrue(process_asset_in_background.apply((owner.id, asset_name)).get())
+
+        return matching_state(owner)
+
+    def test_same_state(self):
+        for seed in range(3):
+            with self.subTest(seed=seed):
+                expected = self.matched_state('python', seed)
+                actual = self.matched_state('sql', seed)
+                for name, rows in expected.items():
+                    self.assertEqual(actual[name], rows, name)
+
+
+class NumpyEngineEquivalenceTests(SimpleTestCase):
+    """NumpyFifoMatchingEngine matches exactly as FifoMatchingEngine does."""
+
+    @staticmethod
+    def snapshot_values(snapshot):
+        # The engines may write the same quantity as '1E-10' or '0.0000000001'
+        return (snapshot['open_side'], snapshot['round_trip'],
+                [(trade_id, Decimal(remaining), Decimal(quantity))
+                 for trade_id, remaining, quantity in snapshot['lots']])
+
+    def outcome(self, engine):
+        return (sorted(engine.results()), list(engine.allocations), engine.round_trip,
+                [(count, self.snapshot_values(snapshot)) for count, snapshot in engine.checkpoints],
+                self.snapshot_values(engine.snapshot()))
+
+    def random_trades(self, rng, count):
+        return [
+            TradeRecord(trade_id, rng.choice(['Buy', 'Sell']),
+                        Decimal(rng.choice([0, rng.randint(1, 40), rng.randint(1, 10 ** 12)])).scaleb(-10))
+            for trade_id in range(1, count + 1)
+        ]
+
+    def test_random_trades_with_resume(self):
+        rng = random.Random(0)
+        for case in range(500):
+            trades = self.random_trades(rng, rng.randint(0, 60))
+            cut = rng.randint(0, len(trades))
+            rest = len(trades) - cut
+            checkpoint_at = sorted(rng.sample(range(1, rest + 1), min(3, rest)))
+            with self.subTest(case=case):
+                python = FifoMatchingEngine().process(trades[:cut])
+                numpy = NumpyFifoMatchingEngine().process(trades[:cut])
+                self.assertEqual(self.outcome(numpy), self.outcome(python))
+
+                # Each resumes from the other's snapshot
+                resumed_python = FifoMatchingEngine.from_snapshot(numpy.snapshot()).process(
+                    trades[cut:], checkpoint_at)
+                resumed_numpy = NumpyFifoMatchingEngine.from_snapshot(python.snapshot()).process(
+                    trades[cut:], checkpoint_at)
+                self.assertEqual(self.outcome(resumed_numpy), self.outcome(resumed_python))
+
+    def test_columns_match_records(self):
+        rng = random.Random(1)
+        trades = self.random_trades(rng, 2000)
+        columns = (np.array([trade.id for trade in trades], dtype=np.int64),
+                   np.array([trade.side == 'Buy' for trade in trades]),
+                   QUANTITY.encode_array([trade.quantity for trade in trades]))
+        checkpoint_at = range(250, 2001, 250)
+        self.assertEqual(
+            self.outcome(NumpyFifoMatchingEngine().process_columns(*columns, checkpoint_at)),
+            self.outcome(FifoMatchingEngine().process(trades, checkpoint_at)))
+
+    def test_overflow_raises(self):
+        trades = [TradeRecord(1, 'Buy', Decimal('5e8')), TradeRecord(2, 'Buy', Decimal('5e8'))]
+        with self.assertRaises(FixedPointError):
+            NumpyFifoMatchingEngine().process(trades)
+
+
+class FixedPointCodecTests(SimpleTestCase):
+    """Decimals go through the codecs and back unchanged."""
+
+    def random_values(self, rng, places, count, digits=8):
+        return [Decimal(rng.randint(-10 ** (digits + places), 10 ** (digits + places))).scaleb(-places)
+                for _ in range(count)]
+
+    def test_round_trip(self):
+        rng = random.Random(0)
+        values = self.random_values(rng, 10, 1000) + [Decimal('0'), Decimal('-0.0000000001'), Decimal('1E+2')]
+        fixed = QUANTITY.encode_array(values)
+        self.assertEqual(QUANTITY.decode_list(fixed.tolist()), values)
+        self.assertEqual([QUANTITY.decode(value) for value in fixed], values)
+        self.assertEqual([Decimal(text) for text in QUANTITY.text_list(fixed)], values)
+        self.assertEqual([Decimal(QUANTITY.text(value)) for value in fixed], values)
+
+    def test_more_places_than_the_scale(self):
+        with self.assertRaises(FixedPointError):
+            QUANTITY.encode(Decimal('0.00000000001'))
+
+    def test_half_even_rounding(self):
+        cases = {
+            '0.00000000005': 0,
+            '0.00000000015': 2,
+            '0.00000000025': 2,
+            '0.000000000251': 3,
+            '-0.00000000025': -2,
+            '-0.00000000035': -4,
+        }
+        values = [Decimal(value) for value in cases]
+        self.assertEqual(QUANTITY.encode_list(values, exact=False), list(cases.values()))
+        self.assertEqual(QUANTITY.encode_list(values, exact=False),
+                         [int(value.quantize(QUANTITY.quantum).scaleb(10)) for value in values])
+
+    def test_int64_overflow(self):
+        largest = Decimal(QUANTITY.INT64_MAX).scaleb(-10)
+        self.assertEqual(QUANTITY.encode_array([largest])[0], QUANTITY.INT64_MAX)
+        for value in (largest + QUANTITY.quantum, -largest - 2 * QUANTITY.quantum):
+            with self.assertRaises(FixedPointError):
+                QUANTITY.encode_array([value])
+
+    def test_wide_prices(self):
+        rng = random.Random(1)
+        values = self.random_values(rng, 20, 1000) + [
+            Decimal('62682.49397828230000000001'), Decimal('-0.00000000000000000001'),
+            Decimal('12345678901234567.89012345678901234567'), Decimal('0')]
+        # One int64 does not hold them at 20 places
+        with self.assertRaises(FixedPointError):
+            PRICE.encode_array(values)
+        high, low = PRICE.encode_wide(values)
+        self.assertTrue(((low >= 0) & (low < PRICE.WIDE_BASE)).all())
+        self.assertEqual(PRICE.decode_wide(high, low), values)
+        for value in (Decimal('1e-21'), Decimal('1e20')):
+            with self.assertRaises(FixedPointError):
+                PRICE.encode_wide([value])
@@ -1,8 +1,18 @@
 import json
 from django.utils import timezone
 from django.db import transaction
-from .models import TradeUploadBlofin
+from .models import (
+    LiveTrades, MatchCheckpoint, PositionSnapshot, RoundTrip, TradeAllocation, TradeUploadBlofin)
+from .progress import IngestProgress
+from .trade_snapshot import TradeSnapshot, get_trade_snapshot
+from .matching import (
+    FifoMatchingEngine, FixedPointError, NumpyFifoMatchingEngine, PositionAccumulator,
+    SqlFifoMatcher, TradeRecord)
+from django.conf import settings
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.db.models.functions import Coalesce
 from decimal import Decimal
+from itertools import chain
 import logging
 
 # Configure logging
@@ -10,12 +20,32 @@ logging.basicConfig(level=logging.DEBUG)  # Set the desired log level
 logger = logging.getLogger(__name__)
 
 class TradeMatcherProcessor:
-    def __init__(self, owner):
+    CHUNK_SIZE = 1000
+    CHECKPOINT_INTERVAL = 5000
+    # Trades matched per committed batch; a multiple of CHECKPOINT_INTERVAL
+    BATCH_SIZE = 50000
+    ENGINES = {
+        'python': FifoMatchingEngine,
+        'numpy': NumpyFifoMatchingEngine,
+    }
+    # Positions in the rows fetched for matching
+    ID, SIDE, QUANTITY, ORDER_TIME, AVG_FILL, FEE = range(6)
+
+    def __init__(self, owner, progress=None):
         self.owner = owner
+        self.progress = progress or IngestProgress()
         self.trades_by_asset = {}
-
-    def process_assets(self, asset_name, chunk_size=None):
+        self.owner_id = getattr(owner, 'id', owner)
+        self.backend = getattr(settings, 'TRADE_MATCHER_BACKEND', 'python')
+
+    def process_assets(self, asset_name, chunk_size=None, batch_size=None):
+        """
+        Match the asset from its earliest unprocessed trade, at most
+        ``batch_size`` trades at a time. Trades past a batch stay
+        unprocessed, so the next call resumes from its checkpoint.
+        """
         logger.debug(f"Starting asset processing for: {asset_name}")
+        self.progress.check_canceled()
 
         # Process trades that have not yet been marked as processed
         unprocessed_trades = TradeUploadBlofin.objects.filter(
@@ -24,19 +54,27 @@ class TradeMatcherProcessor:
             is_processed=False  # Only fetch unprocessed trades
         )
 
+        # Only trades from the earliest new one onward can change
+        earliest = unprocessed_trades.order_by('order_time', 'id').values_list(
+            'order_time', 'id').first()
+
         # If there are no unprocessed trades, stop processing
-        if not unprocessed_trades.exists():
+        if earliest is None:
             logger.info(f"No more unprocessed trades for asset {asset_name}. Stopping processing.")
             return 0
-
-        # Revert filled quantities if necessary (for matching)
-        self.revert_filled_quantity_values(asset_name)
-
-        # Run the matching algorithm
-        self.process_asset_match(asset_name)
+        cursor = self.process_asset_match(asset_name, since=earliest, limit=batch_size)
 
         # After processing, mark the trades as processed
-        unprocessed_trades.update(is_processed=True)
+        if cursor is None:
+            unprocessed_trades.update(is_processed=True)
+        else:
+            order_time, trade_id = cursor
+            after = Q(order_time__gt=order_time) | Q(order_time=order_time, id__gt=trade_id)
+            unprocessed_trades.exclude(after).update(is_processed=True)
+            # Their states are stale until the next batch rewrites them
+            TradeUploadBlofin.objects.filter(
+                after, owner=self.owner, underlying_asset=asset_name, is_processed=True
+            ).update(is_processed=False)
         logger.debug(f"Marked trades as processed for asset: {asset_name}")
 
         # Return the number of remaining unprocessed trades
@@ -48,145 +86,422 @@ class TradeMatcherProcessor:
         
         return remaining_trades
 
-    def revert_filled_quantity_values(self, asset_name):
-        """Revert all trades' filled_quantity values to their original_filled_quantity before processing."""
-        with transaction.atomic():
-            # Retrieve the queryset first
-            trades_queryset = TradeUploadBlofin.objects.filter(
-                owner=self.owner,
-                underlying_asset=asset_name
-            )
-
-            # Check if any trades exist
-            if not trades_queryset.exists():
-                logger.warning(f"No trades found for asset {asset_name}. Skipping revert.")
-                return
+    def resume_checkpoint(self, asset_name, since):
+        """
+        Return the latest checkpoint strictly before ``since`` and drop the
+        ones it invalidates, or None to match the asset from the start.
+        """
+        checkpoints = MatchCheckpoint.objects.filter(
+            owner=self.owner, underlying_asset=asset_name)
+        if since is None:
+            checkpoints.delete()
+            return None
+
+        order_time, trade_id = since
+        before = Q(order_time__lt=order_time) | Q(order_time=order_time, trade_id__lt=trade_id)
+        checkpoints.exclude(before).delete()
+        return checkpoints.filter(before).order_by('order_time', 'trade_id').last()
+
+    def build_checkpoint(self, asset_name, row, position, snapshot):
+        return MatchCheckpoint(
+            owner_id=self.owner_id,
+            underlying_asset=asset_name,
+            order_time=row[self.ORDER_TIME],
+            trade_id=row[self.ID],
+            position=position,
+            state=snapshot,
+        )
 
-            # Use iterator for memory efficiency
-            for trade in trades_queryset.iterator(chunk_size=100):
-                original_value = trade.original_filled_quantity
-                if original_value is None:
-                    logger.warning(f"Trade ID={trade.id} does not have an original_filled_quantity. Skipping revert.")
-                    continue
-
-                try:
-                    TradeUploadBlofin.objects.filter(id=trade.id).update(
-                        filled_quantity=original_value,
-                        is_open=False,
-                        is_matched=False,
-                        is_partially_matched=False,
-                    )
-                    logger.info(f"Reverted trade ID={trade.id} filled_quantity to {original_value}.")
-
-                except Exception as e:
-                    logger.error(f"Failed to revert trade ID={trade.id}. Error: {e}")
-
-    def process_asset_match(self, asset_name):
+    def run_engine(self, engine_class, checkpoint, rows, checkpoint_at, columns=None):
+        """
+        Match ``rows`` with ``engine_class``, falling back to the Python
+        engine when the NumPy one cannot hold the quantities in int64
+        fixed point.
+
+        :param columns: The same trades as a TradeSnapshot slice, which an
+            engine with ``process_columns`` matches without the rows.
+        """
+        try:
+            engine = self.build_engine(engine_class, checkpoint)
+            if columns is not None and hasattr(engine, 'process_columns'):
+                return engine.process_columns(
+                    columns['id'], columns['side'] == TradeSnapshot.BUY, columns['quantity'],
+                    checkpoint_at)
+            return engine.process(self.records(rows), checkpoint_at)
+        except FixedPointError as e:
+            logger.warning(f"Falling back to the Python matching engine: {e}")
+            return self.build_engine(FifoMatchingEngine, checkpoint).process(
+                self.records(rows), checkpoint_at)
+
+    def records(self, rows):
+        return [TradeRecord(row[self.ID], row[self.SIDE], row[self.QUANTITY]) for row in rows]
+
+    def build_engine(self, engine_class, checkpoint):
+        if checkpoint is None:
+            return engine_class()
+        return engine_class.from_snapshot(checkpoint.state)
+
+    def process_asset_match(self, asset_name, since=None, limit=None):
+        """
+        FIFO-match an asset's trades, resuming from the latest checkpoint
+        before ``since`` (an (order_time, id) pair) when there is one, and
+        rewrite its allocations and round trips from the same point.
+
+        :param limit: Match at most this many trades and checkpoint after
+            the last of them. The SQL backend always matches them all.
+        :return: The (order_time, id) of the last trade matched when
+            ``limit`` stopped the run early, otherwise None.
+        """
         logger.debug(f"Processing asset match for: {asset_name}")
+        self.progress.check_canceled()
+
+        backend = self.backend
+        if backend == 'sql':
+            if SqlFifoMatcher.is_supported():
+                # Checkpoints before the new trades stay valid for the
+                # other engines; the statements themselves need none
+                self.resume_checkpoint(asset_name, since)
+                matcher = SqlFifoMatcher(TradeUploadBlofin, TradeAllocation)
+                with transaction.atomic():
+                    self.clear_allocations(asset_name, None)
+                    changed, closed_round_trips = matcher.match_asset(self.owner_id, asset_name)
+                    self.rebuild_round_trips(asset_name, 0, closed_round_trips)
+                    # Positions depend on the order of the trades, so they
+                    # are still accumulated in Python from ``since`` on,
+                    # reading only those trades rather than a snapshot of all
+                    self.accumulate_positions(asset_name, since, from_table=True)
+                    self.update_live_trade_in_sql(asset_name)
+                logger.debug(f"Matched asset {asset_name} in SQL; {changed} trades changed")
+                return None
+            logger.debug("SQL matching needs PostgreSQL; using the Python engine.")
+            backend = 'python'
+
+        checkpoint = self.resume_checkpoint(asset_name, since)
+        if checkpoint is None:
+            position, after = 0, None
+        else:
+            position, after = checkpoint.position, (checkpoint.order_time, checkpoint.trade_id)
+        # One extra row tells whether the batch ends the asset
+        fetch_limit = None if limit is None else limit + 1
+        columns = self.fetch_columns(asset_name, after=after, limit=fetch_limit)
+        if columns is None:
+            rows = self.fetch_rows(asset_name, after=after, limit=fetch_limit)
+            partial = limit is not None and len(rows) > limit
+            rows = rows[:limit]
+        else:
+            partial = limit is not None and len(columns) > limit
+            # The engines take the columns; the writes below need Decimals
+            columns = columns[:limit]
+            rows = TradeSnapshot.to_rows(columns)
+
+        # Checkpoint on every interval boundary and after the last trade
+        interval = self.CHECKPOINT_INTERVAL
+        checkpoint_at = list(range(interval - position % interval, len(rows) + 1, interval))
+        if rows and (position + len(rows)) % interval:
+            checkpoint_at.append(len(rows))
+
+        engine = self.run_engine(self.ENGINES[backend], checkpoint, rows, checkpoint_at, columns)
 
-        # Initialize buy and sell status lists
-        buy_status = []
-        sell_status = []
-
-        # Process buys in chunks
-        for buy in TradeUploadBlofin.objects.filter(
-            owner=self.owner, underlying_asset=asset_name, side='Buy'
-        ).iterator(chunk_size=100):  # Chunking by 100
-            buy_status.append({
-                'id': buy.id,
-                'value': buy.filled_quantity,
-                'is_matched': False,
-                'is_partially_matched': False,
-                'is_open': True
-            })
-
-        # Process sells in chunks
-        for sell in TradeUploadBlofin.objects.filter(
-            owner=self.owner, underlying_asset=asset_name, side='Sell'
-        ).iterator(chunk_size=100):  # Chunking by 100
-            sell_status.append({
-                'id': sell.id,
-                'value': sell.filled_quantity,
-                'is_matched': False,
-                'is_partially_matched': False,
-                'is_open': True
-            })
-
-        logger.debug(f"Buys: {buy_status}, Sells: {sell_status}")
-        i = 0  # Pointer for `buys`
-        while i < len(buy_status) and sell_status:
-            logger.debug(f"Processing Buy ID: {buy_status[i]['id']} with value: {buy_status[i]['value']}")
-            logger.debug(f"Current Sell ID: {sell_status[0]['id']} with value: {sell_status[0]['value']}")
-
-            if buy_status[i]['value'] >= sell_status[0]['value']:
-                buy_status[i]['value'] -= sell_status[0]['value']
-                sell_status[0]['value'] = 0
-
-                sell_status[0]['is_matched'] = True
-                sell_status[0]['is_open'] = False
-                self.update_trade_status(sell_status)
-                logger.info(f"Matched Sell ID: {sell_status[0]['id']} with Buy ID: {buy_status[i]['id']}")
-                sell_status.pop(0)
-                
-                if buy_status[i]['value'] == 0:
-                    buy_status[i]['is_matched'] = True
-                    buy_status[i]['is_open'] = False
-                    buy_status[i]['is_partially_matched'] = False
-            else:
-                sell_status[0]['value'] -= buy_status[i]['value']
-                buy_status[i]['value'] = 0
-                buy_status[i]['is_matched'] = True
-                buy_status[i]['is_open'] = False
-                buy_status[i]['is_partially_matched'] = False
-
-                logger.info(f"Partially matched Buy ID: {buy_status[i]['id']} with Sell ID: {sell_status[0]['id']}.")
-
-            if buy_status[i]['value'] == 0:
-                i += 1
-
-        self.update_trade_status(buy_status)
-        self.update_trade_status(sell_status)
-
-    def update_trade_status(self, buy_status):
-        for buy in buy_status:
-            trade = TradeUploadBlofin.objects.get(id=buy['id'])
-            trade.is_matched = buy['is_matched']
-            trade.is_partially_matched = buy['is_partially_matched']
-            trade.is_open = buy['is_open']
-            trade.save()
-            logger.info(f"Updated trade ID: {trade.id} with status: matched={buy['is_matched']}, partially_matched={buy['is_partially_matched']}, open={buy['is_open']}")
-
-class TradeIdMatcher:
-    def __init__(self, owner):
-        self.owner = owner
-
-    def check_trade_ids(self, chunk_size=100):
-        # Fetch unprocessed trades only
-        unprocessed_trades = TradeUploadBlofin.objects.filter(
-            owner=self.owner,
-            is_processed=False  # Only process unprocessed trades
+        with transaction.atomic():
+            # A tail checkpoint is superseded by the one written below
+            if checkpoint is not None and position % interval:
+                checkpoint.delete()
+            MatchCheckpoint.objects.bulk_create([
+                self.build_checkpoint(asset_name, rows[count - 1], position + count, snapshot)
+                for count, snapshot in engine.checkpoints
+            ])
+            self.write_results(engine)
+            self.clear_allocations(asset_name, checkpoint)
+            TradeAllocation.objects.bulk_create(
+                self.build_allocations(asset_name, engine, rows), batch_size=self.CHUNK_SIZE)
+            first_round_trip = 0 if checkpoint is None else checkpoint.state.get('round_trip', 0)
+            self.rebuild_round_trips(asset_name, first_round_trip, engine.round_trip)
+            if rows:
+                first = (rows[0][self.ORDER_TIME], rows[0][self.ID])
+                self.accumulate_positions(asset_name, first, rows)
+            # Lots past a batch are not final yet
+            if not partial:
+                snapshot = engine.snapshot()
+                self.update_live_trade(asset_name, snapshot['open_side'], [
+                    (trade_id, Decimal(remaining)) for trade_id, remaining, _ in snapshot['lots']])
+
+        if partial:
+            return rows[-1][self.ORDER_TIME], rows[-1][self.ID]
+        return None
+
+    def trade_snapshot(self, asset_name):
+        """The asset's cached trade snapshot, or None to read the table."""
+        try:
+            return get_trade_snapshot(self.owner_id, asset_name)
+        except FixedPointError as e:
+            logger.debug(f"Reading {asset_name} trades from the table: {e}")
+            return None
+
+    def fetch_columns(self, asset_name, after=None, before=None, limit=None):
+        """
+        The trades ``fetch_rows`` would return as a slice of the asset's
+        cached TradeSnapshot, or None when it cannot be held in fixed point.
+        """
+        snapshot = self.trade_snapshot(asset_name)
+        if snapshot is None:
+            return None
+        start = 0 if after is None else snapshot.index_of(*after, side='right')
+        stop = len(snapshot) if before is None else snapshot.index_of(*before)
+        if limit is not None:
+            stop = min(stop, start + limit)
+        return snapshot.slice(start, stop)
+
+    def fetch_rows(self, asset_name, after=None, before=None, limit=None):
+        """
+        The asset's Buy/Sell trades strictly between the (order_time, id)
+        keys ``after`` and ``before`` as (id, side, quantity, order_time,
+        avg_fill, fee) rows in (order_time, id) order.
+        """
+        columns = self.fetch_columns(asset_name, after, before, limit)
+        if columns is not None:
+            return TradeSnapshot.to_rows(columns)
+        return self.query_rows(asset_name, after, before, limit)
+
+    def query_rows(self, asset_name, after=None, before=None, limit=None):
+        """``fetch_rows`` read from the table, bypassing the snapshot cache."""
+        trades = TradeUploadBlofin.objects.filter(
+            owner=self.owner, underlying_asset=asset_name, side__in=['Buy', 'Sell'])
+        if after is not None:
+            trades = trades.filter(
+                Q(order_time__gt=after[0]) | Q(order_time=after[0], id__gt=after[1]))
+        if before is not None:
+            trades = trades.filter(
+                Q(order_time__lt=before[0]) | Q(order_time=before[0], id__lt=before[1]))
+        trades = trades.order_by('order_time', 'id').values_list(
+            'id', 'side', Coalesce('original_filled_quantity', 'filled_quantity'),
+            'order_time', 'avg_fill', 'fee')
+        if limit is not None:
+            trades = trades[:limit]
+        return list(trades.iterator(chunk_size=self.CHUNK_SIZE))
+
+    def fetch_rows_by_id(self, asset_name, trade_ids):
+        """The rows of the given trades of the asset, in no particular order."""
+        snapshot = self.trade_snapshot(asset_name)
+        if snapshot is not None:
+            return snapshot.rows_by_id(trade_ids)
+        return list(TradeUploadBlofin.objects.filter(id__in=trade_ids).values_list(
+            'id', 'side', Coalesce('original_filled_quantity', 'filled_quantity'),
+            'order_time', 'avg_fill', 'fee'))
+
+    def write_results(self, engine):
+        # Closed trades all get the same values, so they are written with a
+        # plain UPDATE per id chunk; only the open lots need per-row values
+        closed_ids = []
+        open_trades = []
+        for trade_id, remaining, is_matched, is_partially_matched, is_open in engine.results():
+            if is_matched:
+                closed_ids.append(trade_id)
+                continue
+            open_trades.append(TradeUploadBlofin(
+                id=trade_id,
+                filled_quantity=remaining,
+                is_matched=is_matched,
+                is_partially_matched=is_partially_matched,
+                is_open=is_open,
+            ))
+
+        for start in range(0, len(closed_ids), self.CHUNK_SIZE):
+            TradeUploadBlofin.objects.filter(
+                id__in=closed_ids[start:start + self.CHUNK_SIZE]
+            ).update(
+                filled_quantity=Decimal('0'),
+                is_matched=True,
+                is_partially_matched=False,
+                is_open=False,
+            )
+        TradeUploadBlofin.objects.bulk_update(
+            open_trades, ['filled_quantity', 'is_matched', 'is_partially_matched', 'is_open'],
+            batch_size=self.CHUNK_SIZE)
+        logger.debug(f"Matched {len(closed_ids) + len(open_trades)} trades")
+
+    def clear_allocations(self, asset_name, checkpoint):
+        """Drop the allocations and round trips a run from ``checkpoint`` rewrites."""
+        allocations = TradeAllocation.objects.filter(owner=self.owner, underlying_asset=asset_name)
+        round_trips = RoundTrip.objects.filter(owner=self.owner, underlying_asset=asset_name)
+        if checkpoint is not None:
+            # Allocations are made when their exit trade is matched
+            allocations = allocations.filter(
+                Q(exit_time__gt=checkpoint.order_time)
+                | Q(exit_time=checkpoint.order_time, exit_trade_id__gt=checkpoint.trade_id))
+            round_trips = round_trips.filter(number__gte=checkpoint.state.get('round_trip', 0))
+        allocations.delete()
+        round_trips.delete()
+
+    def build_allocations(self, asset_name, engine, rows):
+        trades = {row[self.ID]: row for row in rows}
+        # Lots resumed from the checkpoint belong to earlier trades
+        resumed = {
+            trade_id for allocation in engine.allocations for trade_id in allocation[:2]
+        } - trades.keys()
+        if resumed:
+            trades.update(
+                (row[self.ID], row) for row in self.fetch_rows_by_id(asset_name, resumed))
+
+        allocations = []
+        for entry_id, exit_id, quantity, round_trip in engine.allocations:
+            entry, exit = trades[entry_id], trades[exit_id]
+            buy, sell = (entry, exit) if entry[self.SIDE] == 'Buy' else (exit, entry)
+            allocations.append(TradeAllocation(
+                owner_id=self.owner_id,
+                underlying_asset=asset_name,
+                round_trip_number=round_trip,
+                direction='Long' if entry is buy else 'Short',
+                entry_trade_id=entry_id,
+                exit_trade_id=exit_id,
+                entry_time=entry[self.ORDER_TIME],
+                exit_time=exit[self.ORDER_TIME],
+                quantity=quantity,
+                entry_price=entry[self.AVG_FILL],
+                exit_price=exit[self.AVG_FILL],
+                entry_fee=entry[self.FEE] * quantity / entry[self.QUANTITY],
+                exit_fee=exit[self.FEE] * quantity / exit[self.QUANTITY],
+                realized_pnl=(sell[self.AVG_FILL] - buy[self.AVG_FILL]) * quantity,
+            ))
+        return allocations
+
+    def accumulate_positions(self, asset_name, since, rows=None, from_table=False):
+        """
+        Rewrite the asset's position snapshots from the trade at ``since``
+        on, resuming from the latest snapshot before it.
+
+        :param rows: The matching rows from ``since`` on, when the caller
+            has them; only trades between them and the resumed snapshot
+            are read.
+        :param from_table: Read those trades with a query bounded by the
+            resumed snapshot instead of loading the asset's TradeSnapshot,
+            for callers that never need the snapshot otherwise.
+        """
+        snapshots = PositionSnapshot.objects.filter(owner=self.owner, underlying_asset=asset_name)
+        previous = None
+        if since is None:
+            snapshots.delete()
+        else:
+            order_time, trade_id = since
+            before = Q(order_time__lt=order_time) | Q(order_time=order_time, trade_id__lt=trade_id)
+            snapshots.exclude(before).delete()
+            previous = snapshots.filter(before).order_by('order_time', 'trade_id').last()
+
+        accumulator = (PositionAccumulator() if previous is None
+                       else PositionAccumulator.from_snapshot(previous))
+        fetch_rows = self.query_rows if from_table else self.fetch_rows
+        missing = fetch_rows(
+            asset_name,
+            after=None if previous is None else (previous.order_time, previous.trade_id),
+            before=since if rows is not None else None)
+        batch = []
+        for row in chain(missing, rows or ()):
+            accumulator.add(row[self.SIDE], row[self.QUANTITY], row[self.AVG_FILL], row[self.FEE])
+            batch.append(PositionSnapshot(
+                owner_id=self.owner_id,
+                underlying_asset=asset_name,
+                trade_id=row[self.ID],
+                order_time=row[self.ORDER_TIME],
+                position=accumulator.position,
+                avg_entry_price=accumulator.avg_entry_price,
+                realized_pnl=accumulator.realized_pnl,
+                fees=accumulator.fees,
+            ))
+            if len(batch) == self.CHUNK_SIZE:
+                PositionSnapshot.objects.bulk_create(batch)
+                batch = []
+        PositionSnapshot.objects.bulk_create(batch)
+
+    def update_live_trade(self, asset_name, open_side, lots):
+        """
+        Upsert the asset's LiveTrades row from its open lots.
+
+        :param lots: (trade_id, remaining) pairs of the open side.
+        """
+        trade_ids = [trade_id for trade_id, _ in lots]
+        total = sum((remaining for _, remaining in lots), Decimal('0'))
+        value = None
+        if total:
+            prices = {row[self.ID]: row[self.AVG_FILL]
+                      for row in self.fetch_rows_by_id(asset_name, trade_ids)}
+            value = sum(remaining * prices[trade_id] for trade_id, remaining in lots)
+        self.save_live_trade(asset_name, open_side, trade_ids, total, value)
+
+    def update_live_trade_in_sql(self, asset_name):
+        """
+        ``update_live_trade`` from the open lots as stored, summed by the
+        database; only the ids of the open trades are read.
+        """
+        open_trades = TradeUploadBlofin.objects.filter(
+            owner=self.owner, underlying_asset=asset_name,
+            side__in=['Buy', 'Sell'], is_open=True)
+        totals = open_trades.aggregate(
+            total=Coalesce(Sum('filled_quantity'), Decimal('0')),
+            value=Sum(F('filled_quantity') * F('avg_fill')))
+        open_side = open_trades.order_by('order_time', 'id').values_list('side', flat=True).first()
+        self.save_live_trade(
+            asset_name, open_side, list(open_trades.values_list('id', flat=True)),
+            totals['total'], totals['value'])
+
+    def save_live_trade(self, asset_name, open_side, trade_ids, total, entry_value):
+        """
+        Upsert the asset's LiveTrades row for ``total`` open quantity worth
+        ``entry_value`` at its entry prices, writing only the fields and trade
+        links that changed.
+        """
+        live_fill = None
+        if total:
+            live_fill = (entry_value / total).quantize(Decimal('1e-10'))
+        values = {
+            'total_quantity': total,
+            'long_short': {'Buy': 'Long', 'Sell': 'Short'}.get(open_side) if total else None,
+            'live_fill': live_fill,
+            'is_live': bool(total),
+        }
+
+        live_trade = LiveTrades.objects.filter(owner=self.owner, asset=asset_name).first()
+        if live_trade is None:
+            if not total:
+                return
+            live_trade = LiveTrades.objects.create(
+                owner_id=self.owner_id, asset=asset_name, **values)
+        else:
+            changed = [field for field, value in values.items()
+                       if getattr(live_trade, field) != value]
+            if changed:
+                for field in changed:
+                    setattr(live_trade, field, values[field])
+                live_trade.save(update_fields=changed + ['last_updated'])
+        live_trade.trade_ids.set(trade_ids)
+
+    def rebuild_round_trips(self, asset_name, first_number, closed_count):
+        """Summarise the closed round trips numbered from ``first_number``."""
+        totals = TradeAllocation.objects.filter(
+            owner=self.owner, underlying_asset=asset_name,
+            round_trip_number__gte=first_number, round_trip_number__lt=closed_count,
+        ).order_by().values('round_trip_number', 'direction').annotate(
+            opened_at=Min('entry_time'),
+            closed_at=Max('exit_time'),
+            closed_quantity=Sum('quantity'),
+            entry_value=Sum(F('entry_price') * F('quantity')),
+            exit_value=Sum(F('exit_price') * F('quantity')),
+            fee_total=Sum(F('entry_fee') + F('exit_fee')),
+            pnl=Sum('realized_pnl'),
+            allocations=Count('id'),
         )
-
-        if not unprocessed_trades.exists():
-            logger.info("No unprocessed trade IDs found. Stopping.")
-            return {}
-
-        asset_ids = {}
-
-        asset_ids = {}
-
-        # Process trades in chunks
-        for trade in unprocessed_trades:
-            asset = trade.underlying_asset
-            if asset not in asset_ids:
-                asset_ids[asset] = []
-            asset_ids[asset].append(trade.id)
-
-        # Initialize TradeMatcherProcessor
-        processor = TradeMatcherProcessor(owner=self.owner)
-
-        # Process each asset name that was found
-        for asset_name in asset_ids.keys():
-            processor.process_assets(asset_name, chunk_size=chunk_size)
-
-        return asset_ids
+        RoundTrip.objects.bulk_create([
+            RoundTrip(
+                owner_id=self.owner_id,
+                underlying_asset=asset_name,
+                number=total['round_trip_number'],
+                direction=total['direction'],
+                opened_at=total['opened_at'],
+                closed_at=total['closed_at'],
+                quantity=total['closed_quantity'],
+                avg_entry_price=total['entry_value'] / total['closed_quantity'],
+                avg_exit_price=total['exit_value'] / total['closed_quantity'],
+                fees=total['fee_total'],
+                realized_pnl=total['pnl'],
+                allocation_count=total['allocations'],
+            )
+            for total in totals
+        ], batch_size=self.CHUNK_SIZE)
@@ -0,0 +1,180 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db.models.functions import Coalesce
+from .coordination import get_trade_versions
+from .models import TradeUploadBlofin
+from .utils.fixed_point import FixedPointError, PRICE, QUANTITY
+import numpy as np
+import threading
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def to_epoch_ns(value):
+    return (value - EPOCH) // timedelta(microseconds=1) * 1000
+
+
+def from_epoch_ns(value):
+    return EPOCH + timedelta(microseconds=value // 1000)
+
+
+class TradeSnapshot:
+    """
+    An owner's Buy/Sell trades of one asset as a NumPy structured array in
+    (order_time, id) order: quantities and fees in int64 fixed point with
+    10 decimal places, avg_fill with its 20 as a (high, low) int64 pair,
+    times in epoch nanoseconds and the side as int8. Only columns that
+    never change after insert are kept, so matching does not invalidate a
+    snapshot; inserts and deletes do.
+
+    ``slice`` hands the columns to the NumPy engine as they are; ``rows``
+    decodes them for the writes that need Decimals.
+    """
+    DTYPE = np.dtype([
+        ('id', np.int64),
+        ('order_time', np.int64),
+        ('side', np.int8),
+        ('quantity', np.int64),
+        ('price_high', np.int64),
+        ('price_low', np.int64),
+        ('fee', np.int64),
+    ])
+    BUY, SELL = 1, -1
+    SIDES = {BUY: 'Buy', SELL: 'Sell'}
+
+    def __init__(self, trades, version=None):
+        self.trades = trades
+        self.version = version
+        self.id_order = np.argsort(trades['id'], kind='stable')
+
+    @classmethod
+    def load(cls, owner_id, asset_name, version=None):
+        """
+        Read the asset's trades in one query.
+
+        :raises FixedPointError: If a value does not fit the fixed point.
+        """
+        rows = list(TradeUploadBlofin.objects.filter(
+            owner=owner_id, underlying_asset=asset_name, side__in=['Buy', 'Sell']
+        ).order_by('order_time', 'id').values_list(
+            'id', 'order_time', 'side', Coalesce('original_filled_quantity', 'filled_quantity'),
+            'avg_fill', 'fee'
+        ).iterator(chunk_size=2000))
+
+        trades = np.empty(len(rows), dtype=cls.DTYPE)
+        if rows:
+            ids, order_times, sides, quantities, prices, fees = zip(*rows)
+            trades['id'] = ids
+            trades['order_time'] = list(map(to_epoch_ns, order_times))
+            trades['side'] = [cls.BUY if side == 'Buy' else cls.SELL for side in sides]
+            trades['quantity'] = QUANTITY.encode_array(quantities)
+            trades['price_high'], trades['price_low'] = PRICE.encode_wide(prices)
+            trades['fee'] = QUANTITY.encode_array(fees)
+        return cls(trades, version)
+
+    def __len__(self):
+        return len(self.trades)
+
+    def index_of(self, order_time, trade_id, side='left'):
+        """
+        Index of the trade at (order_time, trade_id), or where it would
+        go; ``side='right'`` gives the index just after it.
+        """
+        times = self.trades['order_time']
+        order_time = to_epoch_ns(order_time)
+        start = int(np.searchsorted(times, order_time, side='left'))
+        stop = int(np.searchsorted(times, order_time, side='right'))
+        return start + int(np.searchsorted(self.trades['id'][start:stop], trade_id, side=side))
+
+    def slice(self, start=0, stop=None):
+        """Trades ``start:stop`` as a view of the structured array."""
+        return self.trades[start:stop]
+
+    def rows(self, start=0, stop=None):
+        """
+        Trades ``start:stop`` as (id, side, quantity, order_time, avg_fill,
+        fee) tuples, the rows the matcher reads from the table.
+        """
+        return self.to_rows(self.trades[start:stop])
+
+    def rows_by_id(self, trade_ids):
+        """The rows of the given trades, skipping ids not in the snapshot."""
+        trade_ids = np.asarray(list(trade_ids), dtype=np.int64)
+        sorted_ids = self.trades['id'][self.id_order]
+        if not len(sorted_ids):
+            return []
+        found = np.minimum(np.searchsorted(sorted_ids, trade_ids), len(sorted_ids) - 1)
+        found = found[sorted_ids[found] == trade_ids]
+        return self.to_rows(self.trades[self.id_order[found]])
+
+    @classmethod
+    def to_rows(cls, trades):
+        return list(zip(
+            trades['id'].tolist(),
+            [cls.SIDES[side] for side in trades['side'].tolist()],
+            QUANTITY.decode_list(trades['quantity'].tolist()),
+            map(from_epoch_ns, trades['order_time'].tolist()),
+            PRICE.decode_wide(trades['price_high'], trades['price_low']),
+            QUANTITY.decode_list(trades['fee'].tolist()),
+        ))
+
+
+class TradeSnapshotCache:
+    """
+    Least recently used TradeSnapshots by (owner, asset). An entry is
+    reused while the asset's trade version is unchanged.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, owner_id, asset_name):
+        """
+        :raises FixedPointError: If the asset cannot be held in fixed point.
+        """
+        key = (owner_id, asset_name)
+        version = get_trade_versions().get(owner_id, asset_name)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                snapshot = entry[1]
+                if snapshot is None:
+                    raise FixedPointError(f"Trades of {asset_name} do not fit fixed point.")
+                return snapshot
+
+        try:
+            snapshot = TradeSnapshot.load(owner_id, asset_name, version)
+        except FixedPointError:
+            # Remember the failure so the next call goes straight to the table
+            snapshot = None
+        with self.lock:
+            self.entries[key] = (version, snapshot)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        if snapshot is None:
+            raise FixedPointError(f"Trades of {asset_name} do not fit fixed point.")
+        return snapshot
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_cache = None
+
+
+def get_trade_snapshot(owner_id, asset_name):
+    """
+    The cached snapshot of an owner's asset.
+
+    :raises FixedPointError: If the asset cannot be held in fixed point.
+    """
+    global _cache
+    if _cache is None:
+        _cache = TradeSnapshotCache(getattr(settings, 'TRADE_SNAPSHOT_CACHE_SIZE', 64))
+    return _cache.get(owner_id, asset_name)
@@ -0,0 +1,41 @@
+from .models import UploadJob
+
+# Only the most recent uploads are worth hashing against
+MAX_BASE_CANDIDATES = 5
+
+
+def find_superset_delta(job, blob_store):
+    """
+    Check whether an upload extends a file the owner already ingested.
+
+    BloFin exports grow at one end, so a new export is often an earlier one
+    with rows appended (a byte prefix) or rows inserted after the header
+    (the earlier body is a byte suffix). Returns ``(base_job, ranges)``
+    where ``ranges`` are the byte ranges of the new file that still need
+    ingesting, header included, or ``None`` when there is no such upload.
+    """
+    candidates = UploadJob.objects.filter(
+        owner=job.owner,
+        exchange=job.exchange,
+        status='succeeded',
+        byte_size__gt=0,
+        byte_size__lt=job.byte_size,
+    ).exclude(content_hash='').order_by('-finished_at')[:MAX_BASE_CANDIDATES]
+
+    key = job.content_hash
+    with blob_store.open(key) as mapped:
+        for base in candidates:
+            # Earlier export followed by new rows
+            boundary = mapped[base.byte_size - 1:base.byte_size + 1]
+            if (b'\n' in boundary
+                    and blob_store.hash_range(key, 0, base.byte_size) == base.content_hash):
+                return base, [(0, job.header_size), (base.byte_size, job.byte_size)]
+
+            # New rows between the header and the earlier export's body
+            body_start = job.byte_size - (base.byte_size - base.header_size)
+            if (base.header_size == job.header_size
+                    and mapped[body_start - 1:body_start] == b'\n'
+                    and blob_store.hash_range(key, body_start, job.byte_size) == base.body_hash):
+                return base, [(0, body_start)]
+
+    return None
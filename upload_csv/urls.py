@@ -1,7 +1,9 @@
 from django.urls import path
-from .views import UploadFileView, CsvTradeView, DeleteTradesByFileNameView, FileNameListView, DeleteAllTradesView
+from .views import UploadFileView, CsvTradeView, DeleteTradesByFileNameView, FileNameListView, DeleteAllTradesView, UploadJobStatusView, CancelUploadJobView
 urlpatterns = [
     path('upload/', UploadFileView.as_view(), name='upload-file'),
+    path('upload/jobs/<int:pk>/', UploadJobStatusView.as_view(), name='upload-job-status'),
+    path('upload/jobs/<int:pk>/cancel/', CancelUploadJobView.as_view(), name='upload-job-cancel'),
     path('trades-csv/', CsvTradeView.as_view(), name='csv-trade'),
     path('trades-csv/delete-all/', DeleteAllTradesView.as_view(), name='delete-all-trades'),
     path('filenames/', FileNameListView.as_view(), name='file-names'),
@@ -1 +1,3 @@
-from upload_csv.utils.convert_fields_to_readable import FormattingUtils
\ No newline at end of file
+from upload_csv.utils.convert_fields_to_readable import FormattingUtils
+from upload_csv.utils.trade_fingerprint import build_trade_fingerprint
+from upload_csv.utils.fixed_point import FixedPointCodec, FixedPointError, PRICE, QUANTITY
@@ -74,4 +74,39 @@ class FormattingUtils:
     def format_asset_name(asset_name):
         if asset_name:
             return asset_name.replace('_', ' ').upper()
-        return 'N/A'
\ No newline at end of file
+        return 'N/A'
+
+class BandedFormatter:
+    """
+    ``FormattingUtils.formatted_value`` for many values at once. The
+    decimal places only change at the thresholds of ``get_decimal_places``,
+    so they are worked out once per power of ten and looked up by the
+    value's exponent rather than compared per value.
+    """
+    # get_decimal_places compares against the float 0.01, so the band
+    # holding its exact value is the one the exponent cannot settle
+    SPLIT_BAND = Decimal(0.01).adjusted()
+
+    def __init__(self):
+        self.specs = {}
+
+    def spec(self, value):
+        if not value:
+            return f".{FormattingUtils.get_decimal_places(value)}f"
+        band = value.adjusted()
+        if band == self.SPLIT_BAND:
+            return f".{FormattingUtils.get_decimal_places(value)}f"
+        spec = self.specs.get(band)
+        if spec is None:
+            places = FormattingUtils.get_decimal_places(Decimal(1).scaleb(band))
+            spec = self.specs[band] = f".{places}f"
+        return spec
+
+    def format(self, value, default='N/A'):
+        if value is None:
+            return default
+        value = Decimal(value)
+        return format(value, self.spec(value))
+
+    def format_list(self, values, default='N/A'):
+        return [self.format(value, default) for value in values]
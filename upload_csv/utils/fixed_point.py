@@ -0,0 +1,109 @@
+from decimal import Context, Decimal, MAX_PREC, ROUND_HALF_EVEN
+from itertools import repeat
+import numpy as np
+import operator
+
+
+class FixedPointError(ArithmeticError):
+    """Raised when a value does not fit a fixed-point encoding exactly."""
+
+
+class FixedPointCodec:
+    """
+    Exact conversion between Decimal values with ``places`` decimal places
+    and scaled integers, e.g. Decimal('1.5') <-> 15000000000 at 10 places.
+
+    ``encode`` gives Python ints, which never overflow. ``to_array`` packs
+    them into int64 for NumPy, and values too large for one int64 are
+    split into a (high, low) pair of int64 arrays by ``encode_wide``.
+    """
+    INT64_MAX = np.iinfo(np.int64).max
+    # Base of the wide pairs: value = high * WIDE_BASE + low, 0 <= low < WIDE_BASE
+    WIDE_BASE = 10 ** 18
+    # Scaling never rounds, however many digits a value has
+    CONTEXT = Context(prec=MAX_PREC)
+
+    def __init__(self, places):
+        self.places = places
+        self.scale = 10 ** places
+        self.quantum = Decimal(1).scaleb(-places)
+
+    def encode(self, value, exact=True):
+        return self.encode_list([value], exact)[0]
+
+    def encode_list(self, values, exact=True):
+        """
+        Scale Decimal values to ints.
+
+        :param exact: Raise FixedPointError for values with more decimal
+            places; otherwise round them half to even, like
+            ``Decimal.quantize``.
+        """
+        values = list(values)
+        scaled = list(map(Decimal.scaleb, values, repeat(self.places), repeat(self.CONTEXT)))
+        if not exact:
+            return [int(value.to_integral_value(ROUND_HALF_EVEN)) for value in scaled]
+        fixed = list(map(int, scaled))
+        if not all(map(operator.eq, fixed, scaled)):
+            raise FixedPointError(f"Values have more than {self.places} decimal places.")
+        return fixed
+
+    def decode(self, value):
+        return Decimal(int(value)).scaleb(-self.places, self.CONTEXT)
+
+    def decode_list(self, values):
+        """Decode Python ints, e.g. from ``ndarray.tolist()``."""
+        return list(map(
+            Decimal.scaleb, map(Decimal, values), repeat(-self.places), repeat(self.CONTEXT)))
+
+    def text(self, value):
+        """Format a fixed-point value as a decimal string with every place."""
+        value = int(value)
+        whole, fraction = divmod(abs(value), self.scale)
+        sign = '-' if value < 0 else ''
+        return f"{sign}{whole}.{fraction:0{self.places}d}"
+
+    def text_list(self, values):
+        """``text`` for every value of an int64 array."""
+        values = np.asarray(values, dtype=np.int64)
+        whole, fraction = np.divmod(np.abs(values), self.scale)
+        places = self.places
+        return [
+            f"{'-' if negative else ''}{whole}.{fraction:0{places}d}"
+            for negative, whole, fraction in zip((values < 0).tolist(), whole.tolist(), fraction.tolist())
+        ]
+
+    def to_array(self, fixed):
+        """
+        Pack encoded ints into an int64 array.
+
+        :raises FixedPointError: If a value overflows int64.
+        """
+        try:
+            return np.array(fixed, dtype=np.int64)
+        except OverflowError:
+            raise FixedPointError(f"Values overflow int64 at {self.places} decimal places.")
+
+    def encode_array(self, values, exact=True):
+        """Encode query results or any iterable of Decimals to int64."""
+        return self.to_array(self.encode_list(values, exact))
+
+    def encode_wide(self, values, exact=True):
+        """
+        Encode values too large for one int64 at this scale, such as 20
+        decimal place prices, into (high, low) int64 arrays.
+
+        :raises FixedPointError: If a value overflows the pair.
+        """
+        fixed = self.encode_list(values, exact)
+        high, low = zip(*(divmod(value, self.WIDE_BASE) for value in fixed)) if fixed else ((), ())
+        return self.to_array(high), np.array(low, dtype=np.int64)
+
+    def decode_wide(self, high, low):
+        base = self.WIDE_BASE
+        return self.decode_list([h * base + l for h, l in zip(high.tolist(), low.tolist())])
+
+
+# The model's DecimalField scales: quantities and fees, and avg_fill
+QUANTITY = FixedPointCodec(10)
+PRICE = FixedPointCodec(20)
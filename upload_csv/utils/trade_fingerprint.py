@@ -0,0 +1,25 @@
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+import hashlib
+
+FEE_QUANTUM = Decimal('1E-10')
+AVG_FILL_QUANTUM = Decimal('1E-4')
+
+
+def build_trade_fingerprint(owner_id, order_time, underlying_asset, fee, avg_fill):
+    """
+    Build the stable identity of a trade used to reject duplicate uploads.
+
+    The owner, the UTC order time, the upper-cased asset, the fee at the
+    model's 10 decimal places and avg_fill quantized to the 0.0001 duplicate
+    tolerance are joined and hashed, so the same fill always produces the
+    same 64 character hex digest whatever format it was uploaded in.
+    """
+    parts = [
+        str(owner_id),
+        order_time.astimezone(dt_timezone.utc).isoformat(),
+        underlying_asset.strip().upper(),
+        format(Decimal(fee).quantize(FEE_QUANTUM) + 0, 'f'),
+        format(Decimal(avg_fill).quantize(AVG_FILL_QUANTUM) + 0, 'f'),
+    ]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
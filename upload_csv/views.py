@@ -5,20 +5,44 @@ from rest_framework.response import Response
 from django.utils import timezone
 import pandas as pd
 import time
-from .serializers import FileUploadSerializer, SaveTradeSerializer, FileNameSerializer
+from .serializers import FileUploadSerializer, FastSaveTradeSerializer, FileNameSerializer, UploadJobSerializer
 from django_filters.rest_framework import DjangoFilterBackend
 from upload_csv.exchange.blofin.blofin_csv_handler import BloFinHandler
-from upload_csv.exchange.blofin.csv_processor import CsvProcessor
-from .models import TradeUploadBlofin, FileName
-from .tasks import  process_trade_ids_in_background, process_asset_in_background, process_csv_file_async
-from .trade_matcher import TradeIdMatcher
-from django.db.models import Count
+from .models import TradeUploadBlofin, FileName, UploadJob, IngestedRange, MatchCheckpoint, RoundTrip, LiveTrades
+from .blob_store import BlobStore
+from .coordination import bump_trade_versions
+from .pagination import OptionalKeysetPagination
+from .tasks import process_csv_file_async, release_blob, schedule_matching
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q
+from functools import partial
 import logging
 
 logger = logging.getLogger(__name__) 
 
-class CsvTradeView(generics.ListAPIView):
-    serializer_class = SaveTradeSerializer
+class ValuesListMixin:
+    """
+    List from ``values()`` rows when the serializer names the columns it
+    reads in ``values_fields``, e.g. FastSaveTradeSerializer; other
+    serializers get model instances as usual.
+    """
+
+    def list(self, request, *args, **kwargs):
+        values_fields = getattr(self.get_serializer_class(), 'values_fields', None)
+        if values_fields is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset()).values(*values_fields)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+
+class CsvTradeView(ValuesListMixin, generics.ListAPIView):
+    serializer_class = FastSaveTradeSerializer
     # permission_classes = [IsAuthenticated]
     queryset = TradeUploadBlofin.objects.all().order_by('-order_time')
     filter_backends = [DjangoFilterBackend,
@@ -28,11 +52,13 @@ class CsvTradeView(generics.ListAPIView):
     ordering_fields = ['owner', 'order_time',
                        'underlying_asset', 'side', 'is_open', 'is_matched']
     ordering = ['-order_time']
+    pagination_class = OptionalKeysetPagination
 
 
 class FileNameListView(generics.ListAPIView):
     # permission_classes = [IsAuthenticated]
     serializer_class = FileNameSerializer
+    pagination_class = OptionalKeysetPagination
 
     def get_queryset(self):
         return FileName.objects.all().order_by('file_name')
@@ -54,12 +80,68 @@ class DeleteTradesByFileNameView(generics.DestroyAPIView):
             return Response({"detail": "File not found."}, status=status.HTTP_404_NOT_FOUND)
 
         # Check if the file is currently processing
-        if not force_delete and file_name_entry.cancel_processing:
+        if not force_delete and file_name_entry.processing:
             return Response({"detail": "File is currently processing and cannot be deleted."}, status=status.HTTP_403_FORBIDDEN)
 
         # Allow deletion
-        trade_count, _ = TradeUploadBlofin.objects.filter(file_name=file_name_entry.file_name).delete()
+        trades = TradeUploadBlofin.objects.filter(file_name=file_name_entry.file_name)
+
+        # A later upload ingested as a delta of this file only stored its
+        # extra rows; it holds this file's rows too, so they become its
+        # trades instead of being deleted
+        delta_job = UploadJob.objects.filter(
+            base_job__file_name_entry=file_name_entry, status='succeeded'
+        ).exclude(file_name_entry=file_name_entry).select_related(
+            'file_name_entry').order_by('-finished_at').first()
+        if delta_job:
+            moved = trades.update(file_name=delta_job.file_name_entry.file_name)
+            FileName.objects.filter(id=delta_job.file_name_entry_id).update(
+                trade_count=F('trade_count') + moved)
+            file_name_entry.delete()
+            return Response({
+                "message": f"File '{file_name_entry.file_name}' deleted; its {moved} trades "
+                           f"belong to '{delta_job.file_name_entry.file_name}'."
+            }, status=status.HTTP_204_NO_CONTENT)
+
+        affected = list(trades.order_by().values('owner_id', 'exchange', 'underlying_asset').annotate(
+            earliest=Min('order_time'), latest=Max('order_time')))
+        trade_count, _ = trades.delete()
+        # Other uploads may have found the deleted trades as duplicates, so
+        # re-uploading them must not be short-circuited or ingested as a delta
+        UploadJob.objects.filter(
+            owner=file_name_entry.owner_id, status='succeeded'
+        ).exclude(content_hash='').update(content_hash='', body_hash='')
+        for asset in affected:
+            bump_trade_versions(asset['owner_id'], [asset['underlying_asset']])
+        # Matching after the earliest deleted trade is stale: drop the
+        # checkpoints past it and have the trades from the checkpoint
+        # matching resumes at matched again, even when none came later
+        for asset in affected:
+            checkpoints = MatchCheckpoint.objects.filter(
+                owner=asset['owner_id'], underlying_asset=asset['underlying_asset'])
+            checkpoints.filter(order_time__gte=asset['earliest']).delete()
+            resumed = checkpoints.order_by('order_time', 'trade_id').last()
+            asset_trades = TradeUploadBlofin.objects.filter(
+                owner=asset['owner_id'], underlying_asset=asset['underlying_asset'])
+            if resumed is not None:
+                asset_trades = asset_trades.filter(
+                    Q(order_time__gt=resumed.order_time)
+                    | Q(order_time=resumed.order_time, id__gte=resumed.trade_id))
+            if not asset_trades.update(is_processed=False):
+                # No trades of the asset are left to match
+                RoundTrip.objects.filter(
+                    owner=asset['owner_id'], underlying_asset=asset['underlying_asset']).delete()
+                LiveTrades.objects.filter(
+                    owner=asset['owner_id'], asset=asset['underlying_asset']).delete()
+            # Ranges holding deleted trades are no longer stored in full
+            IngestedRange.objects.filter(
+                owner=asset['owner_id'], exchange=asset['exchange'],
+                underlying_asset=asset['underlying_asset'],
+                first_order_time__lte=asset['latest'],
+                last_order_time__gte=asset['earliest']).delete()
         file_name_entry.delete()
+        if affected:
+            transaction.on_commit(partial(schedule_matching, file_name_entry.owner_id))
 
         return Response({
             "message": f"{trade_count} trades for file '{file_name_entry.file_name}' deleted."
@@ -81,7 +163,17 @@ class DeleteAllTradesView(generics.DestroyAPIView):
                 return Response({"detail": "Cannot delete trades while they are being processed."}, status=status.HTTP_403_FORBIDDEN)
 
         # Delete all trades for the authenticated user
-        trade_count, _ = TradeUploadBlofin.objects.filter(owner=owner).delete()
+        trades = TradeUploadBlofin.objects.filter(owner=owner)
+        asset_names = list(trades.order_by().values_list('underlying_asset', flat=True).distinct())
+        trade_count, _ = trades.delete()
+        bump_trade_versions(owner.id, asset_names)
+        # Earlier uploads no longer describe stored trades, so re-uploads
+        # must not be short-circuited against them
+        UploadJob.objects.filter(owner=owner).delete()
+        IngestedRange.objects.filter(owner=owner).delete()
+        MatchCheckpoint.objects.filter(owner=owner).delete()
+        RoundTrip.objects.filter(owner=owner).delete()
+        LiveTrades.objects.filter(owner=owner).delete()
 
         return Response({
             "message": f"Successfully deleted {trade_count} trades."
@@ -101,7 +193,6 @@ class UploadFileView(generics.CreateAPIView):
         return Response({"detail": "Method 'GET' not allowed."}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
     def post(self, request, *args, **kwargs):
-        start_time = time.time()
         logger.debug("Starting the post request.")
 
         owner = request.user
@@ -109,50 +200,87 @@ class UploadFileView(generics.CreateAPIView):
 
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        
+
         file = serializer.validated_data['file']
         file_name = file.name  # Capture the file name
         logger.debug(f"File name received: {file_name}")
 
         exchange = serializer.validated_data.get('exchange', None)
+        full_reconcile = serializer.validated_data.get('full_reconcile', False)
 
         if exchange != 'BloFin':
             logger.error("Invalid exchange provided.")
             return Response({"error": "Sorry, under construction."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Process the CSV using the CSVProcessor class
-        processor = CsvProcessor(owner, exchange)
-        logger.debug("Processing CSV file.")
-        result = processor.process_csv_file(file, file_name)
+        # Only spool the file here; parsing, dedup, insertion and matching
+        # all run in the worker
+        blob_store = BlobStore()
+        content_hash = blob_store.put(file.chunks())
+
+        previous_job = UploadJob.objects.filter(
+            owner=owner, exchange=exchange, content_hash=content_hash, status='succeeded'
+        ).order_by('-finished_at').first()
+        if previous_job and not full_reconcile:
+            release_blob(blob_store, content_hash)
+            logger.debug(f"File {file_name} matches upload job {previous_job.id}; skipping.")
+            return Response({
+                "status": "duplicate_file",
+                "job_id": previous_job.id,
+                "message": f"File '{file_name}' was already processed: {previous_job.new_trades_count} new trades added, "
+                           f"{previous_job.duplicates_count} duplicates found, {previous_job.canceled_count} canceled trades ignored.",
+                "new_trades_count": previous_job.new_trades_count,
+                "duplicates_count": previous_job.duplicates_count,
+                "canceled_count": previous_job.canceled_count,
+                "covered_count": previous_job.covered_count,
+            }, status=status.HTTP_200_OK)
 
-        if isinstance(result, Response):
-            logger.error("CSV processing error occurred.")
-            return result  # Return early if an error occurred during CSV processing
+        file_name_entry, created = FileName.objects.get_or_create(owner=owner, file_name=file_name)
 
-        new_trades_count, duplicates, canceled_count = result
-        logger.debug(f"New trades count: {new_trades_count}, Duplicates: {duplicates}, Canceled: {canceled_count}")
+        job = UploadJob.objects.create(
+            owner=owner,
+            file_name_entry=file_name_entry,
+            exchange=exchange,
+            content_hash=content_hash,
+            blob_key=content_hash,
+            full_reconcile=full_reconcile,
+        )
+        process_csv_file_async.delay(job.id, content_hash)
+        logger.debug(f"Queued upload job {job.id} for file: {file_name}")
 
+        response_message = {
+            "status": "accepted",
+            "job_id": job.id,
+            "message": f"File '{file_name}' queued for processing.",
+        }
 
-        # Update FileName model
-        file_name_entry, created = FileName.objects.get_or_create(owner=owner, file_name=file_name)
-        file_name_entry.trade_count += new_trades_count
-        file_name_entry.save()
-        logger.debug(f"Updated file name entry: {file_name_entry.file_name}, Trade count: {file_name_entry.trade_count}")
+        return Response(response_message, status=status.HTTP_202_ACCEPTED)
 
-        # Push CSV processing to the background using Celery
-        process_csv_file_async.delay(owner.id, file_name_entry.id, file.read().decode('utf-8'), exchange)
 
+class UploadJobStatusView(generics.RetrieveAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = UploadJobSerializer
 
-        end_time = time.time()  # End timing
-        elapsed_time = end_time - start_time  # Calculate the elapsed time
+    def get_queryset(self):
+        return UploadJob.objects.filter(
+            owner=self.request.user).select_related('file_name_entry')
 
-        response_message = {
-            "status": "success",
-            "message": f"{new_trades_count} new trades added, {duplicates} duplicates found, {canceled_count} canceled trades ignored.",
-            "time_taken": f"{elapsed_time:.2f} seconds"
-        }
 
-        logger.debug(f"Response message: {response_message}")
-        return Response(response_message, status=status.HTTP_201_CREATED)
+class CancelUploadJobView(generics.GenericAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = UploadJobSerializer
+
+    def get_queryset(self):
+        return UploadJob.objects.filter(owner=self.request.user)
+
+    def post(self, request, *args, **kwargs):
+        job = self.get_object()
+
+        # Only this job stops, at its next chunk boundary; other uploads of
+        # the same file and a matching pass it shares run on
+        requested = UploadJob.objects.filter(
+            id=job.id, status__in=('queued', 'running')).update(status='canceling')
+        if not requested:
+            job.refresh_from_db(fields=['status'])
+            return Response({"detail": f"Upload job is already {job.status}."}, status=status.HTTP_409_CONFLICT)
 
-    
\ No newline at end of file
+        return Response({"detail": "Cancellation requested."}, status=status.HTTP_202_ACCEPTED)